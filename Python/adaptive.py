@@ -0,0 +1,38 @@
+import numpy as np
+from photons import Photons
+
+def propagateUntilPrecision(material, relativeError, region=None, batchSize=1000,
+                            minBatches=10, maxPhotons=None, callback=None) -> int:
+    """ Propagate batches of photons in material until the relative error
+    (standard error/mean, estimated from the scatter between batches)
+    is below relativeError in region: every voxel of region (an index
+    of the grid, see Stats.relativeError) or the total absorbed energy
+    if region is None. At least minBatches batches are done, since the
+    error estimated from a few batches is itself very uncertain, and
+    at most maxPhotons photons. maxPhotons is required with a region:
+    the error of a voxel that photons never reach stays infinite, and the
+    run would never end. callback(stats, photonsDone), if given, is
+    called after every batch.
+
+    Returns the number of photons propagated. """
+    stats = material.stats
+    if stats is None:
+        raise ValueError("material.stats must be set to collect the results")
+    if region is not None and maxPhotons is None:
+        raise ValueError("maxPhotons is required with a region")
+
+    stats.startBatches()
+    photonsDone = 0
+    while maxPhotons is None or photonsDone < maxPhotons:
+        N = batchSize if maxPhotons is None else min(batchSize, maxPhotons-photonsDone)
+        photons = Photons(N=N)
+        photons.propagate(material)
+        stats.endBatch(N)
+        photonsDone += N
+
+        if callback is not None:
+            callback(stats, photonsDone)
+        if stats.voxelBatches.count >= minBatches and stats.relativeError(region) <= relativeError:
+            break
+
+    return photonsDone
@@ -0,0 +1,167 @@
+""" Reference scenarios with fixed seeds to follow the speed of the
+engine from one commit to the next:
+
+    python benchmark.py --output benchmark.json
+    python benchmark.py --compare benchmark-old.json --mcml ../C-mcml/mcml
+
+Every scenario reports photons/s, the time spent in each stage of the
+propagation (with a Profiler), the peak memory allocated while
+propagating one batch and its physical results, so that a change in
+speed can be told apart from a change in what is computed. """
+import numpy as np
+import os
+import json
+import time
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+from material import Material
+from photon import Photon
+from photons import Photons
+from layers import LayerStack
+from sweep import Sweep, mciText
+from profiler import Profiler
+from mco import readMCO
+from stats import Stats
+
+scenarios = {
+    'default': {'engine':'photons', 'mu_s':30, 'mu_a':0.5, 'g':0.8, 'photons':10000},
+    'highAlbedo': {'engine':'photons', 'mu_s':100, 'mu_a':0.1, 'g':0.9, 'photons':2000},
+    # Same as C-mcml/input.mci (mcml uses musx for mus)
+    'mcmlInput': {'engine':'layers', 'n':1.4, 'mu_s':30, 'mu_a':0.01, 'g':0.85, 'd':1.0, 'photons':2000},
+}
+
+def runScenario(name, photons=None, seed=1, batchSize=1000) -> dict:
+    scenario = dict(scenarios[name])
+    if photons is not None:
+        scenario['photons'] = photons
+    N = scenario['photons']
+
+    np.random.seed(seed)
+    if scenario['engine'] == 'photons':
+        result = _runPhotons(scenario, N, batchSize)
+    else:
+        result = _runLayers(scenario, N)
+
+    np.random.seed(seed)
+    tracemalloc.start()
+    if scenario['engine'] == 'photons':
+        _runPhotons(scenario, min(N, batchSize), batchSize)
+    else:
+        _runLayers(scenario, min(N, 100))
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result['scenario'] = scenario
+    result['peakMemory'] = peak
+    return result
+
+def _runPhotons(scenario, N, batchSize) -> dict:
+    material = Material(mu_s=scenario['mu_s'], mu_a=scenario['mu_a'], g=scenario['g'])
+    material.stats = Stats(min=(-2,-2,-2), max=(2,2,2), size=(41,41,41))
+    profiler = Profiler(sampleEvery=1)
+
+    startTime = time.perf_counter()
+    for i in range(0, N, batchSize):
+        Photons(N=min(batchSize, N-i)).propagate(material, profiler)
+    elapsed = time.perf_counter() - startTime
+
+    return {'photons':N, 'seconds':elapsed, 'photonsPerSecond':N/elapsed,
+            'profile':profiler.summary(),
+            'results':{'absorbed':float(material.stats.energy.sum()/N)}}
+
+def _runLayers(scenario, N) -> dict:
+    material = Material(mu_s=scenario['mu_s'], mu_a=scenario['mu_a'], g=scenario['g'], index=scenario['n'])
+    stack = LayerStack.withThicknesses([material], [scenario['d']])
+    profiler = Profiler(sampleEvery=10)
+
+    startTime = time.perf_counter()
+    for i in range(N):
+        stack.propagate(Photon(), profiler)
+    elapsed = time.perf_counter() - startTime
+
+    return {'photons':N, 'seconds':elapsed, 'photonsPerSecond':N/elapsed,
+            'profile':profiler.summary(),
+            'results':{'Rd':stack.diffuseReflectance, 'A':stack.absorbance, 'Tt':stack.transmittance}}
+
+def runMCML(mcml, name='mcmlInput', photons=None) -> dict:
+    """ The compiled mcml on the same input as a 'layers' scenario """
+    scenario = dict(scenarios[name])
+    N = photons if photons is not None else scenario['photons']
+    parameters = dict(Sweep.defaults)
+    parameters.update({'n':scenario['n'], 'mua':scenario['mu_a'], 'musx':scenario['mu_s'],
+                       'musz':scenario['mu_s'], 'g':scenario['g'], 'd':scenario['d'], 'photons':N})
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "benchmark.mci"), "w") as file:
+            file.write(mciText(parameters, "benchmark.mco"))
+        startTime = time.perf_counter()
+        subprocess.run([os.path.abspath(mcml), "benchmark.mci"], cwd=directory, check=True,
+                       stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - startTime
+        output = readMCO(os.path.join(directory, "benchmark.mco"))
+
+    return {'photons':N, 'seconds':elapsed, 'photonsPerSecond':N/elapsed,
+            'results':{'Rd':float(output.diffuseReflectance), 'A':float(output.absorbance), 'Tt':float(output.transmittance)}}
+
+def runBenchmarks(names=None, photons=None, mcml=None) -> dict:
+    names = list(scenarios) if names is None else names
+    report = {'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+              'commit': _gitCommit(),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'machine': platform.platform(),
+              'scenarios': {}}
+    for name in names:
+        report['scenarios'][name] = runScenario(name, photons=photons)
+    if mcml is not None:
+        report['mcml'] = runMCML(mcml, photons=photons)
+    return report
+
+def compareBenchmarks(before, after) -> str:
+    """ Speed ratios of two reports (dicts or JSON files) """
+    if isinstance(before, str):
+        with open(before, "r") as file:
+            before = json.load(file)
+    if isinstance(after, str):
+        with open(after, "r") as file:
+            after = json.load(file)
+
+    lines = []
+    for name, result in after['scenarios'].items():
+        if name in before['scenarios']:
+            ratio = result['photonsPerSecond']/before['scenarios'][name]['photonsPerSecond']
+            lines.append("{0:12s} {1:10.0f} photons/s ({2:+.0f}%)".format(name, result['photonsPerSecond'], 100*(ratio-1)))
+    return "\n".join(lines)
+
+def _gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the Python engine on reference scenarios")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file for the results")
+    parser.add_argument("--photons", type=int, default=None, help="Photons per scenario (default: per scenario)")
+    parser.add_argument("--scenario", action="append", choices=list(scenarios), help="Scenarios to run (default: all)")
+    parser.add_argument("--mcml", default=None, help="Path to the compiled mcml, to compare on the same input")
+    parser.add_argument("--compare", default=None, help="Previous JSON results to compare with")
+    args = parser.parse_args()
+
+    report = runBenchmarks(args.scenario, photons=args.photons, mcml=args.mcml)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    for name, result in report['scenarios'].items():
+        print("{0:12s} {1:10.0f} photons/s {2:8.1f} MB peak  {3}".format(name, result['photonsPerSecond'],
+              result['peakMemory']/1e6, result['results']))
+        fractions = result['profile']['fractions']
+        print(" "*13 + "  ".join("{0} {1:.0f}%".format(stage, 100*f) for stage, f in fractions.items() if f > 0))
+    if 'mcml' in report:
+        print("{0:12s} {1:10.0f} photons/s  {2}".format("mcml (C)", report['mcml']['photonsPerSecond'], report['mcml']['results']))
+    if args.compare is not None:
+        print(compareBenchmarks(args.compare, report))
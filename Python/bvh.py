@@ -0,0 +1,170 @@
+import math
+from vector import Vector
+from geometry import Object
+
+class BVHNode:
+    """ A node of the bounding volume hierarchy: a box that contains all
+    the objects below it. Leaves hold at most maxLeafSize objects, other
+    nodes have a leftNode and a rightNode (like KDTNode in the Swift
+    version, except the objects are never split between the two sides). """
+    maxLeafSize = 4
+
+    def __init__(self, objects):
+        self.boundingBoxMin = Vector(min(o.boundingBoxMin.x for o in objects),
+                                     min(o.boundingBoxMin.y for o in objects),
+                                     min(o.boundingBoxMin.z for o in objects))
+        self.boundingBoxMax = Vector(max(o.boundingBoxMax.x for o in objects),
+                                     max(o.boundingBoxMax.y for o in objects),
+                                     max(o.boundingBoxMax.z for o in objects))
+        self.leftNode = None
+        self.rightNode = None
+        self.objects = []
+
+        if len(objects) <= self.maxLeafSize:
+            self.objects = list(objects)
+            return
+
+        # Median split of the centers along the axis where they spread the most
+        centers = [_center(o) for o in objects]
+        spreads = [max(c[axis] for c in centers) - min(c[axis] for c in centers) for axis in range(3)]
+        axis = spreads.index(max(spreads))
+        if spreads[axis] == 0:
+            self.objects = list(objects)
+            return
+
+        order = sorted(range(len(objects)), key=lambda i: centers[i][axis])
+        half = len(objects)//2
+        self.leftNode = BVHNode([objects[i] for i in order[:half]])
+        self.rightNode = BVHNode([objects[i] for i in order[half:]])
+
+    @property
+    def isLeaf(self) -> bool:
+        return self.leftNode is None
+
+class BoundingVolumeHierarchy:
+    """ Finds the object a point is in and the distance to the next
+    surface along a ray without testing every object: the objects are
+    sorted in a tree of boxes (BVHNode), and a whole branch is skipped
+    when its box does not contain the point or is farther than the
+    closest surface found so far. Both queries take about
+    log(number of objects) box tests.
+
+    Objects are axis-aligned boxes (Cube, InfiniteLayer or any Object with
+    a bounding box). When objects are nested (placeInto), objectAt
+    returns the innermost one. The hierarchy must be rebuilt if objects
+    are moved. """
+    def __init__(self, objects):
+        self.objects = list(objects)
+        self.depth = {id(o): _depth(o) for o in self.objects}
+        self.root = BVHNode(self.objects) if self.objects else None
+
+    @classmethod
+    def withScene(cls, world):
+        """ All the objects placed (recursively) into world """
+        objects = []
+        containers = [world]
+        while containers:
+            container = containers.pop()
+            objects.extend(container.objects)
+            containers.extend(container.objects)
+        return cls(objects)
+
+    def objectAt(self, position) -> Object:
+        """ The innermost object that contains position, or None """
+        found = None
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node = nodes.pop()
+            if not _boxContains(node.boundingBoxMin, node.boundingBoxMax, position):
+                continue
+            if node.isLeaf:
+                for o in node.objects:
+                    if o.contains(position):
+                        if found is None or self.depth[id(o)] > self.depth[id(found)]:
+                            found = o
+            else:
+                nodes.append(node.leftNode)
+                nodes.append(node.rightNode)
+        return found
+
+    def distanceToBoundary(self, position, direction) -> (float, Object):
+        """ Distance from position along direction to the closest surface
+        (entering or leaving) of any object, and that object. Returns
+        (math.inf, None) if the ray hits nothing. """
+        inverse = tuple(1.0/d if d != 0 else math.inf for d in (direction.x, direction.y, direction.z))
+        origin = (position.x, position.y, position.z)
+
+        closest = math.inf
+        closestObject = None
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node = nodes.pop()
+            interval = _rayBox(origin, inverse, node.boundingBoxMin, node.boundingBoxMax)
+            if interval is None or max(interval[0], 0) >= closest:
+                continue
+            if node.isLeaf:
+                for o in node.objects:
+                    interval = _rayBox(origin, inverse, o.boundingBoxMin, o.boundingBoxMax)
+                    if interval is None:
+                        continue
+                    (tNear, tFar) = interval
+                    d = tNear if tNear > 0 else tFar
+                    if 0 < d < closest:
+                        closest = d
+                        closestObject = o
+            else:
+                # Visit the closest child first (it is popped first)
+                left = _rayBox(origin, inverse, node.leftNode.boundingBoxMin, node.leftNode.boundingBoxMax)
+                right = _rayBox(origin, inverse, node.rightNode.boundingBoxMin, node.rightNode.boundingBoxMax)
+                if left is not None and right is not None and right[0] < left[0]:
+                    nodes.append(node.leftNode)
+                    nodes.append(node.rightNode)
+                else:
+                    nodes.append(node.rightNode)
+                    nodes.append(node.leftNode)
+        return (closest, closestObject)
+
+def _center(o) -> tuple:
+    # Centers of infinite objects are taken at 0 on the infinite axes
+    center = []
+    for a, b in ((o.boundingBoxMin.x, o.boundingBoxMax.x),
+                 (o.boundingBoxMin.y, o.boundingBoxMax.y),
+                 (o.boundingBoxMin.z, o.boundingBoxMax.z)):
+        center.append((a+b)/2 if math.isfinite(a) and math.isfinite(b) else 0.0)
+    return tuple(center)
+
+def _depth(o) -> int:
+    depth = 0
+    while o.container is not None:
+        o = o.container
+        depth += 1
+    return depth
+
+def _boxContains(boxMin, boxMax, position) -> bool:
+    return (boxMin.x <= position.x <= boxMax.x and
+            boxMin.y <= position.y <= boxMax.y and
+            boxMin.z <= position.z <= boxMax.z)
+
+def _rayBox(origin, inverse, boxMin, boxMax):
+    """ Slab test: (tNear, tFar) of the ray in the box, or None if the
+    ray misses it or the box is behind """
+    tNear = -math.inf
+    tFar = math.inf
+    for r, inv, a, b in zip(origin, inverse, (boxMin.x, boxMin.y, boxMin.z), (boxMax.x, boxMax.y, boxMax.z)):
+        if inv == math.inf: # Parallel to this slab
+            if r < a or r > b:
+                return None
+            continue
+        t1 = (a - r)*inv
+        t2 = (b - r)*inv
+        if t1 > t2:
+            (t1, t2) = (t2, t1)
+        if t1 > tNear:
+            tNear = t1
+        if t2 < tFar:
+            tFar = t2
+        if tNear > tFar:
+            return None
+    if tFar < 0:
+        return None
+    return (tNear, tFar)
@@ -0,0 +1,165 @@
+import numpy as np
+import os
+import json
+import time
+import glob
+from stats import openAtomically
+from photon import Photon
+
+class Checkpoint:
+    """ Periodic saves of a running simulation, to resume it exactly where
+    it was if the process dies:
+
+        checkpoint = Checkpoint("output.checkpoint", mat.stats, interval=60)
+        photonsDone = checkpoint.resume() # 0 if there is no checkpoint
+        while photonsDone < N:
+            Photons(N=batchSize).propagate(mat)
+            photonsDone += batchSize
+            checkpoint.update(photonsDone)
+        checkpoint.remove()
+
+    A checkpoint is made of a base file (a complete Stats.save) and of
+    delta files with only the blocks of the grid that changed since the
+    previous checkpoint (Stats.dirtyBlocks), so the cost of a flush
+    depends on what changed and not on the size of the grid. The
+    counts, the state of the random generator and the list of files
+    are in checkpoint.json, which is written last: every file is
+    written with openAtomically (flushed to the disk, then renamed), so
+    a checkpoint is either complete or not there at all. When the deltas get as
+    large as the grid, a new base replaces them.
+
+    Resuming restores the grid, the counts, the photon ids and the
+    random state: the simulation continues with the same photons as if
+    it had never stopped, provided the checkpoints are made between
+    batches of photons (as update() is meant to be called). """
+    manifestName = "checkpoint.json"
+
+    def __init__(self, directory, stats, interval=60, maxDeltas=20, profiler=None):
+        self.directory = directory
+        self.stats = stats
+        self.profiler = profiler # Its summary is saved with each checkpoint
+        self.interval = interval
+        self.maxDeltas = maxDeltas
+        self.lastFlush = time.monotonic()
+        self.sequence = 0
+        self.base = None
+        self.deltas = []
+        self.deltaBytes = 0
+
+    @property
+    def manifestPath(self) -> str:
+        return os.path.join(self.directory, self.manifestName)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.manifestPath)
+
+    def update(self, photonsDone) -> bool:
+        """ Flush if the last checkpoint is older than interval seconds """
+        if time.monotonic() - self.lastFlush < self.interval:
+            return False
+        self.flush(photonsDone)
+        return True
+
+    def flush(self, photonsDone):
+        os.makedirs(self.directory, exist_ok=True)
+        stats = self.stats
+        self.sequence += 1
+        obsoleteFiles = []
+
+        if self.base is None or len(self.deltas) >= self.maxDeltas or self.deltaBytes >= stats.nbytes:
+            obsoleteFiles = [self.base] + self.deltas if self.base is not None else []
+            self.base = "base-{0:06d}.stats".format(self.sequence)
+            stats.save(os.path.join(self.directory, self.base))
+            self.deltas = []
+            self.deltaBytes = 0
+        elif stats.dirtyBlocks.any():
+            delta = "delta-{0:06d}.npz".format(self.sequence)
+            self.deltaBytes += self.writeDelta(os.path.join(self.directory, delta))
+            self.deltas.append(delta)
+        stats.clearDirtyBlocks()
+
+        (generator, keys, position, hasGauss, cachedGaussian) = np.random.get_state()
+        manifest = {"sequence": self.sequence,
+                    "base": self.base,
+                    "deltas": self.deltas,
+                    "photonsDone": int(photonsDone),
+                    "photonCount": int(stats.photonCount),
+                    "eventCount": int(stats.eventCount),
+                    "overflow": float(stats.overflow),
+                    "overflowCount": int(stats.overflowCount),
+                    "nextUniqueId": int(Photon.nextUniqueId),
+                    "randomState": [generator, keys.tolist(), int(position), int(hasGauss), float(cachedGaussian)]}
+        if self.profiler is not None:
+            manifest["profile"] = self.profiler.summary()
+        with openAtomically(self.manifestPath) as file:
+            file.write(json.dumps(manifest).encode())
+
+        for filename in obsoleteFiles:
+            os.remove(os.path.join(self.directory, filename))
+        self.lastFlush = time.monotonic()
+
+    def writeDelta(self, filepath) -> int:
+        """ The current values of the dirty blocks, and their indices """
+        stats = self.stats
+        b = stats.blockSize
+        blocks = np.argwhere(stats.dirtyBlocks)
+        values = [np.ravel(stats.block(i, j, k)) for (i, j, k) in blocks]
+        values = np.concatenate(values)
+
+        with openAtomically(filepath) as file:
+            np.savez(file, blockSize=b, blocks=blocks, values=values)
+        return values.nbytes
+
+    def readDelta(self, filepath):
+        stats = self.stats
+        with np.load(filepath) as data:
+            if int(data["blockSize"]) != stats.blockSize:
+                raise ValueError("{0} has blocks of another size".format(filepath))
+            values = data["values"]
+            start = 0
+            for (i, j, k) in data["blocks"]:
+                block = stats.block(i, j, k)
+                block[...] = values[start:start+block.size].reshape(block.shape)
+                start += block.size
+
+    def resume(self) -> int:
+        """ Restore the last checkpoint into stats and the random state.
+        Returns the number of photons done, 0 if there is no checkpoint. """
+        if not self.exists():
+            return 0
+
+        with open(self.manifestPath, "r") as file:
+            manifest = json.load(file)
+
+        stats = self.stats
+        stats.restore(os.path.join(self.directory, manifest["base"]))
+        for delta in manifest["deltas"]:
+            self.readDelta(os.path.join(self.directory, delta))
+        stats.photonCount = manifest["photonCount"]
+        stats.eventCount = manifest["eventCount"]
+        stats.overflow = manifest["overflow"]
+        stats.overflowCount = manifest["overflowCount"]
+        stats.clearDirtyBlocks()
+
+        (generator, keys, position, hasGauss, cachedGaussian) = manifest["randomState"]
+        np.random.set_state((generator, np.array(keys, dtype=np.uint32), position, hasGauss, cachedGaussian))
+        Photon.nextUniqueId = manifest["nextUniqueId"]
+        if self.profiler is not None and "profile" in manifest:
+            self.profiler.restore(manifest["profile"])
+
+        self.sequence = manifest["sequence"]
+        self.base = manifest["base"]
+        self.deltas = list(manifest["deltas"])
+        self.deltaBytes = sum(os.path.getsize(os.path.join(self.directory, delta)) for delta in self.deltas)
+        self.lastFlush = time.monotonic()
+        return manifest["photonsDone"]
+
+    def remove(self):
+        """ Delete the checkpoint (e.g. when the run is complete) """
+        if self.exists():
+            os.remove(self.manifestPath)
+        for filepath in glob.glob(os.path.join(self.directory, "base-*.stats")) + glob.glob(os.path.join(self.directory, "delta-*.npz")):
+            os.remove(filepath)
+        self.base = None
+        self.deltas = []
+        self.deltaBytes = 0
@@ -0,0 +1,86 @@
+""" Command line to propagate photons in a single material and save the
+energy absorbed:
+
+    python montecarlo.py --photons 100000 --mus 30 --mua 0.5 --g 0.8
+    python montecarlo.py --photons 1000 --monitor --show
+
+Nothing is drawn unless --monitor (live display in another process) or
+--show (at the end) is given, and matplotlib is not even imported, so
+it runs as is on nodes without a display. An existing output file is
+continued, and so is an interrupted run (from its checkpoint). """
+import numpy as np
+import argparse
+import os
+import time
+from stats import Stats
+from material import Material
+from photons import Photons
+from checkpoint import Checkpoint
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Propagate photons in a material and save the energy absorbed")
+    parser.add_argument("--photons", type=int, default=1000, help="Number of photons")
+    parser.add_argument("--mus", type=float, default=30, help="Scattering coefficient [1/cm]")
+    parser.add_argument("--mua", type=float, default=0.5, help="Absorption coefficient [1/cm]")
+    parser.add_argument("--g", type=float, default=0.8, help="Anisotropy")
+    parser.add_argument("--index", type=float, default=1.0, help="Index of refraction")
+    parser.add_argument("--min", type=float, nargs=3, default=(-2, -2, -2), help="Corner of the grid [cm]")
+    parser.add_argument("--max", type=float, nargs=3, default=(2, 2, 2), help="Opposite corner of the grid [cm]")
+    parser.add_argument("--size", type=int, nargs=3, default=(41, 41, 41), help="Voxels along x, y and z")
+    parser.add_argument("--batch-size", type=int, default=100, help="Photons propagated together")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the random generator")
+    parser.add_argument("--output", default="output.stats", help="Stats file, continued if it exists")
+    parser.add_argument("--checkpoint", default="output.checkpoint", help="Checkpoint of the run")
+    parser.add_argument("--interval", type=float, default=60, help="Seconds between checkpoints")
+    parser.add_argument("--monitor", action="store_true", help="Live display of the energy")
+    parser.add_argument("--show", action="store_true", help="Draw the energy at the end")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parseArguments(argv)
+    N = args.photons
+    if args.seed is not None:
+        np.random.seed(args.seed)
+
+    material = Material(mu_s=args.mus, mu_a=args.mua, g=args.g, index=args.index)
+    if os.path.exists(args.output):
+        material.stats.restore(args.output)
+    else:
+        material.stats = Stats(min=tuple(args.min), max=tuple(args.max), size=tuple(args.size))
+
+    # The live display is drawn by another process, the simulation only
+    # publishes a copy of the energy from time to time
+    monitor = None
+    if args.monitor:
+        from monitor import Monitor
+        monitor = Monitor(material.stats, plot='show2D', plane='xz', integratedAlong='y')
+
+    # If a previous run was interrupted, continue it from its last checkpoint
+    checkpoint = Checkpoint(args.checkpoint, material.stats, interval=args.interval)
+    photonsDone = checkpoint.resume()
+
+    startTime = time.time()
+    batchSize = args.batch_size
+    while photonsDone < N:
+        photons = Photons(N=min(batchSize, N-photonsDone))
+        photons.propagate(material)
+        photonsDone += photons.N
+        print("Photon {0}/{1}".format(photonsDone, N))
+        if monitor is not None:
+            monitor.publish(material.stats)
+        checkpoint.update(photonsDone=photonsDone)
+
+    elapsed = time.time() - startTime
+    print('{0:.1f} s for {2} photons, {1:.1f} ms per photon'.format(elapsed, elapsed/N*1000, N))
+
+    if monitor is not None:
+        monitor.close()
+
+    material.stats.save(args.output)
+    checkpoint.remove()
+    if args.show:
+        material.stats.show2D(plane='xz', integratedAlong='y', title="{0} photons".format(N), realtime=False)
+        material.stats.show1D(axis='z', integratedAlong='xy', title="{0} photons".format(N), realtime=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import numpy as np
+import math
+import os
+from stats import encodeHeader, readHeader, HEADER_SIZE
+
+_magic = b"MCEXITS\n"
+
+class Detector:
+    """ Records every photon that leaves the medium through a surface in a
+    binary file (position, direction, weight, path lengths and id, one
+    fixed-size record of recordType each), to model fibres, cameras or
+    any detector after the simulation. It is used like the exit tallies:
+    as the reflectanceTally or transmittanceTally of a LayerStack, or the
+    exitTally of a VoxelVolume.
+
+    Records are kept in a buffer of bufferSize records and appended to
+    the file when it is full (and by flush() or close()), so the file
+    only grows by whole blocks and a run that stops loses at most one
+    buffer. An existing file is appended to: several runs can write the
+    same file one after the other.
+
+    Photons can be filtered when captured: only those within the
+    numerical aperture (index*sin(theta) <= numericalAperture, theta
+    from the normal of the surface, the z axis) and within radius of
+    center (in x and y) are written. The others are only counted. """
+    recordType = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+                           ('ux', '<f4'), ('uy', '<f4'), ('uz', '<f4'),
+                           ('weight', '<f4'), ('pathLength', '<f4'), ('opticalPathLength', '<f4'),
+                           ('uniqueId', '<i8')])
+    binaryFormat = 1
+
+    def __init__(self, filepath="exits.bin", numericalAperture=None, index=1.0, center=(0, 0), radius=None, bufferSize=65536):
+        self.filepath = filepath
+        self.numericalAperture = numericalAperture
+        self.index = index
+        self.center = tuple(center)
+        self.radius = radius
+        self.buffer = np.zeros(bufferSize, dtype=self.recordType)
+        self.bufferCount = 0
+        self.recordCount = 0 # Written or in the buffer, by this detector
+        self.rejectedCount = 0
+        self.weight = 0.0 # Of the records
+
+        if os.path.exists(filepath):
+            header = readHeader(filepath, _magic)
+            if header is None or np.dtype([tuple(field) for field in header["dtype"]]) != self.recordType:
+                raise ValueError("{0} is not a file of exit records".format(filepath))
+        else:
+            with open(filepath, "wb") as write_file:
+                write_file.write(encodeHeader(self._header(), _magic))
+
+    def _header(self) -> dict:
+        return {"format":Detector.binaryFormat, "dtype":[list(field) for field in self.recordType.descr],
+                "numericalAperture":self.numericalAperture, "index":self.index,
+                "center":list(self.center), "radius":self.radius}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def accepts(self, photon) -> bool:
+        if self.numericalAperture is not None:
+            uz = photon.ez.z
+            if self.index*math.sqrt(max(1-uz*uz, 0)) > self.numericalAperture:
+                return False
+        if self.radius is not None:
+            dx = photon.r.x - self.center[0]
+            dy = photon.r.y - self.center[1]
+            if dx*dx + dy*dy > self.radius*self.radius:
+                return False
+        return True
+
+    def acceptsMany(self, positions, directions) -> np.ndarray:
+        accepted = np.ones(len(positions.x), dtype=bool)
+        if self.numericalAperture is not None:
+            uz = directions.z
+            accepted &= self.index*np.sqrt(np.maximum(1-uz*uz, 0)) <= self.numericalAperture
+        if self.radius is not None:
+            dx = positions.x - self.center[0]
+            dy = positions.y - self.center[1]
+            accepted &= dx*dx + dy*dy <= self.radius*self.radius
+        return accepted
+
+    def score(self, photon, weight):
+        if not self.accepts(photon):
+            self.rejectedCount += 1
+            return
+        if self.bufferCount == len(self.buffer):
+            self.flush()
+        record = self.buffer[self.bufferCount]
+        (r, u) = (photon.r, photon.ez)
+        record['x'] = r.x
+        record['y'] = r.y
+        record['z'] = r.z
+        record['ux'] = u.x
+        record['uy'] = u.y
+        record['uz'] = u.z
+        record['weight'] = weight
+        record['pathLength'] = photon.pathLength
+        record['opticalPathLength'] = photon.opticalPathLength
+        record['uniqueId'] = photon.uniqueId
+        self.bufferCount += 1
+        self.recordCount += 1
+        self.weight += weight
+
+    def scoreMany(self, photons, weights):
+        """ Records the Photons that leave, with their weights """
+        weights = np.broadcast_to(np.asarray(weights, dtype=float), (photons.count,))
+        accepted = self.acceptsMany(photons.r, photons.ez)
+        self.rejectedCount += int(np.count_nonzero(~accepted))
+        n = int(np.count_nonzero(accepted))
+        if n == 0:
+            return
+
+        records = np.zeros(n, dtype=self.recordType)
+        for field, values in (('x', photons.r.x), ('y', photons.r.y), ('z', photons.r.z),
+                              ('ux', photons.ez.x), ('uy', photons.ez.y), ('uz', photons.ez.z),
+                              ('weight', weights), ('pathLength', photons.pathLength),
+                              ('opticalPathLength', photons.opticalPathLength), ('uniqueId', photons.uniqueId)):
+            records[field] = np.asarray(values)[accepted]
+        self.recordCount += n
+        self.weight += float(np.sum(records['weight'], dtype=float))
+
+        while len(records) > 0:
+            if self.bufferCount == len(self.buffer):
+                self.flush()
+            m = min(len(records), len(self.buffer) - self.bufferCount)
+            self.buffer[self.bufferCount:self.bufferCount+m] = records[:m]
+            self.bufferCount += m
+            records = records[m:]
+
+    def flush(self):
+        """ Append the records of the buffer to the file """
+        if self.bufferCount == 0:
+            return
+        with open(self.filepath, "ab") as append_file:
+            self.buffer[:self.bufferCount].tofile(append_file)
+        self.bufferCount = 0
+
+    def close(self):
+        self.flush()
+
+def exitRecordCount(filepath) -> int:
+    """ Number of complete records in a file written by a Detector """
+    return (os.path.getsize(filepath) - HEADER_SIZE)//Detector.recordType.itemsize
+
+def readExits(filepath, chunkSize=1000000):
+    """ The records of a file written by a Detector, as structured arrays
+    of at most chunkSize records: the file is read one chunk at a time,
+    so it can be processed in constant memory whatever its size. For
+    example, the weight collected by a fibre of NA 0.22:
+
+        collected = 0
+        for records in readExits("exits.bin"):
+            sint = np.sqrt(1 - records['uz']**2)
+            collected += records['weight'][sint <= 0.22].sum()
+
+    A partial record at the end (a run that stopped while writing) is
+    ignored. """
+    header = readHeader(filepath, _magic)
+    if header is None:
+        raise ValueError("{0} is not a file of exit records".format(filepath))
+    dtype = np.dtype([tuple(field) for field in header["dtype"]])
+    remaining = (os.path.getsize(filepath) - HEADER_SIZE)//dtype.itemsize
+    with open(filepath, "rb") as read_file:
+        read_file.seek(HEADER_SIZE)
+        while remaining > 0:
+            records = np.fromfile(read_file, dtype=dtype, count=min(chunkSize, remaining))
+            if len(records) == 0:
+                return
+            remaining -= len(records)
+            yield records
@@ -1,24 +1,25 @@
-from vector import *
+import math
+from vector import Vector
 
 class Object:
-    def __init__(self, origin=Vector(0,0,0), material=Material(0,0,0)):
+    def __init__(self, origin=Vector(0,0,0), material=None):
         self.origin = origin # Global coordinates
         self.material = material
-        self.boudingBoxMin = None # Local coordinates
-        self.boudingBoxMax = None # Local coordinates
+        self.boundingBoxMin = None # Global coordinates
+        self.boundingBoxMax = None # Global coordinates
         self.objects = []
         self.container = None
 
     def placeInto(self, container, position):
         # position in local coordinates of container
-        self.translate(container.origin + position) 
+        self.translateBy(container.origin + position - self.origin)
         self.container = container
-        container.append(self)
+        container.objects.append(self)
 
-    def translateBy(self, position:Vector)
-        self.boundingBoxMin = self.boundingBoxMin - self.origin + position 
-        self.boundingBoxMax = self.boundingBoxMax - self.origin + position 
-        self.origin += position
+    def translateBy(self, position:Vector):
+        self.boundingBoxMin = self.boundingBoxMin + position
+        self.boundingBoxMax = self.boundingBoxMax + position
+        self.origin = self.origin + position
 
     def contains(self, position) -> bool:
         if position.x < self.boundingBoxMin.x or position.x > self.boundingBoxMax.x:
@@ -31,18 +32,20 @@ class Object:
         return True
 
 class Cube(Object):
-    def __init__(self, side, origin=Vector(0,0,0), material=Material(0,0,0)):
+    def __init__(self, side, origin=Vector(0,0,0), material=None):
         self.side = side
-        Object.__init__(origin, material)
+        Object.__init__(self, origin, material)
         self.boundingBoxMin = origin - Vector(side/2,side/2,side/2)
         self.boundingBoxMax = origin + Vector(side/2,side/2,side/2)
 
 class InfiniteLayer(Object):
-    def __init__(self, thickness, origin=Vector(0,0,0), material=Material(0,0,0)):
+    """ A layer between z = origin.z and z = origin.z + thickness,
+    infinite in x and y """
+    def __init__(self, thickness, origin=Vector(0,0,0), material=None):
         self.thickness = thickness
-        Object.__init__(origin, material)
-        self.boundingBoxMin = origin + Vector(-1000,-1000,thickness)
-        self.boundingBoxMax = origin + Vector(+1000,+1000,thickness)
+        Object.__init__(self, origin, material)
+        self.boundingBoxMin = origin + Vector(-math.inf,-math.inf,0)
+        self.boundingBoxMax = origin + Vector(+math.inf,+math.inf,thickness)
 
     def contains(self, position) -> bool:
         if position.z < self.boundingBoxMin.z or position.z > self.boundingBoxMax.z:
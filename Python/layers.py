@@ -0,0 +1,271 @@
+import numpy as np
+import math
+import bisect
+from vector import UnitVector, Vector
+from geometry import InfiniteLayer
+
+COSZERO = 1.0-1.0E-12 # cosine of about 1e-6 rad
+COS90D = 1.0E-6 # cosine of about 1.57 - 1e-6 rad
+
+def fresnelReflection(n1, n2, cosIncident) -> (float, float):
+    """ Fresnel reflectance (unpolarized) and cosine of the transmission
+    angle, for 0 <= cosIncident <= 1. Same as RFresnel in mcmlgo.c. """
+    if n1 == n2:
+        return (0.0, cosIncident)
+    elif cosIncident > COSZERO:
+        r = (n2-n1)/(n2+n1)
+        return (r*r, cosIncident)
+    elif cosIncident < COS90D:
+        return (1.0, 0.0)
+
+    sa1 = math.sqrt(1-cosIncident*cosIncident)
+    sa2 = n1*sa1/n2
+    if sa2 >= 1.0:
+        return (1.0, 0.0) # Total internal reflection
+
+    ca1 = cosIncident
+    ca2 = math.sqrt(1-sa2*sa2)
+    cap = ca1*ca2 - sa1*sa2 # c+ = cc - ss
+    cam = ca1*ca2 + sa1*sa2 # c- = cc + ss
+    sap = sa1*ca2 + ca1*sa2 # s+ = sc + cs
+    sam = sa1*ca2 - ca1*sa2 # s- = sc - cs
+    r = 0.5*sam*sam*(cam*cam+cap*cap)/(sap*sap*cam*cam)
+    return (r, ca2)
+
+class LayerStack:
+    """ A stack of InfiniteLayer, each with its own Material, between an
+    ambient medium above and one below (like MCML). Photons enter at
+    the origin on the top surface going down (+z).
+
+    The steps are truncated at the interfaces, where the photon is
+    reflected or refracted according to Fresnel. Layers are indexed
+    from 1 to N (0 and N+1 are the ambient media) and the photon keeps
+    the index of its layer: the boundary test at each step only looks
+    at the two planes of that layer. The layer at an arbitrary z is
+    found by bisection of the sorted boundaries (layerAt). A step cut at
+    an interface carries its optical depth left (sleft) to the next
+    layer, which also lets an ExponentialTransform work across layers:
+    the weight is corrected for each part of the step.
+
+    The energy absorbed is scored in stats (shared by all layers: a Stats
+    or a tally like CylindricalTally), the weight that leaves the stack in
+    reflectanceTally and transmittanceTally (ExitTally) if given, and the
+    weights absorbed, reflected and transmitted are summed for the whole
+    run. """
+    def __init__(self, layers, indexAbove=1.0, indexBelow=1.0, stats=None,
+                 reflectanceTally=None, transmittanceTally=None):
+        self.layers = sorted(layers, key=lambda layer: layer.boundingBoxMin.z)
+        for above, below in zip(self.layers, self.layers[1:]):
+            if above.boundingBoxMax.z != below.boundingBoxMin.z:
+                raise ValueError("Layers must be contiguous")
+
+        self.boundaries = [self.layers[0].boundingBoxMin.z] + [layer.boundingBoxMax.z for layer in self.layers]
+        self.materials = [None] + [layer.material for layer in self.layers] + [None]
+        self.indices = [indexAbove] + [layer.material.index for layer in self.layers] + [indexBelow]
+        self.stats = stats
+        self.reflectanceTally = reflectanceTally
+        self.transmittanceTally = transmittanceTally
+        for layer in self.layers:
+            layer.material.stats = stats
+
+        N = len(self.layers)
+        # Cosines of the critical angles at the top (0) and bottom (1) of each layer
+        self.cosCritical0 = [0.0]*(N+2)
+        self.cosCritical1 = [0.0]*(N+2)
+        for i in range(1, N+1):
+            n1 = self.indices[i]
+            for n2, cosCritical in ((self.indices[i-1], self.cosCritical0), (self.indices[i+1], self.cosCritical1)):
+                cosCritical[i] = math.sqrt(1.0 - n2*n2/(n1*n1)) if n1 > n2 else 0.0
+
+        self.specularReflectance = self.getSpecularReflectance()
+        self.reset()
+
+    @classmethod
+    def withThicknesses(cls, materials, thicknesses, **kwargs):
+        """ Layers stacked from z = 0 in the given order """
+        layers = []
+        z = 0
+        for material, thickness in zip(materials, thicknesses):
+            layers.append(InfiniteLayer(thickness, origin=Vector(0,0,z), material=material))
+            z += thickness
+        return cls(layers, **kwargs)
+
+    def reset(self):
+        self.photonCount = 0
+        self.reflected = 0.0 # Diffuse reflectance, total weight
+        self.transmitted = 0.0
+        self.absorbed = [0.0]*(len(self.layers)+2) # Per layer
+
+    @property
+    def layerCount(self) -> int:
+        return len(self.layers)
+
+    @property
+    def diffuseReflectance(self) -> float:
+        return self.reflected/self.photonCount
+
+    @property
+    def transmittance(self) -> float:
+        return self.transmitted/self.photonCount
+
+    @property
+    def absorbance(self) -> float:
+        return sum(self.absorbed)/self.photonCount
+
+    def isGlass(self, layer) -> bool:
+        material = self.materials[layer]
+        return material.mu_a == 0 and material.mu_s == 0 and material.mu_sz == 0
+
+    def layerAt(self, z) -> int:
+        """ Index of the layer at z: 0 above the stack, N+1 below """
+        return bisect.bisect_right(self.boundaries, z)
+
+    def getSpecularReflectance(self) -> float:
+        """ Same as Rspecular in mcmlgo.c: multiple reflections are
+        considered if the first layer is glass """
+        temp = (self.indices[0] - self.indices[1])/(self.indices[0] + self.indices[1])
+        r1 = temp*temp
+        if self.isGlass(1) and self.layerCount > 1:
+            temp = (self.indices[1] - self.indices[2])/(self.indices[1] + self.indices[2])
+            r2 = temp*temp
+            r1 = r1 + (1-r1)*(1-r1)*r2/(1-r1*r2)
+        return r1
+
+    def launch(self, photon):
+        photon.weight = 1.0 - self.specularReflectance
+        photon.layer = 1
+        photon.sleft = 0
+        photon.r = Vector(0, 0, self.boundaries[0])
+        if self.isGlass(1) and self.layerCount > 1:
+            photon.layer = 2
+            photon.r = Vector(0, 0, self.boundaries[1])
+        self.photonCount += 1
+        if self.stats is not None:
+            self.stats.countPhotons()
+
+    def propagate(self, photon, profiler=None):
+        """ Propagate photon from its launch. A profiler (if any) counts
+        and times the methods called by this loop from the outside (see
+        Profiler.instrumenting and probes). """
+        if profiler is not None:
+            profiler.countPhotons()
+            with profiler.instrumenting(self.probes(photon)):
+                self.propagate(photon)
+            return
+
+        self.launch(photon)
+        photons = [photon] # And the copies split by a WeightWindow
+        while photons:
+            photon = photons.pop()
+            while photon.isAlive:
+                self.hopDropSpin(photon)
+                photons.extend(self.materials[photon.layer].roulette(photon))
+
+    def probes(self, photon) -> list:
+        """ The methods of propagate and hopDropSpin, by stage, for
+        Profiler.instrumenting """
+        def countRoulette(profiler, args, result):
+            profiler.countRoulette(*result)
+        def countDeposits(profiler, args, result):
+            profiler.countDeposits(args[0].stats, args[1].r)
+
+        probes = [(type(self), 'hopDropSpin', None, lambda profiler, args, result: profiler.countSteps()),
+                  (type(self), 'crossOrNot', 'boundaries', None),
+                  (type(photon), 'moveBy', 'move', None),
+                  (type(photon), 'scatterByCosines', 'rotation', None),
+                  (type(photon), 'roulette', None, countRoulette)]
+        for material in self.materials[1:-1]:
+            probes += [(type(material), 'getOpticalDepth', 'sampling', None),
+                       (type(material), 'getScatteringCosines', 'sampling', None),
+                       (type(material), 'absorbEnergy', 'scoring', countDeposits),
+                       (type(material), 'roulette', 'roulette', None)]
+            if material.weightWindow is not None:
+                probes.append((type(material.weightWindow), 'roulette', None, countRoulette))
+        return probes
+
+    def hopDropSpin(self, photon):
+        """ One step of photon: to the next interaction (drop and spin) or
+        to the boundary of its layer (cross or reflect) """
+        layer = photon.layer
+        material = self.materials[layer]
+
+        uz = photon.ez.z
+        if uz > 0:
+            distanceToBoundary = (self.boundaries[layer] - photon.r.z)/uz
+        elif uz < 0:
+            distanceToBoundary = (self.boundaries[layer-1] - photon.r.z)/uz
+        else:
+            distanceToBoundary = math.inf
+
+        if self.isGlass(layer):
+            if distanceToBoundary == math.inf:
+                photon.weight = 0 # Horizontal photon in glass never comes back
+            else:
+                photon.moveBy(distanceToBoundary, material.index)
+                self.crossOrNot(photon)
+            return
+
+        # sleft is the optical depth left of the step, with the biased
+        # attenuation in a layer with an exponential transform
+        mu_t = material.getAttenuation(photon)
+        transform = material.exponentialTransform
+        mu = mu_t if transform is None else transform.biasedAttenuation(mu_t, photon)
+        if photon.sleft == 0:
+            photon.sleft = material.getOpticalDepth(photon)
+        d = photon.sleft/mu
+
+        if d > distanceToBoundary:
+            photon.sleft -= distanceToBoundary*mu
+            if transform is not None:
+                transform.correctWeight(photon, mu_t, mu, distanceToBoundary, collides=False)
+            photon.moveBy(distanceToBoundary, material.index)
+            self.crossOrNot(photon)
+        else:
+            photon.sleft = 0
+            if transform is not None:
+                transform.correctWeight(photon, mu_t, mu, d)
+            photon.moveBy(d, material.index)
+            self.absorbed[layer] += material.absorbEnergy(photon)
+            (cost, sint, phi) = material.getScatteringCosines(photon)
+            photon.scatterByCosines(cost, sint, phi)
+
+    def crossOrNot(self, photon):
+        """ Reflect or transmit (statistically) the photon on the boundary
+        of its layer. Transmitted out of the stack, it is recorded as
+        reflectance or transmittance and its weight is set to zero. """
+        layer = photon.layer
+        uz = photon.ez.z
+        if uz < 0:
+            nextLayer = layer - 1
+            cosCritical = self.cosCritical0[layer]
+        else:
+            nextLayer = layer + 1
+            cosCritical = self.cosCritical1[layer]
+
+        ni = self.indices[layer]
+        nt = self.indices[nextLayer]
+        if abs(uz) <= cosCritical:
+            r = 1.0 # Total internal reflection
+        else:
+            (r, cosTransmitted) = fresnelReflection(ni, nt, abs(uz))
+
+        if r < 1.0 and photon.random() > r:
+            ez = photon.ez
+            photon.changeDirectionTo(UnitVector(ez.x*ni/nt, ez.y*ni/nt, math.copysign(cosTransmitted, uz)))
+            if nextLayer == 0 or nextLayer == self.layerCount+1:
+                self.recordExit(photon, nextLayer)
+                photon.weight = 0
+            else:
+                photon.layer = nextLayer
+        else:
+            photon.reflectOffPlane(UnitVector(0,0,1))
+
+    def recordExit(self, photon, layer):
+        if layer == 0:
+            self.reflected += photon.weight
+            if self.reflectanceTally is not None:
+                self.reflectanceTally.score(photon, photon.weight)
+        else:
+            self.transmitted += photon.weight
+            if self.transmittanceTally is not None:
+                self.transmittanceTally.score(photon, photon.weight)
@@ -1,35 +1,127 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from stats import *
+import math
+from stats import Stats
+from phase import HenyeyGreenstein
 
 class Material:
-    def __init__(self, mu_s, mu_a, g):
+    """ The phase function is Henyey-Greenstein with anisotropy g unless
+    another PhaseFunction is given (then g is only informative). Its
+    table is computed here (or taken from the cache) so that sampling
+    the scattering angle is a table lookup.
+
+    Scattering can depend on the direction, as in fibrous tissue (white
+    matter) with fibres along z: mu_s is the scattering coefficient across
+    the fibres and mu_sz along them, and for a direction (ux, uy, uz) it is
+    sqrt((mu_s*ux)^2 + (mu_s*uy)^2 + (mu_sz*uz)^2). computeAnisoptropicMus
+    in mcmlgo.c computes the same value but returns musx, so the C mcml
+    ignores mu_sz: results differ from mcml when mu_sz != mu_s. mu_t is
+    then the value across z (see getAttenuation).
+
+    Variance reduction is set per material: the threshold and chance of
+    survival of the roulette, or a WeightWindow that replaces it, and an
+    ExponentialTransform of the path lengths (see variance.py). """
+    def __init__(self, mu_s, mu_a, g, index=1.0, phaseFunction=None, rouletteThreshold=1e-4,
+                 rouletteChance=0.1, weightWindow=None, exponentialTransform=None, mu_sz=None):
         self.mu_s = mu_s
+        self.mu_sz = mu_s if mu_sz is None else mu_sz
         self.mu_a = mu_a
         self.mu_t = self.mu_a + self.mu_s
         self.g = g
+        self.index = index
+        if phaseFunction is None:
+            phaseFunction = HenyeyGreenstein(g)
+        self.phaseFunction = phaseFunction
+        self.phaseFunction.cosineTable # Computed now, not at the first scattering
+        self.rouletteThreshold = rouletteThreshold
+        self.rouletteChance = rouletteChance
+        self.weightWindow = weightWindow
+        self.exponentialTransform = exponentialTransform
         self.stats = Stats()
 
+    @property
+    def isAnisotropic(self) -> bool:
+        return self.mu_sz != self.mu_s
+
+    def getAttenuation(self, photon) -> float:
+        """ mu_t in the direction of propagation of photon. It does not
+        change along a straight step, so the distance to the next
+        interaction is still exponential with this mu_t: no need for
+        delta-tracking. """
+        if self.mu_sz == self.mu_s:
+            return self.mu_t
+        uz = photon.ez.z
+        return self.mu_a + math.sqrt(self.mu_s*self.mu_s*(1-uz*uz) + self.mu_sz*self.mu_sz*uz*uz)
+
+    def getAttenuationMany(self, photons):
+        """ Same as getAttenuation, one value per photon (or mu_t for all) """
+        if self.mu_sz == self.mu_s:
+            return self.mu_t
+        uz = photons.ez.z
+        return self.mu_a + np.sqrt(self.mu_s*self.mu_s*(1-uz*uz) + self.mu_sz*self.mu_sz*uz*uz)
+
     def getScatteringDistance(self, photon) -> float:
-        rnd = 0
-        while rnd == 0:
-            rnd = np.random.random()
-        return -np.log(rnd)/self.mu_t
+        mu_t = self.getAttenuation(photon)
+        if self.exponentialTransform is not None:
+            return self.exponentialTransform.sampleDistance(mu_t, photon)
+        return -math.log(1.0 - photon.random())/mu_t # random() is in [0,1)
+
+    def getOpticalDepth(self, photon) -> float:
+        """ The optical depth to the next interaction, for steps that cross
+        interfaces (LayerStack): the distance is found material by material """
+        return -math.log(1.0 - photon.random())
 
     def getScatteringAngles(self, photon) -> (float, float):
-        phi = np.random.random()*2*np.pi
-        g = self.g
-        if g == 0:
-            cost = 2*np.random.random()-1 
-        else:
-            temp = (1-g*g)/(1-g+2*g*np.random.random())
-            cost = (1+g*g - temp*temp)/(2*g)
-        return (np.arccos(cost), phi)
+        (cost, sint, phi) = self.getScatteringCosines(photon)
+        return (math.atan2(sint, cost), phi)
+
+    def getScatteringCosines(self, photon) -> (float, float, float):
+        """ cos(theta), sin(theta) and phi: Photon.scatterByCosines does
+        not need theta itself """
+        phi = photon.random()*2*math.pi
+        (cost, sint) = self.phaseFunction.sampleCosine(photon.random())
+        return (cost, sint, phi)
+
+    def getScatteringDistanceMany(self, photons) -> np.ndarray:
+        mu_t = self.getAttenuationMany(photons)
+        if self.exponentialTransform is not None:
+            return self.exponentialTransform.sampleDistances(mu_t, photons)
+        rnd = 1 - np.random.random(photons.count) # in (0,1], never 0
+        return -np.log(rnd)/mu_t
+
+    def getScatteringAnglesMany(self, photons) -> (np.ndarray, np.ndarray):
+        (cost, sint, phi) = self.getScatteringCosinesMany(photons)
+        return (np.arctan2(sint, cost), phi)
+
+    def getScatteringCosinesMany(self, photons) -> (np.ndarray, np.ndarray, np.ndarray):
+        N = photons.count
+        phi = np.random.random(N)*2*np.pi
+        (cost, sint) = self.phaseFunction.sampleCosines(np.random.random(N))
+        return (cost, sint, phi)
 
     def absorbEnergy(self, photon):
-        delta = photon.weight * self.mu_a/self.mu_t
+        delta = photon.weight * self.mu_a/self.getAttenuation(photon)
         photon.decreaseWeightBy(delta)
         if self.stats is not None:
             self.stats.score(photon, delta)
+        return delta
+
+    def absorbEnergyMany(self, photons):
+        delta = photons.weight * self.mu_a/self.getAttenuationMany(photons)
+        photons.decreaseWeightBy(delta)
+        if self.stats is not None:
+            self.stats.scoreMany(photons.r, delta)
 
+    def roulette(self, photon) -> list:
+        """ Roulette of photon, or its weight window. Returns the copies
+        split from it, if any. """
+        if self.weightWindow is not None:
+            return self.weightWindow.apply(photon)
+        photon.roulette(self.rouletteThreshold, self.rouletteChance)
+        return []
 
+    def rouletteMany(self, photons) -> (int, int):
+        """ Same as roulette for Photons, which gets the copies. Returns
+        the number of photons that played and that survived. """
+        if self.weightWindow is not None:
+            return self.weightWindow.applyMany(photons)
+        return photons.roulette(self.rouletteThreshold, self.rouletteChance)
@@ -0,0 +1,142 @@
+import numpy as np
+import os
+import glob
+import multiprocessing
+
+class MCOFile:
+    """ The content of an MCML output file (.mco), read in a single pass.
+
+    InParm is a dict with the input parameters (photons, dz, dr, nz, nr,
+    na, indexAbove, indexBelow, and layers: one row n, mua, mus, g, d per
+    layer). RAT holds the specular reflectance, diffuse reflectance,
+    absorbed fraction and transmittance. A_l, A_z, Rd_r, Rd_a, Tt_r and
+    Tt_a are 1D arrays, and A_rz (nr x nz), Rd_ra and Tt_ra (nr x na) are
+    2D arrays.
+
+    The 2D blocks are by far the largest part of the file: unless
+    load2D is True, their position in the file is only noted while
+    reading and they are parsed the first time they are used. """
+    categories1D = ('A_l', 'A_z', 'Rd_r', 'Rd_a', 'Tt_r', 'Tt_a')
+    categories2D = ('A_rz', 'Rd_ra', 'Tt_ra')
+
+    def __init__(self, filepath, load2D=False):
+        self.filepath = filepath
+        self.InParm = {}
+        self.RAT = None
+        self.data = {}
+        self.offsets = {} # File position of the 2D blocks not parsed yet
+        self.read(load2D)
+
+    def read(self, load2D=False):
+        with open(self.filepath, "rb") as file:
+            version = file.readline().split()
+            if not version or version[0] != b"A1":
+                raise ValueError("{0} is not an MCML output file".format(self.filepath))
+
+            line = file.readline()
+            while line:
+                words = line.split()
+                name = words[0].decode() if words else None
+                if name == 'InParm':
+                    self.InParm = self.readInParm(file)
+                elif name == 'RAT':
+                    self.RAT = self.readBlock(file)
+                elif name in self.categories1D:
+                    self.data[name] = self.readBlock(file)
+                elif name in self.categories2D:
+                    if load2D:
+                        self.data[name] = self.readBlock(file).reshape(self.shapeOf(name))
+                    else:
+                        self.offsets[name] = file.tell()
+                        self.skipBlock(file)
+                line = file.readline()
+
+    def readInParm(self, file) -> dict:
+        values = []
+        line = file.readline()
+        while len(values) < 9: # Up to the number of layers
+            words = line.split(b"#")[0].split()
+            values.extend(words)
+            line = file.readline()
+
+        inParm = {'filename': values[0].decode(),
+                  'photons': int(values[2]),
+                  'dz': float(values[3]), 'dr': float(values[4]),
+                  'nz': int(values[5]), 'nr': int(values[6]), 'na': int(values[7])}
+
+        layerCount = int(values[8])
+        rows = []
+        while len(rows) < layerCount+2: # Layers and media above and below
+            words = line.split(b"#")[0].split()
+            if words:
+                rows.append([float(word) for word in words])
+            line = file.readline()
+
+        inParm['indexAbove'] = rows[0][0]
+        inParm['layers'] = np.array(rows[1:-1]).reshape(layerCount, 5)
+        inParm['indexBelow'] = rows[-1][0]
+        return inParm
+
+    def readBlock(self, file) -> np.ndarray:
+        """ Numbers until the next blank line (comments are ignored) """
+        words = []
+        line = file.readline()
+        while line.strip():
+            words.extend(line.split(b"#")[0].split())
+            line = file.readline()
+        return np.array(words, dtype=float)
+
+    def skipBlock(self, file):
+        line = file.readline()
+        while line.strip():
+            line = file.readline()
+
+    def shapeOf(self, name) -> tuple:
+        nz = self.InParm['nz']
+        nr = self.InParm['nr']
+        na = self.InParm['na']
+        shapes = {'A_l':(len(self.InParm['layers']),), 'A_z':(nz,),
+                  'Rd_r':(nr,), 'Rd_a':(na,), 'Tt_r':(nr,), 'Tt_a':(na,),
+                  'A_rz':(nr, nz), 'Rd_ra':(nr, na), 'Tt_ra':(nr, na)}
+        return shapes[name]
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not found: the data categories
+        if name in MCOFile.categories1D + MCOFile.categories2D:
+            data = self.__dict__['data']
+            if name not in data:
+                offsets = self.__dict__['offsets']
+                if name not in offsets:
+                    raise AttributeError("{0} has no {1}".format(self.filepath, name))
+                with open(self.filepath, "rb") as file:
+                    file.seek(offsets.pop(name))
+                    data[name] = self.readBlock(file).reshape(self.shapeOf(name))
+            return data[name]
+        raise AttributeError(name)
+
+    @property
+    def specularReflectance(self) -> float:
+        return self.RAT[0]
+
+    @property
+    def diffuseReflectance(self) -> float:
+        return self.RAT[1]
+
+    @property
+    def absorbance(self) -> float:
+        return self.RAT[2]
+
+    @property
+    def transmittance(self) -> float:
+        return self.RAT[3]
+
+def readMCO(filepath, load2D=False) -> MCOFile:
+    return MCOFile(filepath, load2D=load2D)
+
+def readMCODirectory(directory, pattern="*.mco", load2D=False, processes=None) -> dict:
+    """ All the .mco files of a directory (e.g. a parameter sweep), read
+    in parallel. Returns a dict {filename: MCOFile} sorted by filename. """
+    filepaths = sorted(glob.glob(os.path.join(directory, pattern)))
+    with multiprocessing.Pool(processes=processes) as pool:
+        files = pool.starmap(MCOFile, [(filepath, load2D) for filepath in filepaths])
+    return {os.path.basename(file.filepath): file for file in files}
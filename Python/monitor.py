@@ -0,0 +1,95 @@
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+import time
+from stats import Stats
+
+class Monitor:
+    """ Live display of a Stats that does not slow down the simulation.
+
+    The energy grid is copied (at most once every interval seconds) into
+    shared memory by publish(), and a separate viewer process draws it
+    with one of the Stats.show methods on its own schedule. The
+    simulation never waits on matplotlib, and a simulation without a
+    Monitor pays nothing. The plot and its options are the ones of
+    Stats.show2D or Stats.show1D, for instance:
+
+        monitor = Monitor(stats, plot='show2D', plane='xz', integratedAlong='y')
+        ...
+        monitor.publish(stats)
+        ...
+        monitor.close()
+    """
+    def __init__(self, stats, plot='show2D', interval=0.5, **plotOptions):
+        self.interval = interval
+        self.lastPublished = None
+
+        self.memory = shared_memory.SharedMemory(create=True, size=max(1, stats.energy.nbytes))
+        self.snapshot = np.ndarray(stats.energy.shape, dtype=float, buffer=self.memory.buf)
+        self.snapshot[:] = 0
+        self.lock = multiprocessing.Lock()
+        self.sequence = multiprocessing.Value('q', 0, lock=False)
+        self.photonCount = multiprocessing.Value('q', 0, lock=False)
+        self.stopped = multiprocessing.Event()
+
+        grid = (stats.min, stats.max, stats.size)
+        self.viewer = multiprocessing.Process(target=_view,
+                        args=(self.memory.name, grid, self.lock, self.sequence,
+                              self.photonCount, self.stopped, plot, plotOptions),
+                        daemon=True)
+        self.viewer.start()
+
+    def publish(self, stats, force=False):
+        """ Make a copy of the energy available to the viewer, unless the
+        last one was less than interval seconds ago """
+        now = time.monotonic()
+        if not force and self.lastPublished is not None and now - self.lastPublished < self.interval:
+            return
+
+        with self.lock:
+            np.copyto(self.snapshot, stats.energy)
+            self.photonCount.value = stats.photonCount
+            self.sequence.value += 1
+        self.lastPublished = now
+
+    def close(self, timeout=2):
+        self.stopped.set()
+        self.viewer.join(timeout)
+        if self.viewer.is_alive():
+            self.viewer.terminate()
+        del self.snapshot
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _view(memoryName, grid, lock, sequence, photonCount, stopped, plot, plotOptions):
+    import matplotlib.pyplot as plt
+
+    (gridMin, gridMax, gridSize) = grid
+    memory = shared_memory.SharedMemory(name=memoryName)
+    snapshot = np.ndarray(tuple(gridSize), dtype=float, buffer=memory.buf)
+    stats = Stats(min=gridMin, max=gridMax, size=gridSize)
+    show = getattr(stats, plot)
+
+    lastSequence = 0
+    while not stopped.is_set():
+        if sequence.value != lastSequence:
+            with lock:
+                np.copyto(stats.energy, snapshot)
+                stats.photonCount = photonCount.value
+                lastSequence = sequence.value
+            show(realtime=True, **plotOptions)
+        elif stats.figure is not None:
+            # Keep the window responsive without redrawing (plt.pause would
+            # draw the figure that show() has just cleared)
+            stats.figure.canvas.start_event_loop(0.05)
+        else:
+            time.sleep(0.05)
+
+    del snapshot
+    memory.close()
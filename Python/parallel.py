@@ -0,0 +1,62 @@
+import numpy as np
+import multiprocessing
+import copy
+from photons import Photons
+from photon import Photon
+
+def propagateInParallel(material, N, processes=None, seed=None, tasks=None, batchSize=1000, callback=None):
+    """ Propagate N photons in material using a pool of processes and
+    return the reduced Stats.
+
+    The photon budget is split into tasks (by default four per process,
+    for load balancing). Each task gets its own random stream, spawned
+    from SeedSequence(seed), and its own Stats grid. The streams depend
+    on the task and not on the process that happens to run it, so the
+    result is reproducible for a given seed, number of tasks and
+    batchSize. The grids are added in task order as they come back;
+    callback(stats, photonsDone) is called after each one, which can be
+    used to save intermediate results.
+
+    The photon ids are reserved here for all N photons and each task
+    starts at its own offset, so ids are unique across workers (e.g. in
+    the records of a Detector) and do not depend on the processes. """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if tasks is None:
+        tasks = 4*processes
+    tasks = max(1, min(tasks, N))
+
+    counts = [N//tasks + (1 if i < N % tasks else 0) for i in range(tasks)]
+    seeds = np.random.SeedSequence(seed).spawn(tasks)
+    stats = material.stats
+    if stats is None:
+        raise ValueError("material.stats must be set to collect the results")
+
+    # The workers only need the grid geometry, not the energy collected so far
+    taskMaterial = copy.copy(material)
+    taskMaterial.stats = None
+    grid = (type(stats), stats.min, stats.max, stats.size, stats.clampToEdges)
+
+    firstIds = Photon.reserveUniqueIds(N) + np.cumsum([0] + counts[:-1])
+    arguments = [(taskMaterial, grid, count, batchSize, taskSeed, int(firstId))
+                 for count, taskSeed, firstId in zip(counts, seeds, firstIds)]
+    photonsDone = 0
+    with multiprocessing.Pool(processes) as pool:
+        for count, taskStats in zip(counts, pool.imap(_propagateTask, arguments)):
+            stats.merge(taskStats)
+            photonsDone += count
+            if callback is not None:
+                callback(stats, photonsDone)
+
+    return stats
+
+def _propagateTask(arguments):
+    material, (statsClass, gridMin, gridMax, gridSize, clampToEdges), N, batchSize, seed, firstId = arguments
+    np.random.seed(seed.generate_state(8))
+    Photon.nextUniqueId = firstId
+
+    material.stats = statsClass(min=gridMin, max=gridMax, size=gridSize, clampToEdges=clampToEdges)
+    for i in range(0, N, batchSize):
+        photons = Photons(N=min(batchSize, N-i))
+        photons.propagate(material)
+    return material.stats
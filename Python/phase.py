@@ -0,0 +1,141 @@
+import numpy as np
+import math
+
+class PhaseFunction:
+    """ The distribution of the cosine of the scattering angle. Sampling
+    is done with a table of the inverse cumulative distribution: for a
+    uniform random number rnd in [0,1), cos(theta) is interpolated
+    linearly between the tableSize+1 values of the table at rnd*tableSize.
+    This is the same for every phase function, with or without an
+    analytical inverse (two-term HG, Mie, measured data), and it works
+    for one photon or an array of photons.
+
+    Tables are computed once for a given set of parameters and shared:
+    two materials with the same phase function use the same table. """
+    tableSize = 4096
+    tables = {} # key: table of cos(theta)
+    lists = {} # key: same table as a list
+
+    @property
+    def key(self) -> tuple:
+        """ Phase functions with the same key have the same table """
+        raise NotImplementedError()
+
+    def pdf(self, cost):
+        """ Probability density of cos(theta), not necessarily normalized """
+        raise NotImplementedError()
+
+    def inverseCDF(self, rnd):
+        """ cos(theta) for the values of the cumulative distribution rnd.
+        By default, the pdf is integrated numerically on a fine grid. """
+        cost = np.linspace(-1, 1, 64*self.tableSize+1)
+        p = self.pdf(cost)
+        cdf = np.concatenate(([0], np.cumsum((p[1:]+p[:-1])/2*np.diff(cost))))
+        cdf /= cdf[-1]
+        return np.interp(rnd, cdf, cost)
+
+    @property
+    def cosineTable(self) -> np.ndarray:
+        key = (self.key, self.tableSize)
+        table = PhaseFunction.tables.get(key)
+        if table is None:
+            rnd = np.linspace(0, 1, self.tableSize+1)
+            table = np.clip(self.inverseCDF(rnd), -1, 1)
+            table.setflags(write=False)
+            PhaseFunction.tables[key] = table
+        return table
+
+    @property
+    def cosineList(self) -> list:
+        """ cosineTable as a list, faster than an array for one value """
+        key = (self.key, self.tableSize)
+        table = PhaseFunction.lists.get(key)
+        if table is None:
+            table = self.cosineTable.tolist()
+            PhaseFunction.lists[key] = table
+        return table
+
+    def sampleCosine(self, rnd) -> (float, float):
+        """ cos(theta) and sin(theta) for one random number in [0,1). The
+        list is kept by the phase function after the first call, so its
+        parameters must not change after it is sampled. """
+        try:
+            table = self._cosineList
+        except AttributeError:
+            table = self._cosineList = self.cosineList
+        position = rnd*self.tableSize
+        i = int(position)
+        lower = table[i]
+        cost = lower + (position-i)*(table[i+1]-lower)
+        return (cost, math.sqrt(1.0-cost*cost))
+
+    def sampleCosines(self, rnd) -> (np.ndarray, np.ndarray):
+        """ cos(theta) and sin(theta) for an array of random numbers """
+        table = self.cosineTable
+        position = rnd*self.tableSize
+        i = position.astype(int)
+        lower = table[i]
+        cost = lower + (position-i)*(table[i+1]-lower)
+        return (cost, np.sqrt(1.0-cost*cost))
+
+class HenyeyGreenstein(PhaseFunction):
+    def __init__(self, g):
+        self.g = g
+
+    @property
+    def key(self) -> tuple:
+        return ('HenyeyGreenstein', self.g)
+
+    def pdf(self, cost):
+        g = self.g
+        return (1-g*g)/(1+g*g-2*g*cost)**1.5
+
+    def inverseCDF(self, rnd):
+        g = self.g
+        if g == 0:
+            return 2*rnd-1
+        temp = (1-g*g)/(1-g+2*g*rnd)
+        return (1+g*g - temp*temp)/(2*g)
+
+class TwoTermHenyeyGreenstein(PhaseFunction):
+    """ fraction*HG(g1) + (1-fraction)*HG(g2), e.g. forward and backward
+    lobes with g1 > 0 and g2 < 0 """
+    def __init__(self, g1, g2, fraction):
+        self.g1 = g1
+        self.g2 = g2
+        self.fraction = fraction
+
+    @property
+    def key(self) -> tuple:
+        return ('TwoTermHenyeyGreenstein', self.g1, self.g2, self.fraction)
+
+    @property
+    def g(self) -> float:
+        return self.fraction*self.g1 + (1-self.fraction)*self.g2
+
+    def pdf(self, cost):
+        f = self.fraction
+        return f*HenyeyGreenstein(self.g1).pdf(cost) + (1-f)*HenyeyGreenstein(self.g2).pdf(cost)
+
+class TabulatedPhaseFunction(PhaseFunction):
+    """ A phase function known at a few angles only (Mie calculation,
+    measured data): values of the pdf at increasing cosines, linearly
+    interpolated in between """
+    def __init__(self, cosines, values):
+        self.cosines = np.asarray(cosines, dtype=float)
+        self.values = np.asarray(values, dtype=float)
+        if self.cosines.shape != self.values.shape or np.any(np.diff(self.cosines) <= 0):
+            raise ValueError("cosines must be increasing and have one value each")
+
+    @property
+    def key(self) -> tuple:
+        return ('TabulatedPhaseFunction', tuple(self.cosines), tuple(self.values))
+
+    @property
+    def g(self) -> float:
+        cost = np.linspace(-1, 1, 100001)
+        p = self.pdf(cost)
+        return np.sum(p*cost)/np.sum(p)
+
+    def pdf(self, cost):
+        return np.interp(cost, self.cosines, self.values, left=0, right=0)
@@ -1,6 +1,9 @@
 import numpy as np
-from vector import *
-from material import *
+import math
+from random import Random
+from vector import UnitVector, Vector
+
+SPEED_OF_LIGHT = 29.9792458 # cm/ns, in vacuum
 
 class Photon:
     def __init__(self):
@@ -11,33 +14,115 @@ class Photon:
         self.ez = UnitVector(0,0,1) # Propagation
         self.er = UnitVector(0,1,0) # Perpendicular to scattering plane
         self.weight = 1.0
-        self.uniqueId = np.random.randint(1<<63)
+        self.uniqueId = Photon.reserveUniqueIds(1)
+        # Each photon has its own generator for the numbers drawn one at a
+        # time (Python's: np.random takes 10 times longer per number),
+        # seeded from np.random so that np.random.seed() still makes a run
+        # reproducible. Copies of a photon share it.
+        self.random = Random(int(np.random.randint(1 << 62))).random
+        self.layer = None # Index in a LayerStack
+        self.sleft = 0 # Dimensionless step left after hitting an interface
+        self.scatterCount = 0
+        self.pathLength = 0.0
+        self.opticalPathLength = 0.0 # Path length times the index, for the time of flight
+
+    nextUniqueId = 0
+
+    @classmethod
+    def reserveUniqueIds(cls, N) -> int:
+        """ Ids increase within a process, which lets Stats count photons
+        without remembering them. Returns the first of N consecutive ids. """
+        first = cls.nextUniqueId
+        cls.nextUniqueId += N
+        return first
 
     @property
     def el(self) -> UnitVector:
-        return self.ez.cross(self.ePerp) 
+        return self.ez.cross(self.er)
 
     @property
     def isAlive(self) -> bool :
         return self.weight != 0
 
-    def moveBy(self, d):
-        self.r += self.ez * d
+    @property
+    def timeOfFlight(self) -> float:
+        """ In ns, since the launch """
+        return self.opticalPathLength/SPEED_OF_LIGHT
+
+    def moveBy(self, d, index=1.0):
+        """ Move by d in a medium of refractive index index """
+        self.r.addScaled(self.ez, d)
+        self.pathLength += d
+        self.opticalPathLength += index*d
+
+    renormalizationPeriod = 100 # scatterBy calls between orthonormalize
 
     def scatterBy(self, theta, phi):
-        self.er.rotateAround(self.ez, phi)
-        self.ez.rotateAround(self.er, theta)
+        self.scatterByCosines(math.cos(theta), math.sin(theta), phi)
+
+    def scatterByCosines(self, cost, sint, phi):
+        self.ez.spinFrameByCosines(self.er, cost, sint, phi)
+        self.scatterCount += 1
+        if self.scatterCount % Photon.renormalizationPeriod == 0:
+            self.ez.orthonormalize(self.er)
+
+    def reflectOffPlane(self, normal):
+        """ Mirror the direction of propagation (and er with it, to keep
+        the frame orthonormal) on a plane with a unit normal """
+        for e in (self.ez, self.er):
+            twiceProjection = 2*e.dot(normal)
+            e.x -= twiceProjection*normal.x
+            e.y -= twiceProjection*normal.y
+            e.z -= twiceProjection*normal.z
+
+    def changeDirectionTo(self, u):
+        """ New direction of propagation u (a unit vector, e.g. after
+        refraction). er is rotated by the same rotation as ez, around
+        k = ez x u: er' = er + k x er + k x (k x er)/(1 + ez.u), in place
+        like spinFrameByCosines. u must not be opposite to ez. """
+        (ez, er) = (self.ez, self.er)
+        kx = ez.y*u.z - ez.z*u.y
+        ky = ez.z*u.x - ez.x*u.z
+        kz = ez.x*u.y - ez.y*u.x
+        c = 1 + ez.x*u.x + ez.y*u.y + ez.z*u.z
+        (rx, ry, rz) = (er.x, er.y, er.z)
+        (ax, ay, az) = (ky*rz - kz*ry, kz*rx - kx*rz, kx*ry - ky*rx) # k x er
+        er.x = rx + ax + (ky*az - kz*ay)/c
+        er.y = ry + ay + (kz*ax - kx*az)/c
+        er.z = rz + az + (kx*ay - ky*ax)/c
+        ez.x = u.x
+        ez.y = u.y
+        ez.z = u.z
 
     def decreaseWeightBy(self, delta):
         self.weight -= delta
         if self.weight < 0:
             self.weight = 0
 
-    def roulette(self):
-        chance = 0.1
-        if self.weight >= 1e-4 or self.weight == 0:
-            return
-        elif np.random.random() < chance:
+    def copy(self):
+        """ Same photon (same id), e.g. split by a WeightWindow """
+        photon = Photon.__new__(Photon)
+        photon.r = self.r.copy()
+        photon.ez = self.ez.copy()
+        photon.er = self.er.copy()
+        photon.weight = self.weight
+        photon.uniqueId = self.uniqueId
+        photon.random = self.random
+        photon.layer = self.layer
+        photon.sleft = self.sleft
+        photon.scatterCount = self.scatterCount
+        photon.pathLength = self.pathLength
+        photon.opticalPathLength = self.opticalPathLength
+        return photon
+
+    def roulette(self, threshold=1e-4, chance=0.1) -> (int, int):
+        """ Returns 1 if the photon played and 1 if it survived, like
+        Photons.roulette """
+        if self.weight >= threshold or self.weight == 0:
+            return (0, 0)
+        elif self.random() < chance:
             self.weight /= chance
+            return (1, 1)
         else:
             self.weight = 0
+            return (1, 0)
@@ -0,0 +1,137 @@
+import numpy as np
+from vector import Vectors
+from photon import Photon, SPEED_OF_LIGHT
+
+class Photons:
+    """ A batch of N photons propagated together. Each property of Photon
+    is stored as an array (or as Vectors), and every step (hop, drop, spin,
+    roulette) is done on the whole batch with NumPy. Dead photons are
+    removed after each step so the arrays only hold live photons. """
+    def __init__(self, N:int):
+        self.N = N
+        self.reset()
+
+    def reset(self):
+        N = self.N
+        self.r = Vectors(0, 0, 0, N=N)
+        self.ez = Vectors(0, 0, 1, N=N) # Propagation
+        self.er = Vectors(0, 1, 0, N=N) # Perpendicular to scattering plane
+        self.weight = np.ones(N)
+        self.uniqueId = np.arange(N) + Photon.reserveUniqueIds(N)
+        self.scatterCount = 0
+        self.pathLength = np.zeros(N)
+        self.opticalPathLength = np.zeros(N)
+
+    @property
+    def count(self) -> int:
+        return len(self.weight)
+
+    @property
+    def isAlive(self) -> bool :
+        return self.count != 0
+
+    @property
+    def timeOfFlight(self) -> np.ndarray:
+        return self.opticalPathLength/SPEED_OF_LIGHT
+
+    def moveBy(self, d, index=1.0):
+        self.r = self.r + self.ez * d
+        self.pathLength += d
+        self.opticalPathLength += index*d
+
+    def scatterBy(self, theta, phi):
+        self.er.rotateAround(self.ez, phi)
+        self.ez.rotateAround(self.er, theta)
+
+    def scatterByCosines(self, cost, sint, phi):
+        self.ez.spinFrameByCosines(self.er, cost, sint, phi)
+        self.scatterCount += 1
+        if self.scatterCount % Photon.renormalizationPeriod == 0:
+            self.ez.orthonormalize(self.er)
+
+    def decreaseWeightBy(self, delta):
+        self.weight -= delta
+        self.weight[self.weight < 0] = 0
+
+    def roulette(self, threshold=1e-4, chance=0.1) -> (int, int):
+        """ Returns the number of photons that played and that survived.
+        threshold and chance can also be arrays, one value per photon. """
+        candidates = (self.weight < threshold) & (self.weight != 0)
+        n = np.count_nonzero(candidates)
+        if n == 0:
+            return (0, 0)
+        if np.ndim(chance) > 0:
+            chance = chance[candidates]
+        survived = np.random.random(n) < chance
+        self.weight[candidates] = np.where(survived, self.weight[candidates]/chance, 0)
+        return (int(n), int(np.count_nonzero(survived)))
+
+    def split(self, counts):
+        """ Replace each photon by counts copies of itself (0 to remove
+        it), the copies next to each other """
+        self.r = self.r.repeat(counts)
+        self.ez = self.ez.repeat(counts)
+        self.er = self.er.repeat(counts)
+        self.weight = np.repeat(self.weight, counts)
+        self.uniqueId = np.repeat(self.uniqueId, counts)
+        self.pathLength = np.repeat(self.pathLength, counts)
+        self.opticalPathLength = np.repeat(self.opticalPathLength, counts)
+
+    def compress(self, mask) -> "Photons":
+        """ A new batch with the photons where mask is True (copies), e.g.
+        those that leave, to score them in an exit tally """
+        photons = Photons.__new__(Photons)
+        photons.N = int(np.count_nonzero(mask))
+        photons.scatterCount = self.scatterCount
+        photons.r = self.r.compress(mask)
+        photons.ez = self.ez.compress(mask)
+        photons.er = self.er.compress(mask)
+        photons.weight = self.weight[mask]
+        photons.uniqueId = self.uniqueId[mask]
+        photons.pathLength = self.pathLength[mask]
+        photons.opticalPathLength = self.opticalPathLength[mask]
+        return photons
+
+    def removeDeadPhotons(self):
+        alive = self.weight != 0
+        if alive.all():
+            return
+        self.r = self.r.compress(alive)
+        self.ez = self.ez.compress(alive)
+        self.er = self.er.compress(alive)
+        self.weight = self.weight[alive]
+        self.uniqueId = self.uniqueId[alive]
+        self.pathLength = self.pathLength[alive]
+        self.opticalPathLength = self.opticalPathLength[alive]
+
+    def propagate(self, material, profiler=None):
+        """ Propagate the whole batch in material. A profiler (if any)
+        counts and times the methods called by this loop from the outside
+        (see Profiler.instrumenting and probes). """
+        if profiler is not None:
+            profiler.countPhotons(self.count)
+            with profiler.instrumenting(self.probes(material)):
+                self.propagate(material)
+            return
+
+        if material.stats is not None:
+            material.stats.countPhotons(self.count)
+        while self.isAlive:
+            (cost, sint, phi) = material.getScatteringCosinesMany(self)
+            self.scatterByCosines(cost, sint, phi)
+            d = material.getScatteringDistanceMany(self) # In the new direction
+            self.moveBy(d, material.index)
+            material.absorbEnergyMany(self)
+            material.rouletteMany(self)
+            self.removeDeadPhotons()
+
+    def probes(self, material) -> list:
+        """ The methods of propagate, by stage, for Profiler.instrumenting """
+        return [(type(material), 'getScatteringCosinesMany', 'sampling', None),
+                (type(material), 'getScatteringDistanceMany', 'sampling', None),
+                (type(self), 'scatterByCosines', 'rotation', None),
+                (type(self), 'moveBy', 'move', lambda profiler, args, result: profiler.countSteps(args[0].count)),
+                (type(material), 'absorbEnergyMany', 'scoring',
+                    lambda profiler, args, result: profiler.countDeposits(args[0].stats, args[1].r)),
+                (type(material), 'rouletteMany', 'roulette', lambda profiler, args, result: profiler.countRoulette(*result)),
+                (type(self), 'removeDeadPhotons', 'roulette', None)]
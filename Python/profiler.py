@@ -0,0 +1,124 @@
+import numpy as np
+import json
+import time
+import functools
+from contextlib import contextmanager
+
+class Profiler:
+    """ Counters and timers for the propagation loop, to know where the
+    time goes without cProfile (which distorts tiny functions like
+    moveBy or roulette too much to be useful).
+
+    It is opt-in and costs nothing when it is not used: the loops of
+    Photons.propagate(material, profiler) and LayerStack.propagate(photon,
+    profiler) have no profiling code. Given a profiler, they run the same
+    loop within instrumenting(probes), which replaces the methods called
+    by the loop (moveBy, absorbEnergy, roulette...) with wrappers that
+    count and time them, and puts the originals back after. Counters
+    (steps, photons, roulette, deposits outside the grid) are exact.
+    Timers only time one call out of sampleEvery of each method, and the
+    time of each stage is extrapolated to all calls. """
+    stages = ('sampling', 'rotation', 'move', 'scoring', 'roulette', 'boundaries')
+    counters = ('photons', 'steps', 'iterations', 'timedCalls', 'rouletteCandidates',
+                'rouletteSurvivors', 'deposits', 'outOfGridDeposits')
+
+    def __init__(self, sampleEvery=10):
+        self.sampleEvery = sampleEvery
+        self.clock = time.perf_counter
+        self.reset()
+
+    def reset(self):
+        self.counts = dict.fromkeys(self.counters, 0)
+        self.times = dict.fromkeys(self.stages, 0.0) # Estimated for all calls
+
+    @contextmanager
+    def instrumenting(self, probes):
+        """ Within the with block, each method of probes, a list of
+        (cls, name, stage, count), is replaced on its class by a wrapper
+        that adds its time to stage (if not None) and calls
+        count(profiler, args, result) after each call (if not None). The
+        methods are restored at the end, even after an exception. """
+        replaced = {}
+        for (cls, name, stage, count) in probes:
+            owner = next(c for c in cls.__mro__ if name in c.__dict__)
+            if (owner, name) not in replaced:
+                replaced[(owner, name)] = owner.__dict__[name]
+                setattr(owner, name, self._wrap(owner.__dict__[name], stage, count))
+        try:
+            yield self
+        finally:
+            for (owner, name), method in replaced.items():
+                setattr(owner, name, method)
+
+    def _wrap(self, method, stage, count):
+        counts = self.counts
+        times = self.times
+        clock = self.clock
+        sampleEvery = self.sampleEvery
+        calls = [0]
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if stage is not None and calls[0] % sampleEvery == 0:
+                t0 = clock()
+                result = method(*args, **kwargs)
+                times[stage] += (clock()-t0)*sampleEvery
+                counts['timedCalls'] += 1
+            else:
+                result = method(*args, **kwargs)
+            calls[0] += 1
+            if count is not None:
+                count(self, args, result)
+            return result
+        return wrapper
+
+    def countPhotons(self, N=1):
+        self.counts['photons'] += N
+
+    def countSteps(self, N=1):
+        """ One iteration of the loop, that moved N photons """
+        self.counts['steps'] += N
+        self.counts['iterations'] += 1
+
+    def countRoulette(self, candidates, survivors):
+        self.counts['rouletteCandidates'] += int(candidates)
+        self.counts['rouletteSurvivors'] += int(survivors)
+
+    def countDeposits(self, stats, positions):
+        """ Deposits of a step, and those outside the grid of stats (a
+        Stats or a tally: clamped to the edges or sent to the overflow,
+        None if nothing is scored) """
+        self.counts['deposits'] += np.size(positions.x)
+        if stats is not None:
+            outside = stats.isOutside(positions)
+            self.counts['outOfGridDeposits'] += int(np.count_nonzero(outside))
+
+    def summary(self) -> dict:
+        counts = self.counts
+        total = sum(self.times.values())
+        return {'counts': dict(counts),
+                'estimatedTimes': dict(self.times),
+                'fractions': {stage: (t/total if total > 0 else 0) for stage, t in self.times.items()},
+                'stepsPerPhoton': counts['steps']/counts['photons'] if counts['photons'] else 0,
+                'rouletteSurvivalRate': counts['rouletteSurvivors']/counts['rouletteCandidates'] if counts['rouletteCandidates'] else 0,
+                'outOfGridFraction': counts['outOfGridDeposits']/counts['deposits'] if counts['deposits'] else 0}
+
+    def restore(self, summary):
+        """ Continue from a summary (e.g. one saved in a checkpoint) """
+        self.reset()
+        self.counts.update(summary['counts'])
+        self.times.update(summary['estimatedTimes'])
+
+    def save(self, filepath="profile.json"):
+        with open(filepath, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def __str__(self):
+        summary = self.summary()
+        lines = ["{0} photons, {1:.1f} steps per photon, roulette survival {2:.1%}, {3:.2%} of deposits outside the grid".format(
+                 summary['counts']['photons'], summary['stepsPerPhoton'],
+                 summary['rouletteSurvivalRate'], summary['outOfGridFraction'])]
+        for stage in self.stages:
+            if summary['estimatedTimes'][stage] > 0:
+                lines.append("{0:12s} {1:8.3f} s {2:6.1%}".format(stage, summary['estimatedTimes'][stage], summary['fractions'][stage]))
+        return "\n".join(lines)
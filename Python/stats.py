@@ -1,17 +1,89 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import json
+import os
+from contextlib import contextmanager
 
-class Stats:
-    def __init__(self, min = (-1, -1, 0), max = (1, 1, 0.5), size = (21,21,21)):
+_magic = b"MCSTATS\n"
+HEADER_SIZE = 4096 # Bytes before the data in the binary files (see encodeHeader)
+
+class BatchMeans:
+    """ Running mean and variance of a quantity (a number or an array of
+    any shape) measured once per batch of photons, with the weighted
+    Welford algorithm: each batch value x is a mean per photon and counts
+    for the number of photons of its batch. The standard error of the
+    mean comes from the scatter between batches, so it is valid whatever
+    the correlations between the deposits of a single photon. """
+    def __init__(self):
+        self.count = 0 # Batches
+        self.weight = 0 # Photons
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, x, weight):
+        self.count += 1
+        self.weight += weight
+        delta = x - self.mean
+        self.mean = self.mean + delta*(weight/self.weight)
+        self.m2 = self.m2 + weight*delta*(x - self.mean)
+
+    @property
+    def variance(self):
+        """ Variance of the mean over all batches """
+        if self.count < 2:
+            return np.full_like(np.asarray(self.mean, dtype=float), np.inf)
+        return self.m2/((self.count-1)*self.weight)
+
+    @property
+    def standardError(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def relativeError(self):
+        """ standardError/mean, infinite where the mean is zero """
+        mean = np.abs(np.asarray(self.mean, dtype=float))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(mean > 0, self.standardError/mean, np.inf)
+
+class PhotonCounter:
+    """ The number of photons launched, for everything that scores them
+    (Stats and the tallies). The propagation entry points (Photons.propagate,
+    LayerStack.launch, VoxelVolume.propagate and propagateMany) call
+    countPhotons once per photon when it is launched, so photons that
+    never deposit anything (or leave right away) are counted too. A loop
+    written by hand must do the same. """
+    photonCount = 0
+
+    def countPhotons(self, N=1):
+        self.photonCount += N
+
+class Stats(PhotonCounter):
+    binaryFormat = 1
+    blockSize = 8 # Voxels per side of the blocks tracked in dirtyBlocks
+
+    def __init__(self, min = (-1, -1, 0), max = (1, 1, 0.5), size = (21,21,21), clampToEdges=True):
         self.min = min
         self.max = max
         self.L = (self.max[0]-self.min[0],self.max[1]-self.min[1],self.max[2]-self.min[2])
         self.size = size
-        self.photons = set()
         self.photonCount = 0
-        self.energy = np.zeros(size)
+        self.eventCount = 0
+        self._clearEnergy()
+        # Deposits outside min-max go to the closest voxel on the edge
+        # or, if clampToEdges is False, to the overflow.
+        self.clampToEdges = clampToEdges
+        self.overflow = 0.0
+        self.overflowCount = 0
         self.figure = None
+        self._allocateDirtyBlocks(dirty=False)
+        self.batchStart = None # See startBatches()
+        self.voxelBatches = None
+        self.depthBatches = None
+        self.absorbedBatches = None
+
+    isSparse = False
+
+    def _clearEnergy(self):
+        self.energy = np.zeros(self.size)
 
     @property
     def xCoords(self):
@@ -35,160 +107,568 @@ class Stats:
 
         return coords
 
-    def save(self, filepath="output.json"):
-        data = {"min":self.min, "max":self.max, "L":self.L,
-                "size":self.size,"energy":self.energy.tolist(),
-                "photonCount":self.photonCount,"photons":list(self.photons)}
+    def save(self, filepath="output.stats"):
+        """ Save in the binary format: a fixed-size header with the grid
+        metadata as JSON, followed by the raw float64 energy array (C
+        order). The file is written with openAtomically, so an existing
+        file (possibly memory-mapped by restore()) is replaced in one
+        step. """
+        header = self._header()
+        with openAtomically(filepath) as write_file:
+            write_file.write(encodeHeader(header))
+            np.ascontiguousarray(self.energy, dtype="<f8").tofile(write_file)
+
+    def _header(self) -> dict:
+        return {"format":Stats.binaryFormat, "min":list(self.min), "max":list(self.max),
+                "size":list(self.size), "dtype":"<f8",
+                "photonCount":int(self.photonCount), "eventCount":int(self.eventCount),
+                "overflow":float(self.overflow), "overflowCount":int(self.overflowCount)}
+
+    def _restoreHeader(self, header):
+        self.min = tuple(header["min"])
+        self.max = tuple(header["max"])
+        self.L = (self.max[0]-self.min[0],self.max[1]-self.min[1],self.max[2]-self.min[2])
+        self.size = tuple(header["size"])
+        self.photonCount = header["photonCount"]
+        self.eventCount = header.get("eventCount", 0)
+        self.overflow = header.get("overflow", 0.0)
+        self.overflowCount = header.get("overflowCount", 0)
+        self._allocateDirtyBlocks(dirty=False)
+
+    def restore(self, filepath="output.stats", mmap=True):
+        """ Restore from a binary file (memory-mapped copy-on-write unless
+        mmap=False: the grid is read lazily and changes are never
+        written back), from a file saved by SparseStats or from an old
+        JSON file. """
+        header = readHeader(filepath)
+        if header is None:
+            self._restoreJSON(filepath)
+            return
 
-        with open(filepath, "w") as write_file:
-            json.dump(data, write_file,indent=4, sort_keys=True)
+        self._restoreHeader(header)
+        if header.get("layout") == "blocks":
+            self._clearEnergy()
+            self.addBlocks(*_mapBlocks(filepath, header, self.blockSize))
+        else:
+            self.energy = _mapEnergy(filepath, header, mode='c')
+            if not mmap:
+                self.energy = np.array(self.energy)
+        self.markAllDirty()
 
-    def restore(self, filepath="output.json"):
+    def append(self, filepath="output.stats"):
+        """ Add the results saved in filepath. A binary file is
+        memory-mapped and added directly into the grid, without
+        an intermediate copy. """
+        header = readHeader(filepath)
+        if header is None:
+            self._appendJSON(filepath)
+            return
+
+        if tuple(self.min) != tuple(header["min"]):
+            raise ValueError("To append, data must have same min")
+        if tuple(self.max) != tuple(header["max"]):
+            raise ValueError("To append, data must have same max")
+        if tuple(self.size) != tuple(header["size"]):
+            raise ValueError("To append, data must have same size")
+
+        self.photonCount += header["photonCount"]
+        self.eventCount += header.get("eventCount", 0)
+        self.overflow += header.get("overflow", 0.0)
+        self.overflowCount += header.get("overflowCount", 0)
+        if header.get("layout") == "blocks":
+            self.addBlocks(*_mapBlocks(filepath, header, self.blockSize))
+        else:
+            self.addEnergy(_mapEnergy(filepath, header, mode='r'))
+        self.markAllDirty()
+
+    def _restoreJSON(self, filepath):
         with open(filepath, "r") as read_file:
             data = json.load(read_file)
 
-        self.min = data["min"]
-        self.max = data["max"]
-        self.L = data["L"]
-        self.size = data["size"]
-        self.photonCount = data["photonCount"]
-        self.photons = set(data["photons"])
+        self.min = tuple(data["min"])
+        self.max = tuple(data["max"])
+        self.L = tuple(data["L"])
+        self.size = tuple(data["size"])
+        # Old files kept the id of every photon
+        self.photonCount = max(data["photonCount"], len(data["photons"]))
+        self.eventCount = 0
+        self._allocateDirtyBlocks(dirty=False)
         self.energy = np.array(data["energy"])
+        self.markAllDirty()
 
-    def append(self, filepath="output.json"):
+    def _appendJSON(self, filepath):
         with open(filepath, "r") as read_file:
             data = json.load(read_file)
 
-        if self.min != data["min"]:
+        # JSON has lists where the grid has tuples
+        if tuple(self.min) != tuple(data["min"]):
             raise ValueError("To append, data must have same min")
-        if self.max != data["max"]:
+        if tuple(self.max) != tuple(data["max"]):
             raise ValueError("To append, data must have same max")
-        if self.L != data["L"]:
+        if tuple(self.L) != tuple(data["L"]):
             raise ValueError("To append, data must have same L")
-        if self.size != data["size"]:
+        if tuple(self.size) != tuple(data["size"]):
             raise ValueError("To append, data must have same size")
 
-        self.photonCount += data["photonCount"]
-        self.photons.add(set(data["photons"]))
+        self.photonCount += max(data["photonCount"], len(data["photons"]))
         self.energy = np.add(self.energy, np.array(data["energy"]))
+        self.markAllDirty()
+
+    def merge(self, stats):
+        """ Add the results of another Stats with the same grid, for
+        instance the one obtained by another process """
+        if tuple(self.min) != tuple(stats.min):
+            raise ValueError("To merge, stats must have same min")
+        if tuple(self.max) != tuple(stats.max):
+            raise ValueError("To merge, stats must have same max")
+        if tuple(self.size) != tuple(stats.size):
+            raise ValueError("To merge, stats must have same size")
+
+        self.photonCount += stats.photonCount
+        self.eventCount += stats.eventCount
+        self.overflow += stats.overflow
+        self.overflowCount += stats.overflowCount
+        if stats.isSparse:
+            self.addBlocks(*stats.blockValues())
+        else:
+            self.addEnergy(stats.energy)
+        self.dirtyBlocks |= stats.dirtyBlocks
+
+    def startBatches(self):
+        """ Start tracking the mean and variance between batches of
+        photons, per voxel (voxelBatches), per depth (depthBatches, like
+        A_z) and for the total (absorbedBatches). Call endBatch() after
+        each batch: the cost is one pass over the grid per batch, nothing
+        per photon. """
+        self.batchStart = np.array(self.energy)
+        self.voxelBatches = BatchMeans()
+        self.depthBatches = BatchMeans()
+        self.absorbedBatches = BatchMeans()
+
+    def endBatch(self, photonCount):
+        """ photonCount photons were propagated since the last call """
+        batch = (self.energy - self.batchStart)/photonCount
+        self.voxelBatches.update(batch, photonCount)
+        depth = batch.sum(axis=(0,1))
+        self.depthBatches.update(depth, photonCount)
+        self.absorbedBatches.update(float(depth.sum()), photonCount)
+        np.copyto(self.batchStart, self.energy)
+
+    def relativeError(self, region=None) -> float:
+        """ Largest relative error (standard error/mean) of the voxels in
+        region (an index of the grid, e.g. a tuple of slices or a
+        boolean mask), or of the total absorbed energy if region is None """
+        if region is None:
+            return float(self.absorbedBatches.relativeError)
+        return float(np.max(self.voxelBatches.relativeError[region]))
+
+    def _allocateDirtyBlocks(self, dirty):
+        """ dirtyBlocks tells which blocks of blockSize^3 voxels changed
+        since the last clearDirtyBlocks(), so that a checkpoint only
+        writes those """
+        shape = tuple((n + self.blockSize - 1)//self.blockSize for n in self.size)
+        self.dirtyBlocks = np.full(shape, dirty, dtype=bool)
+
+    def markAllDirty(self):
+        self._allocateDirtyBlocks(dirty=True)
+
+    def clearDirtyBlocks(self):
+        self.dirtyBlocks[...] = False
 
     def score(self, photon, delta):
-        self.photons.add(photon.uniqueId)
-        position = photon.r
+        self.eventCount += 1
+        self.scoreAt(photon.r, delta)
+
+    def contains(self, position) -> bool:
+        for axis, coordinate in enumerate((position.x, position.y, position.z)):
+            if coordinate < self.min[axis] or coordinate > self.max[axis]:
+                return False
+        return True
 
-        i = int((self.size[0]-1)*(position.x-self.min[0])/self.L[0])
-        j = int((self.size[1]-1)*(position.y-self.min[1])/self.L[1])
-        k = int((self.size[2]-1)*(position.z-self.min[2])/self.L[2])
+    def isOutside(self, positions) -> np.ndarray:
+        """ Which positions (x, y and z arrays) are outside min-max """
+        outside = False
+        for axis, coordinates in enumerate((positions.x, positions.y, positions.z)):
+            coordinates = np.asarray(coordinates)
+            outside = outside | (coordinates < self.min[axis]) | (coordinates > self.max[axis])
+        return outside
 
-        # print(position, self.min, self.max, self.L)
-        # print(i,j,k)
+    def voxelIndex(self, position) -> (int, int, int):
+        """ Indices of the voxel of position, clamped to the edges """
+        (nx, ny, nz) = self.size
+        (xMin, yMin, zMin) = self.min
+        (Lx, Ly, Lz) = self.L
+        i = int((nx-1)*(position.x-xMin)/Lx)
+        j = int((ny-1)*(position.y-yMin)/Ly)
+        k = int((nz-1)*(position.z-zMin)/Lz)
 
         if i < 0:
             i = 0
-        elif i > self.size[0]-1:
-            i = self.size[0]-1    
+        elif i > nx-1:
+            i = nx-1
 
         if j < 0:
             j = 0
-        elif j > self.size[1]-1:
-            j = self.size[1]-1    
+        elif j > ny-1:
+            j = ny-1
 
         if k < 0:
             k = 0
-        elif k > self.size[2]-1:
-            k = self.size[2]-1    
+        elif k > nz-1:
+            k = nz-1
+
+        return (i, j, k)
+
+    def voxelIndices(self, positions) -> (list, np.ndarray):
+        """ Same as voxelIndex for x, y and z arrays. Also returns which
+        positions are inside min-max (None if clampToEdges) """
+        indices = []
+        inside = None
+        for axis, coordinates in enumerate((positions.x, positions.y, positions.z)):
+            coordinates = np.asarray(coordinates)
+            index = ((self.size[axis]-1)*(coordinates-self.min[axis])/self.L[axis]).astype(int)
+            indices.append(np.clip(index, 0, self.size[axis]-1))
+            if not self.clampToEdges:
+                isInside = (coordinates >= self.min[axis]) & (coordinates <= self.max[axis])
+                inside = isInside if inside is None else inside & isInside
+        return (indices, inside)
+
+    def scoreAt(self, position, delta):
+        if not self.clampToEdges and not self.contains(position):
+            self.overflow += delta
+            self.overflowCount += 1
+            return
+
+        (i, j, k) = self.voxelIndex(position)
+        self.addAt(i, j, k, delta)
+        b = self.blockSize
+        self.dirtyBlocks[i//b, j//b, k//b] = True
+
+    def scoreMany(self, positions, deltas):
+        """ Score many deposits at once: positions has x, y and z arrays
+        (e.g. Vectors) and deltas one weight per position. The voxel
+        indices are computed like scoreAt() for all deposits, then added
+        with a single scatter-add on the flattened grid. """
+        deltas = np.asarray(deltas, dtype=float)
+        N = len(deltas)
+        if N == 0:
+            return
+        self.eventCount += N
 
+        (indices, inside) = self.voxelIndices(positions)
+        b = self.blockSize
+        self.dirtyBlocks[indices[0]//b, indices[1]//b, indices[2]//b] = True
+        if inside is not None and not inside.all():
+            self.overflow += float(deltas[~inside].sum())
+            self.overflowCount += N - int(np.count_nonzero(inside))
+            indices = [index[inside] for index in indices]
+            deltas = deltas[inside]
+        self.addMany(indices, deltas)
+
+    def addAt(self, i, j, k, delta):
         self.energy[i,j,k] += delta
 
+    def addMany(self, indices, deltas):
+        """ Add deltas to the voxels at indices (i, j and k arrays) """
+        flatIndices = np.ravel_multi_index(indices, self.size)
+        flatEnergy = self.energy.reshape(-1)
+        if len(deltas) > flatEnergy.size // 8:
+            flatEnergy += np.bincount(flatIndices, weights=deltas, minlength=flatEnergy.size)
+        else:
+            np.add.at(flatEnergy, flatIndices, deltas)
+
+    @property
+    def nbytes(self) -> int:
+        """ Memory used by the grid """
+        return self.energy.nbytes
+
+    def block(self, i, j, k) -> np.ndarray:
+        """ The voxels of block (i, j, k) of dirtyBlocks (a view, smaller
+        than blockSize^3 on the last blocks of the grid if its size is
+        not a multiple of blockSize) """
+        b = self.blockSize
+        return self.energy[i*b:(i+1)*b, j*b:(j+1)*b, k*b:(k+1)*b]
+
+    def addEnergy(self, energy):
+        """ Add a whole grid of the same size """
+        self.energy += energy
+
+    def blockValues(self) -> (np.ndarray, np.ndarray):
+        """ The indices of the blocks that are not all zero, and their
+        values (blockSize^3 each) """
+        return _nonzeroBlocks(self.energy, self.blockSize)
+
+    def addBlocks(self, blocks, values):
+        """ Add values (one blockSize^3 array per block) to blocks (their
+        i, j, k indices), e.g. from a file saved by SparseStats """
+        for (i, j, k), value in zip(blocks, values):
+            block = self.block(i, j, k)
+            block += value[:block.shape[0], :block.shape[1], :block.shape[2]]
+            self.dirtyBlocks[i, j, k] = True
+
+    def energyAt(self, index) -> np.ndarray:
+        """ Part of the grid, e.g. energyAt(np.s_[:,:,10]) """
+        return np.asarray(self.energy[index])
+
+    def energySum(self, axis) -> np.ndarray:
+        """ The grid summed along axis (an int or a tuple) """
+        return self.energy.sum(axis=axis)
+
     def show3D(self):
         raise NotImplementedError()
 
     def show2D(self, plane:str, cutAt:int= None, integratedAlong:str=None, title="", realtime=True):
-        if integratedAlong is None and cutAt is None:
-            raise ValueError("You must provide cutAt= or integratedAlong=")
-        elif integratedAlong is not None and cutAt is not None:
-            raise ValueError("You cannot provide both cutAt= and integratedAlong=")
-        elif integratedAlong is None and cutAt is not None:
-            if plane == 'xy':
-                cutAt = int((self.size[2]-1)/2)
-            elif plane == 'yz':
-                cutAt = int((self.size[0]-1)/2)
-            elif plane == 'xz':
-                cutAt = int((self.size[1]-1)/2)
-
-        if self.figure == None:
-            plt.ion()
-            self.figure = plt.figure()
-
-        plt.title("Energy in {0}, {1} photons".format(plane, len(self.photons)))
-        if cutAt is not None:
-            if plane == 'xy':
-                plt.imshow(np.log(self.energy[:,:,cutAt]+0.0001),cmap='hsv',extent=[self.min[0],self.max[0],self.min[1],self.max[1]],aspect='auto')
-            elif plane == 'yz':
-                plt.imshow(np.log(self.energy[cutAt,:,:]+0.0001),cmap='hsv',extent=[self.min[1],self.max[1],self.min[2],self.max[2]],aspect='auto')
-            elif plane == 'xz':
-                plt.imshow(np.log(self.energy[:,cutAt,:]+0.0001),cmap='hsv',extent=[self.min[0],self.max[0],self.min[2],self.max[2]],aspect='auto')
-        else:
-            if plane == 'xy':
-                sum = self.energy.sum(axis=2)
-                plt.imshow(np.log(sum+0.0001),cmap='hsv',extent=[self.min[0],self.max[0],self.min[1],self.max[1]],aspect='auto')
-            elif plane == 'yz':
-                sum = self.energy.sum(axis=0)
-                plt.imshow(np.log(sum+0.0001),cmap='hsv',extent=[self.min[1],self.max[1],self.min[2],self.max[2]],aspect='auto')
-            elif plane == 'xz':
-                sum = self.energy.sum(axis=1)
-                plt.imshow(np.log(sum+0.0001),cmap='hsv',extent=[self.min[2],self.max[2],self.min[0],self.max[0]],aspect='auto')
-
-        if realtime:
-            plt.show()
-            plt.pause(0.0001)
-            plt.clf()
-        else:
-            plt.ioff()
-            plt.show()
+        """ See visualization.show2D (matplotlib is imported only now) """
+        from visualization import show2D
+        show2D(self, plane, cutAt=cutAt, integratedAlong=integratedAlong, title=title, realtime=realtime)
 
     def show1D(self, axis:str, cutAt=None, integratedAlong=None, title="", realtime=True):
-        if integratedAlong is None and cutAt is None:
-            # Assume integral
-            raise ValueError("You should provide cutAt=(x0, x1) or integratedAlong='xy'.")
-        elif integratedAlong is not None and cutAt is not None:
-            raise ValueError("You cannot provide both cutAt= and integratedAlong=")
-        elif integratedAlong is None and cutAt is not None:
-            if axis == 'x':
-                cutAt = (int((self.size[1]-1)/2),int((self.size[2]-1)/2))
-            elif axis == 'y':
-                cutAt = (int((self.size[0]-1)/2),int((self.size[2]-1)/2))
-            elif axis == 'z':
-                cutAt = (int((self.size[0]-1)/2),int((self.size[1]-1)/2))
-
-        if self.figure == None:
-            plt.ion()
-            self.figure = plt.figure()
-
-        plt.title(title)
-        if cutAt is not None:
-            if axis == 'z':
-                plt.plot(self.zCoords, np.log(self.energy[cutAt[0],cutAt[1],:]+0.0001),'ko--')
-            elif axis == 'y':
-                plt.plot(self.yCoords, np.log(self.energy[cutAt[0],:,cutAt[1]]+0.0001),'ko--')
-            elif axis == 'x':
-                plt.plot(self.xCoords, np.log(self.energy[:,cutAt[0],cutAt[1]]+0.0001),'ko--')
+        """ See visualization.show1D """
+        from visualization import show1D
+        show1D(self, axis, cutAt=cutAt, integratedAlong=integratedAlong, title=title, realtime=realtime)
+
+class SparseStats(Stats):
+    """ Same as Stats, but the grid is stored by blocks of blockSize^3
+    voxels, allocated the first time something is deposited in them: the
+    memory depends on the volume the photons actually reach, not on the
+    size of the grid. It saves memory when the photons reach a small part
+    of the grid: each block reached takes 4 kB, a bit more than in a
+    Stats, and the slots 8 bytes per block of the grid. With
+    clampToEdges (the default), photons that leave the grid fill the
+    blocks of its faces.
+
+    The blocks are kept together in pool, and slots gives the position of
+    each block in the pool (-1 if not allocated yet), so scoring many
+    deposits is still a single scatter-add. Projections (show1D, show2D),
+    save, restore, append and merge work block by block. energy gives the
+    whole grid as a dense array (e.g. for Monitor or startBatches), with
+    the memory of the full grid. """
+    isSparse = True
+
+    def _clearEnergy(self):
+        b = self.blockSize
+        shape = tuple((n + b - 1)//b for n in self.size)
+        self.slots = np.full(shape, -1, dtype=np.int64)
+        self.blocks = np.zeros((0, 3), dtype=np.int64) # i, j, k of each block in the pool
+        self.pool = np.zeros((0, b, b, b))
+        self.blockCount = 0
+
+    @property
+    def energy(self) -> np.ndarray:
+        b = self.blockSize
+        energy = np.zeros(self.size)
+        for (i, j, k), value in zip(self.blocks[:self.blockCount], self.pool):
+            block = energy[i*b:(i+1)*b, j*b:(j+1)*b, k*b:(k+1)*b]
+            block += value[:block.shape[0], :block.shape[1], :block.shape[2]]
+        return energy
+
+    @energy.setter
+    def energy(self, energy):
+        self._clearEnergy()
+        self.addEnergy(energy)
+
+    @property
+    def nbytes(self) -> int:
+        return self.pool.nbytes + self.slots.nbytes + self.blocks.nbytes
+
+    def allocate(self, i, j, k):
+        """ Allocate the blocks at i, j, k (arrays of block indices, not
+        allocated yet and without duplicates) """
+        b = self.blockSize
+        first = self.blockCount
+        needed = first + len(i)
+        if needed > len(self.pool):
+            # Grown by chunks of 1/64 of the grid (not doubled), and never
+            # beyond the number of blocks of the grid
+            chunk = max(self.slots.size//64, 64)
+            capacity = min(max(needed, len(self.pool) + chunk), self.slots.size)
+            pool = np.zeros((capacity, b, b, b))
+            pool[:first] = self.pool[:first]
+            blocks = np.zeros((capacity, 3), dtype=np.int64)
+            blocks[:first] = self.blocks[:first]
+            self.pool = pool
+            self.blocks = blocks
+        self.slots[i, j, k] = np.arange(first, needed)
+        self.blocks[first:needed] = np.column_stack((i, j, k))
+        self.blockCount = needed
+
+    def slotsOf(self, bi, bj, bk) -> np.ndarray:
+        """ The slots of the blocks at bi, bj, bk, allocated if needed """
+        slots = self.slots[bi, bj, bk]
+        missing = slots < 0
+        if np.any(missing):
+            keys = np.unique(np.ravel_multi_index((np.asarray(bi)[missing], np.asarray(bj)[missing],
+                                                   np.asarray(bk)[missing]), self.slots.shape))
+            self.allocate(*np.unravel_index(keys, self.slots.shape))
+            slots = self.slots[bi, bj, bk]
+        return slots
+
+    def addAt(self, i, j, k, delta):
+        b = self.blockSize
+        slot = self.slots[i//b, j//b, k//b]
+        if slot < 0:
+            slot = self.slotsOf([i//b], [j//b], [k//b])[0]
+        self.pool[slot, i%b, j%b, k%b] += delta
+
+    def addMany(self, indices, deltas):
+        b = self.blockSize
+        (i, j, k) = indices
+        slots = self.slotsOf(i//b, j//b, k//b)
+        flatIndices = ((slots*b + i%b)*b + j%b)*b + k%b
+        flatPool = self.pool[:self.blockCount].reshape(-1)
+        if len(deltas) > flatPool.size // 8:
+            flatPool += np.bincount(flatIndices, weights=deltas, minlength=flatPool.size)
         else:
-            if axis == 'z':
-                sum = self.energy.sum(axis=(0,1))
-                plt.plot(self.zCoords, np.log(sum+0.0001),'ko--')
-            elif axis == 'y':
-                sum = self.energy.sum(axis=(0,2))
-                plt.plot(self.yCoords, np.log(sum+0.0001),'ko--')
-            elif axis == 'x':
-                sum = self.energy.sum(axis=(1,2))
-                plt.plot(self.xCoords, np.log(sum+0.0001),'ko--')
-
-        if realtime:
-            plt.show()
-            plt.pause(0.0001)
-            plt.clf()
+            np.add.at(flatPool, flatIndices, deltas)
+
+    def block(self, i, j, k) -> np.ndarray:
+        b = self.blockSize
+        slot = self.slotsOf([i], [j], [k])[0]
+        return self.pool[slot, :self.size[0]-i*b, :self.size[1]-j*b, :self.size[2]-k*b]
+
+    def addEnergy(self, energy):
+        self.addBlocks(*_nonzeroBlocks(energy, self.blockSize))
+
+    def blockValues(self) -> (np.ndarray, np.ndarray):
+        """ The allocated blocks (some may still be zero) and their values """
+        return (self.blocks[:self.blockCount], self.pool[:self.blockCount])
+
+    def addBlocks(self, blocks, values):
+        if len(blocks) == 0:
+            return
+        blocks = np.asarray(blocks)
+        (i, j, k) = (blocks[:,0], blocks[:,1], blocks[:,2])
+        slots = self.slotsOf(i, j, k)
+        self.pool[slots] += values
+        self.dirtyBlocks[i, j, k] = True
+
+    def markAllDirty(self):
+        """ Only the allocated blocks: the others are all zero and a
+        checkpoint must not allocate them """
+        self._allocateDirtyBlocks(dirty=False)
+        blocks = self.blocks[:self.blockCount]
+        self.dirtyBlocks[blocks[:,0], blocks[:,1], blocks[:,2]] = True
+
+    def energyAt(self, index) -> np.ndarray:
+        b = self.blockSize
+        voxels = [np.arange(n)[i] for n, i in zip(self.size, index)]
+        shape = tuple(len(v) for v in voxels if np.ndim(v) > 0)
+        voxels = [np.atleast_1d(v) for v in voxels]
+        result = np.zeros(tuple(len(v) for v in voxels))
+        for block, value in zip(self.blocks[:self.blockCount], self.pool):
+            positions = [np.nonzero(v//b == bIndex)[0] for v, bIndex in zip(voxels, block)]
+            if all(len(p) > 0 for p in positions):
+                local = [v[p] % b for v, p in zip(voxels, positions)]
+                result[np.ix_(*positions)] = value[np.ix_(*local)]
+        return result.reshape(shape)
+
+    def energySum(self, axis) -> np.ndarray:
+        b = self.blockSize
+        axes = (axis,) if np.ndim(axis) == 0 else tuple(axis)
+        kept = [a for a in range(3) if a not in axes]
+        result = np.zeros(tuple(self.slots.shape[a]*b for a in kept))
+        for block, value in zip(self.blocks[:self.blockCount], self.pool):
+            result[tuple(slice(block[a]*b, (block[a]+1)*b) for a in kept)] += value.sum(axis=axes)
+        return result[tuple(slice(0, self.size[a]) for a in kept)]
+
+    def save(self, filepath="output.stats"):
+        """ Same header as Stats.save, followed by the indices of the
+        blocks (int64, blockCount x 3) and their values (blockCount x
+        blockSize^3). Stats.restore and Stats.append can read it. """
+        header = self._header()
+        header.update({"layout":"blocks", "blockSize":self.blockSize, "blockCount":int(self.blockCount)})
+        with openAtomically(filepath) as write_file:
+            write_file.write(encodeHeader(header))
+            np.ascontiguousarray(self.blocks[:self.blockCount], dtype="<i8").tofile(write_file)
+            np.ascontiguousarray(self.pool[:self.blockCount], dtype="<f8").tofile(write_file)
+
+    def restore(self, filepath="output.stats", mmap=True):
+        """ Restore from any file that Stats.restore reads. The blocks are
+        read in memory: mmap is ignored. """
+        header = readHeader(filepath)
+        if header is None:
+            self._restoreJSON(filepath)
+            return
+
+        self._restoreHeader(header)
+        self._clearEnergy()
+        if header.get("layout") == "blocks":
+            self.addBlocks(*_mapBlocks(filepath, header, self.blockSize))
         else:
-            plt.ioff()
-            plt.show()
+            self.addEnergy(_mapEnergy(filepath, header, mode='r'))
+        self.markAllDirty()
+
+@contextmanager
+def openAtomically(filepath):
+    """ A binary file to write that replaces filepath when the block
+    ends: it is written under a temporary name, flushed to the disk
+    (fsync) and renamed, and the rename itself is flushed. filepath is
+    then either the old file or the complete new one, even if the
+    process or the machine stops in the middle. """
+    temporaryPath = filepath + ".tmp"
+    with open(temporaryPath, "wb") as file:
+        yield file
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporaryPath, filepath)
+    if hasattr(os, "O_DIRECTORY"): # Not on Windows
+        directory = os.open(os.path.dirname(os.path.abspath(filepath)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+def encodeHeader(header, magic=_magic) -> bytes:
+    """ The fixed-size header of the binary files, HEADER_SIZE bytes: the
+    magic, then the header as JSON. Stats files use the default magic,
+    other formats (the exit records of a Detector) pass their own. """
+    data = magic + json.dumps(header).encode("utf-8") + b"\n"
+    if len(data) > HEADER_SIZE:
+        raise ValueError("Header too large")
+    return data.ljust(HEADER_SIZE, b" ")
+
+def readHeader(filepath, magic=_magic):
+    """ The header of a binary Stats file (or of another format with its
+    magic), or None if it is not one (i.e. an old JSON file) """
+    with open(filepath, "rb") as read_file:
+        data = read_file.read(HEADER_SIZE)
+    if not data.startswith(magic):
+        return None
+    return json.loads(data[len(magic):].decode("utf-8"))
+
+def _mapEnergy(filepath, header, mode):
+    return np.memmap(filepath, dtype=header["dtype"], mode=mode,
+                     offset=HEADER_SIZE, shape=tuple(header["size"]))
+
+def _mapBlocks(filepath, header, blockSize):
+    """ The block indices and values of a file saved by SparseStats """
+    n = header["blockCount"]
+    b = header["blockSize"]
+    if b != blockSize:
+        raise ValueError("The blocks of {0} are not {1} voxels wide".format(filepath, blockSize))
+    if n == 0:
+        return (np.zeros((0,3), dtype=int), np.zeros((0,b,b,b)))
+    blocks = np.memmap(filepath, dtype="<i8", mode='r', offset=HEADER_SIZE, shape=(n, 3))
+    values = np.memmap(filepath, dtype=header["dtype"], mode='r',
+                       offset=HEADER_SIZE + blocks.nbytes, shape=(n, b, b, b))
+    return (blocks, values)
+
+def _nonzeroBlocks(energy, b) -> (np.ndarray, np.ndarray):
+    """ The blocks of b^3 voxels of a dense grid that are not all zero,
+    padded with zeros to b^3 on the edges of the grid """
+    blocks = []
+    values = []
+    (nx, ny, nz) = energy.shape
+    for i in range(0, nx, b):
+        for j in range(0, ny, b):
+            for k in range(0, nz, b):
+                block = energy[i:i+b, j:j+b, k:k+b]
+                if block.any():
+                    value = np.zeros((b, b, b))
+                    value[:block.shape[0], :block.shape[1], :block.shape[2]] = block
+                    blocks.append((i//b, j//b, k//b))
+                    values.append(value)
+    if not blocks:
+        return (np.zeros((0,3), dtype=int), np.zeros((0,b,b,b)))
+    return (np.array(blocks), np.array(values))
 
@@ -0,0 +1,169 @@
+import numpy as np
+import os
+import itertools
+import subprocess
+import multiprocessing
+import warnings
+from mco import readMCO
+
+class Sweep:
+    """ A parameter sweep of a single layer (like the spinalCord runs):
+    every combination of the values in the grid is an independent run.
+
+        sweep = Sweep({'mua':[0.01, 0.1, 0.5, 1.0], 'd':[0.1, 1.0]}, mus=35.9, g=0.86, n=1.4)
+        results = sweep.run("muaDep", engine='mcml')
+        results.grid('Rd') # 4 x 2 array
+
+    The parameters are those of an .mci run: n, mua, mus (or musx and musz
+    separately), g, d (thickness), photons, dz, dr, nz, nr, na, indexAbove
+    and indexBelow. Any of them can be in the grid or fixed.
+
+    Each run is written to its own .mci file and the runs are dispatched
+    to a pool of processes, each running either the compiled mcml (C)
+    or the Python LayerStack.
+
+    The two engines differ when musx != musz: the Python Material scatters
+    with a coefficient that depends on the direction, but the C mcml reads
+    musz and ignores it (computeAnisoptropicMus in mcmlgo.c returns musx),
+    so run() warns. """
+    defaults = {'n':1.4, 'mua':0.01, 'mus':35.9, 'musx':None, 'musz':None,
+                'g':0.86, 'd':1.0, 'photons':100000,
+                'dz':20e-4, 'dr':20e-4, 'nz':10, 'nr':20, 'na':30,
+                'indexAbove':1.0, 'indexBelow':1.0}
+
+    def __init__(self, grid:dict, **fixed):
+        for name in list(grid) + list(fixed):
+            if name not in self.defaults:
+                raise ValueError("Unknown sweep parameter: {0}".format(name))
+        self.grid = {name:list(values) for name, values in grid.items()}
+        self.fixed = fixed
+
+    @property
+    def names(self) -> list:
+        return list(self.grid)
+
+    @property
+    def shape(self) -> tuple:
+        return tuple(len(values) for values in self.grid.values())
+
+    @property
+    def runs(self) -> list:
+        """ The parameters of every run, the last parameter of the grid
+        changing fastest """
+        runs = []
+        for values in itertools.product(*self.grid.values()):
+            parameters = dict(self.defaults)
+            parameters.update(self.fixed)
+            parameters.update(zip(self.names, values))
+            if parameters['musx'] is None:
+                parameters['musx'] = parameters['mus']
+            if parameters['musz'] is None:
+                parameters['musz'] = parameters['mus']
+            runs.append(parameters)
+        return runs
+
+    def writeMCI(self, directory) -> list:
+        """ One .mci file per run (run000.mci, run001.mci...), each
+        writing its own run000.mco. Returns the paths of the .mci files. """
+        os.makedirs(directory, exist_ok=True)
+        filepaths = []
+        for i, parameters in enumerate(self.runs):
+            filepath = os.path.join(directory, "run{0:03d}.mci".format(i))
+            with open(filepath, "w") as file:
+                file.write(mciText(parameters, "run{0:03d}.mco".format(i)))
+            filepaths.append(filepath)
+        return filepaths
+
+    def run(self, directory, engine='mcml', mcml="mcml", processes=None, seed=None):
+        """ Write the runs to directory and run them in parallel with the
+        C mcml executable (engine='mcml') or with the Python LayerStack
+        (engine='python'). Returns SweepResults. """
+        runs = self.runs
+        if any(p['musx'] != p['musz'] for p in runs):
+            warnings.warn("musx != musz: the C mcml ignores musz (it only uses musx), the Python "
+                          "LayerStack does not, so the two engines do not give the same results")
+        filepaths = self.writeMCI(directory)
+
+        if engine == 'mcml':
+            mcml = os.path.abspath(mcml) if os.path.exists(mcml) else mcml
+            tasks = [(mcml, filepath) for filepath in filepaths]
+            target = _runMCML
+        elif engine == 'python':
+            seeds = np.random.SeedSequence(seed).spawn(len(runs))
+            tasks = list(zip(runs, seeds))
+            target = _runPython
+        else:
+            raise ValueError("engine must be 'mcml' or 'python'")
+
+        with multiprocessing.Pool(processes=processes) as pool:
+            rats = pool.starmap(target, tasks)
+
+        return SweepResults(self, np.array(rats).reshape(self.shape + (4,)))
+
+class SweepResults:
+    """ Rsp, Rd, A and Tt of every run of a Sweep, indexed by parameter:
+    grid('Rd')[i,j] is the diffuse reflectance for the i-th value of the
+    first parameter and j-th of the second. table is the same data with
+    one row per run. """
+    quantities = ('Rsp', 'Rd', 'A', 'Tt')
+
+    def __init__(self, sweep, RAT):
+        self.sweep = sweep
+        self.RAT = RAT
+
+    def grid(self, quantity) -> np.ndarray:
+        return self.RAT[..., self.quantities.index(quantity)]
+
+    @property
+    def table(self) -> np.ndarray:
+        """ Structured array with the swept parameters and the results """
+        fields = [(name, float) for name in self.sweep.names] + [(q, float) for q in self.quantities]
+        table = np.zeros(len(self.sweep.runs), dtype=fields)
+        for row, parameters in zip(table, self.sweep.runs):
+            for name in self.sweep.names:
+                row[name] = parameters[name]
+        flat = self.RAT.reshape(-1, 4)
+        for i, quantity in enumerate(self.quantities):
+            table[quantity] = flat[:, i]
+        return table
+
+def mciText(parameters, outputFilename) -> str:
+    """ The .mci input of a single run of one layer, in the format read by
+    C-mcml/mcmlio.c (n mua musx musz g d) """
+    p = parameters
+    lines = ["1.0 # file version",
+             "1 # Number of runs",
+             "",
+             "{0} A".format(outputFilename),
+             "{0}".format(int(p['photons'])),
+             "{0} {1} # dz, dr".format(p['dz'], p['dr']),
+             "{0} {1} {2} # No. of dz, dr & da".format(int(p['nz']), int(p['nr']), int(p['na'])),
+             "",
+             "1 # Number of layers",
+             "#n mua musx musz g d",
+             "{0}".format(p['indexAbove']),
+             "{0} {1} {2} {3} {4} {5}".format(p['n'], p['mua'], p['musx'], p['musz'], p['g'], p['d']),
+             "{0}".format(p['indexBelow']),
+             ""]
+    return "\n".join(lines)
+
+def _runMCML(mcml, mciPath) -> list:
+    directory = os.path.dirname(os.path.abspath(mciPath))
+    subprocess.run([mcml, os.path.basename(mciPath)], cwd=directory, check=True,
+                   stdout=subprocess.DEVNULL)
+    return list(readMCO(os.path.splitext(mciPath)[0] + ".mco").RAT)
+
+def _runPython(parameters, seed) -> list:
+    from layers import LayerStack
+    from material import Material
+    from photon import Photon
+
+    p = parameters
+    np.random.seed(seed.generate_state(8))
+    material = Material(mu_s=p['musx'], mu_a=p['mua'], g=p['g'], index=p['n'], mu_sz=p['musz'])
+    stack = LayerStack.withThicknesses([material], [p['d']],
+                                       indexAbove=p['indexAbove'], indexBelow=p['indexBelow'])
+    for i in range(int(p['photons'])):
+        stack.propagate(Photon())
+    return [stack.specularReflectance, stack.diffuseReflectance,
+            stack.absorbance, stack.transmittance]
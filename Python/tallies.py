@@ -0,0 +1,353 @@
+import numpy as np
+import math
+import time
+from stats import PhotonCounter
+
+class Tally(PhotonCounter):
+    """ A histogram of weights on a regular grid starting at 0, with bins
+    of width deltas[axis] and sizes[axis] bins per axis. This is the
+    binning engine shared by all tallies: subclasses only compute the
+    coordinates of what they score (radius, depth, exit angle...), and
+    score() (one value) or scoreMany() (arrays, added with a single
+    scatter-add like Stats.scoreMany) do the rest.
+
+    Like MCML, a value beyond the last bin is scored in the last bin (and
+    a negative one in the first): isOutside() tells which ones were. """
+    def __init__(self, deltas, sizes):
+        self.deltas = tuple(float(delta) for delta in deltas)
+        self.sizes = tuple(int(size) for size in sizes)
+        self.values = np.zeros(self.sizes)
+        self.photonCount = 0
+        self.eventCount = 0
+
+    def reset(self):
+        self.values[...] = 0
+        self.photonCount = 0
+        self.eventCount = 0
+
+    def flatIndex(self, coordinates) -> int:
+        index = 0
+        for value, delta, size in zip(coordinates, self.deltas, self.sizes):
+            i = int(value/delta)
+            if i > size-1:
+                i = size-1
+            elif i < 0:
+                i = 0
+            index = index*size + i
+        return index
+
+    def flatIndices(self, coordinates) -> np.ndarray:
+        indices = [np.clip((np.asarray(value)/delta).astype(int), 0, size-1)
+                   for value, delta, size in zip(coordinates, self.deltas, self.sizes)]
+        return np.ravel_multi_index(indices, self.sizes)
+
+    def add(self, coordinates, weight):
+        self.eventCount += 1
+        self.values.reshape(-1)[self.flatIndex(coordinates)] += weight
+
+    def addMany(self, coordinates, weights):
+        weights = np.asarray(weights, dtype=float)
+        N = len(weights)
+        if N == 0:
+            return
+        self.eventCount += N
+
+        flatIndices = self.flatIndices(coordinates)
+        flatValues = self.values.reshape(-1)
+        if N > flatValues.size // 8:
+            flatValues += np.bincount(flatIndices, weights=weights, minlength=flatValues.size)
+        else:
+            np.add.at(flatValues, flatIndices, weights)
+
+    def isOutsideGrid(self, coordinates) -> np.ndarray:
+        outside = False
+        for value, delta, size in zip(coordinates, self.deltas, self.sizes):
+            value = np.asarray(value)
+            outside = outside | (value < 0) | (value >= delta*size)
+        return outside
+
+    def merge(self, tally):
+        """ Add the results of another tally with the same grid """
+        if type(self) != type(tally) or self.deltas != tally.deltas or self.sizes != tally.sizes:
+            raise ValueError("To merge, tallies must have the same grid")
+        self.values += tally.values
+        self.photonCount += tally.photonCount
+        self.eventCount += tally.eventCount
+
+    def binCenters(self, axis) -> np.ndarray:
+        return (np.arange(self.sizes[axis]) + 0.5)*self.deltas[axis]
+
+class AbsorptionTally(Tally):
+    """ A tally of absorbed energy that can replace Stats in a Material or
+    a LayerStack: it has the same score(photon, delta), scoreMany(positions,
+    deltas) and countPhotons(N). """
+    def coordinatesOf(self, x, y, z):
+        raise NotImplementedError()
+
+    def score(self, photon, delta):
+        r = photon.r
+        self.add(self.coordinatesOf(r.x, r.y, r.z), delta)
+
+    def scoreMany(self, positions, deltas):
+        self.addMany(self.coordinatesOf(np.asarray(positions.x), np.asarray(positions.y), np.asarray(positions.z)), deltas)
+
+    def isOutside(self, positions) -> np.ndarray:
+        """ Positions scored in an edge bin because they are beyond the grid """
+        return self.isOutsideGrid(self.coordinatesOf(np.asarray(positions.x), np.asarray(positions.y), np.asarray(positions.z)))
+
+class CylindricalTally(AbsorptionTally):
+    """ Absorbed energy in rings around the z axis, A_rz[ir, iz] of MCML:
+    nr rings of width dr and nz slices of thickness dz from z = 0. For a
+    problem with radial symmetry, this is what a 3D grid would give after
+    averaging over the angle, with far fewer bins and far less noise. """
+    def __init__(self, nr, nz, dr, dz):
+        super().__init__(deltas=(dr, dz), sizes=(nr, nz))
+
+    @property
+    def nr(self) -> int:
+        return self.sizes[0]
+
+    @property
+    def nz(self) -> int:
+        return self.sizes[1]
+
+    @property
+    def dr(self) -> float:
+        return self.deltas[0]
+
+    @property
+    def dz(self) -> float:
+        return self.deltas[1]
+
+    def coordinatesOf(self, x, y, z):
+        if isinstance(x, np.ndarray):
+            return (np.hypot(x, y), z)
+        return (math.sqrt(x*x + y*y), z)
+
+    def A_rz(self, photonCount=None) -> np.ndarray:
+        """ Absorbed fraction per unit volume [1/cm3], scaled like ScaleA in
+        mcmlio.c. photonCount is the number of photons launched: by default
+        the one counted by the LayerStack (or Photons.propagate) when they
+        are launched. """
+        N = self.photonCount if photonCount is None else photonCount
+        volumes = 2*np.pi*(np.arange(self.nr)+0.5)*self.dr*self.dr*self.dz
+        return self.values/(volumes[:, np.newaxis]*N)
+
+    def A_z(self, photonCount=None) -> np.ndarray:
+        """ Absorbed fraction per unit depth [1/cm] (see A_rz for photonCount) """
+        N = self.photonCount if photonCount is None else photonCount
+        return self.values.sum(axis=0)/(self.dz*N)
+
+class DepthTally(AbsorptionTally):
+    """ Absorbed energy as a function of depth only, A_z of MCML """
+    def __init__(self, nz, dz):
+        super().__init__(deltas=(dz,), sizes=(nz,))
+
+    @property
+    def nz(self) -> int:
+        return self.sizes[0]
+
+    @property
+    def dz(self) -> float:
+        return self.deltas[0]
+
+    def coordinatesOf(self, x, y, z):
+        return (z,)
+
+    def A_z(self, photonCount=None) -> np.ndarray:
+        """ Same as CylindricalTally.A_z """
+        N = self.photonCount if photonCount is None else photonCount
+        return self.values/(self.dz*N)
+
+class ExitTally(Tally):
+    """ Weight leaving a surface as a function of the radius and of the
+    angle with its normal, Rd_ra (or Tt_ra) of MCML: nr rings of width
+    dr, and na bins of angle from 0 to 90 degrees. The photon count is
+    the one of the simulation (e.g. LayerStack.photonCount) since not
+    every photon leaves through the surface.
+
+    Like every exit tally (TimeTally, Detector), it has score(photon,
+    weight) and scoreMany(photons, weights), photons being the Photons
+    that leave. """
+    def __init__(self, nr, na, dr):
+        super().__init__(deltas=(dr, 0.5*math.pi/na), sizes=(nr, na))
+
+    @property
+    def nr(self) -> int:
+        return self.sizes[0]
+
+    @property
+    def na(self) -> int:
+        return self.sizes[1]
+
+    @property
+    def dr(self) -> float:
+        return self.deltas[0]
+
+    @property
+    def da(self) -> float:
+        return self.deltas[1]
+
+    def score(self, photon, weight):
+        r = photon.r
+        uz = abs(photon.ez.z)
+        self.add((math.sqrt(r.x*r.x + r.y*r.y), math.acos(min(uz, 1.0))), weight)
+
+    def scoreMany(self, photons, weights):
+        r = photons.r
+        uz = np.minimum(np.abs(np.asarray(photons.ez.z)), 1.0)
+        self.addMany((np.hypot(np.asarray(r.x), np.asarray(r.y)), np.arccos(uz)), weights)
+
+    def ra(self, photonCount) -> np.ndarray:
+        """ Per unit area and solid angle [1/(cm2 sr)], scaled like ScaleRdTt in mcmlio.c """
+        scale = 4.0*np.pi*np.pi*self.dr*math.sin(self.da/2)*self.dr*photonCount
+        ir = np.arange(self.nr)[:, np.newaxis]
+        ia = np.arange(self.na)[np.newaxis, :]
+        return self.values/((ir+0.5)*np.sin(2.0*(ia+0.5)*self.da)*scale)
+
+    def r(self, photonCount) -> np.ndarray:
+        """ Per unit area [1/cm2] """
+        areas = 2*np.pi*(np.arange(self.nr)+0.5)*self.dr*self.dr
+        return self.values.sum(axis=1)/(areas*photonCount)
+
+    def a(self, photonCount) -> np.ndarray:
+        """ Per unit solid angle [1/sr] """
+        solidAngles = 2*np.pi*self.da*np.sin((np.arange(self.na)+0.5)*self.da)
+        return self.values.sum(axis=0)/(solidAngles*photonCount)
+
+class TimeTally(Tally):
+    """ Weight as a function of the time of flight (a TPSF when used as the
+    reflectanceTally or transmittanceTally of a LayerStack): nt bins of
+    dt ns. score() takes a Photon and scoreMany() takes Photons, with the
+    time of each from its optical path length. """
+    def __init__(self, nt, dt):
+        super().__init__(deltas=(dt,), sizes=(nt,))
+
+    @property
+    def nt(self) -> int:
+        return self.sizes[0]
+
+    @property
+    def dt(self) -> float:
+        return self.deltas[0]
+
+    def coordinatesOf(self, r, t):
+        return (t,)
+
+    def score(self, photon, weight):
+        r = photon.r
+        self.add(self.coordinatesOf(math.sqrt(r.x*r.x + r.y*r.y), photon.timeOfFlight), weight)
+
+    def scoreMany(self, photons, weights):
+        r = photons.r
+        self.addMany(self.coordinatesOf(np.hypot(np.asarray(r.x), np.asarray(r.y)), photons.timeOfFlight), weights)
+
+    def t(self, photonCount) -> np.ndarray:
+        """ Per unit time [1/ns] """
+        return self.values/(self.dt*photonCount)
+
+class TimeRadiusTally(TimeTally):
+    """ Weight as a function of the radius and of the time of flight: nr
+    rings of width dr and nt bins of dt ns """
+    def __init__(self, nr, nt, dr, dt):
+        Tally.__init__(self, deltas=(dr, dt), sizes=(nr, nt))
+
+    @property
+    def nr(self) -> int:
+        return self.sizes[0]
+
+    @property
+    def nt(self) -> int:
+        return self.sizes[1]
+
+    @property
+    def dr(self) -> float:
+        return self.deltas[0]
+
+    @property
+    def dt(self) -> float:
+        return self.deltas[1]
+
+    def coordinatesOf(self, r, t):
+        return (r, t)
+
+    def t(self, photonCount) -> np.ndarray:
+        return self.values.sum(axis=0)/(self.dt*photonCount)
+
+    def rt(self, photonCount) -> np.ndarray:
+        """ Per unit area and time [1/(cm2 ns)] """
+        areas = 2*np.pi*(np.arange(self.nr)+0.5)*self.dr*self.dr
+        return self.values/(areas[:, np.newaxis]*self.dt*photonCount)
+
+def writeMCO(filepath, stack):
+    """ Write the results of a LayerStack in the ASCII format of MCML
+    (.mco), readable by readMCO and by the scripts written for MCML. The
+    stack must score into a CylindricalTally (its stats) and into exit
+    tallies (reflectanceTally and transmittanceTally), all with the same
+    dr and the exit tallies with the same na. """
+    A = stack.stats
+    Rd = stack.reflectanceTally
+    Tt = stack.transmittanceTally
+    if not isinstance(A, CylindricalTally) or not isinstance(Rd, ExitTally) or not isinstance(Tt, ExitTally):
+        raise ValueError("The stack needs a CylindricalTally as stats and exit tallies")
+    if not (A.dr == Rd.dr == Tt.dr and A.nr == Rd.nr == Tt.nr and Rd.na == Tt.na):
+        raise ValueError("The tallies must have the same radial bins and angles")
+
+    N = stack.photonCount
+    lines = ["A1 \t# Version number of the file format.", "",
+             "####", "# Data categories include: ", "# InParm, RAT, ",
+             "# A_l, A_z, Rd_r, Rd_a, Tt_r, Tt_a, ", "# A_rz, Rd_ra, Tt_ra ", "####", "",
+             "# Written by tallies.py on {0}".format(time.strftime("%Y-%m-%d %H:%M:%S")), ""]
+
+    lines += ["InParm \t\t\t# Input parameters. cm is used.",
+              "{0} \tA\t\t# output file name, ASCII.".format(filepath.split("/")[-1]),
+              "{0} \t\t\t# No. of photons".format(N),
+              "{0:G}\t{1:G}\t\t# dz, dr [cm]".format(A.dz, A.dr),
+              "{0}\t{1}\t{2}\t# No. of dz, dr, da.".format(A.nz, A.nr, Rd.na), "",
+              "{0}\t\t\t\t\t# Number of layers".format(stack.layerCount),
+              "#n\tmua\tmus\tg\td\t# One line for each layer",
+              "{0:G}\t\t\t\t\t# n for medium above".format(stack.indices[0])]
+    for i, layer in enumerate(stack.layers):
+        material = layer.material
+        thickness = layer.boundingBoxMax.z - layer.boundingBoxMin.z
+        lines.append("{0:G}\t{1:G}\t{2:G}\t{3:G}\t{4:G}\t# layer {5}".format(
+                     material.index, material.mu_a, material.mu_s, material.g, thickness, i+1))
+    lines += ["{0:G}\t\t\t\t\t# n for medium below".format(stack.indices[-1]), ""]
+
+    lines += ["RAT #Reflectance, absorption, transmission. ",
+              "{0:<14.6G} \t#Specular reflectance [-]".format(stack.specularReflectance),
+              "{0:<14.6G} \t#Diffuse reflectance [-]".format(Rd.values.sum()/N),
+              "{0:<14.6G} \t#Absorbed fraction [-]".format(A.values.sum()/N),
+              "{0:<14.6G} \t#Transmittance [-]".format(Tt.values.sum()/N), ""]
+
+    lines += ["A_l #Absorption as a function of layer. [-]"]
+    lines += ["{0:12.4G}".format(absorbed/N) for absorbed in stack.absorbed[1:-1]] + [""]
+    lines += _column("A_z #A[0], [1],..A[nz-1]. [1/cm]", A.A_z(N))
+    lines += _column("Rd_r #Rd[0], [1],..Rd[nr-1]. [1/cm2]", Rd.r(N))
+    lines += _column("Rd_a #Rd[0], [1],..Rd[na-1]. [sr-1]", Rd.a(N))
+    lines += _column("Tt_r #Tt[0], [1],..Tt[nr-1]. [1/cm2]", Tt.r(N))
+    lines += _column("Tt_a #Tt[0], [1],..Tt[na-1]. [sr-1]", Tt.a(N))
+
+    lines += ["# A[r][z]. [1/cm3]", "# A[0][0], [0][1],..[0][nz-1]", "# A[1][0], [1][1],..[1][nz-1]",
+              "# ...", "# A[nr-1][0], [nr-1][1],..[nr-1][nz-1]", "A_rz"]
+    lines += _rows(A.A_rz(N))
+    for name, tally in (("Rd", Rd), ("Tt", Tt)):
+        lines += ["# {0}[r][angle]. [1/(cm2sr)].".format(name),
+                  "# {0}[0][0], [0][1],..[0][na-1]".format(name),
+                  "# {0}[1][0], [1][1],..[1][na-1]".format(name), "# ...",
+                  "# {0}[nr-1][0], [nr-1][1],..[nr-1][na-1]".format(name),
+                  "{0}_ra".format(name)]
+        lines += _rows(tally.ra(N))
+
+    with open(filepath, "w") as file:
+        file.write("\n".join(lines))
+
+def _column(title, values) -> list:
+    return [title] + ["{0:12.4E}".format(value) for value in values] + [""]
+
+def _rows(values, perLine=5) -> list:
+    """ perLine numbers per line, as WriteRd_ra in mcmlio.c """
+    flat = values.reshape(-1)
+    rows = [" ".join("{0:12.4E}".format(value) for value in flat[i:i+perLine])
+            for i in range(0, len(flat), perLine)]
+    return rows + [""]
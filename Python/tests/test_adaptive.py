@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+from adaptive import propagateUntilPrecision
+from material import Material
+from stats import Stats
+
+def testRegionRequiresMaxPhotons():
+    material = Material(mu_s=30, mu_a=0.5, g=0.8)
+    with pytest.raises(ValueError):
+        propagateUntilPrecision(material, relativeError=0.01, region=(0, 0, 0))
+
+def testUnreachableRegionStopsAtMaxPhotons():
+    np.random.seed(9)
+    material = Material(mu_s=30, mu_a=0.5, g=0.8)
+    material.stats = Stats(min=(-1, -1, -1), max=(1, 1, 1), size=(5, 5, 5), clampToEdges=False)
+    region = (slice(0, 1), slice(0, 1), slice(0, 1)) # A corner that photons do not reach
+    photonsDone = propagateUntilPrecision(material, relativeError=0.1, region=region, batchSize=100, maxPhotons=500)
+    assert photonsDone == 500
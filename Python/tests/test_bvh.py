@@ -0,0 +1,60 @@
+import numpy as np
+import math
+from vector import UnitVector, Vector
+from geometry import Cube
+from bvh import BoundingVolumeHierarchy, _rayBox, _depth
+
+def randomScene(random):
+    """ 80 cubes in a world, 20 of them with a smaller cube inside """
+    world = Cube(20)
+    cubes = []
+    for i in range(80):
+        cube = Cube(random.uniform(0.5, 2))
+        cube.placeInto(world, Vector(*random.uniform(-9, 9, 3)))
+        cubes.append(cube)
+    for i in range(20):
+        container = cubes[i]
+        Cube(container.side/3).placeInto(container, Vector(*random.uniform(-0.2, 0.2, 3)*container.side))
+    return world
+
+def bruteObjectAt(objects, position):
+    inside = [o for o in objects if o.contains(position)]
+    return max(inside, key=_depth) if inside else None
+
+def bruteDistance(objects, position, direction) -> float:
+    inverse = tuple(1.0/d if d != 0 else math.inf for d in (direction.x, direction.y, direction.z))
+    closest = math.inf
+    for o in objects:
+        interval = _rayBox((position.x, position.y, position.z), inverse, o.boundingBoxMin, o.boundingBoxMax)
+        if interval is not None:
+            d = interval[0] if interval[0] > 0 else interval[1]
+            if 0 < d < closest:
+                closest = d
+    return closest
+
+def testBVHMatchesBruteForce():
+    random = np.random.RandomState(3)
+    world = randomScene(random)
+    bvh = BoundingVolumeHierarchy.withScene(world)
+    assert len(bvh.objects) == 100
+
+    for i in range(500):
+        if i % 2 == 0:
+            position = Vector(*random.uniform(-10, 10, 3))
+        else: # Around a cube, often inside
+            o = bvh.objects[random.randint(len(bvh.objects))]
+            position = o.origin + Vector(*random.uniform(-0.6, 0.6, 3)*o.side)
+        (x, y, z) = random.normal(size=3)
+        if i % 10 == 0:
+            (x, y) = (0, 0) # Parallel to two axes
+        norm = math.sqrt(x*x + y*y + z*z)
+        direction = UnitVector(x/norm, y/norm, z/norm)
+
+        found = bvh.objectAt(position)
+        expected = bruteObjectAt(bvh.objects, position)
+        assert (found is None) == (expected is None)
+        if found is not None:
+            assert found.contains(position) and _depth(found) == _depth(expected)
+
+        (distance, hit) = bvh.distanceToBoundary(position, direction)
+        assert distance == bruteDistance(bvh.objects, position, direction)
@@ -0,0 +1,45 @@
+import numpy as np
+import os
+import signal
+import subprocess
+import sys
+from checkpoint import Checkpoint
+from material import Material
+from photons import Photons
+from stats import Stats
+
+def run(directory, N=2000, batchSize=200, killAfter=None):
+    """ The loop of the command line, with a checkpoint after every batch.
+    With killAfter, the process kills itself in the middle of that batch,
+    after it is propagated but before its checkpoint. """
+    np.random.seed(6)
+    material = Material(mu_s=30, mu_a=0.5, g=0.8)
+    material.stats = Stats(min=(-1, -1, -1), max=(1, 1, 1), size=(16, 16, 16))
+    checkpoint = Checkpoint(os.path.join(directory, "checkpoint"), material.stats, interval=0, maxDeltas=3)
+    photonsDone = checkpoint.resume()
+    batches = 0
+    while photonsDone < N:
+        Photons(batchSize).propagate(material)
+        batches += 1
+        if batches == killAfter:
+            os.kill(os.getpid(), signal.SIGKILL)
+        photonsDone += batchSize
+        checkpoint.update(photonsDone)
+    material.stats.save(os.path.join(directory, "output.stats"))
+    return material.stats
+
+def testResumeAfterAKillIsIdentical(tmp_path):
+    uninterrupted = run(str(tmp_path / "uninterrupted"))
+
+    interrupted = str(tmp_path / "interrupted")
+    testsDirectory = os.path.dirname(os.path.abspath(__file__))
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join([testsDirectory, os.path.dirname(testsDirectory)]))
+    process = subprocess.run([sys.executable, "-c", "import test_checkpoint; test_checkpoint.run({0!r}, killAfter=6)".format(interrupted)],
+                             env=environment)
+    assert process.returncode == -signal.SIGKILL
+    assert not os.path.exists(os.path.join(interrupted, "output.stats"))
+
+    resumed = run(interrupted)
+    assert resumed.photonCount == uninterrupted.photonCount
+    assert resumed.eventCount == uninterrupted.eventCount
+    assert np.array_equal(resumed.energy, uninterrupted.energy)
@@ -0,0 +1,28 @@
+import numpy as np
+from layers import LayerStack
+from detector import Detector, exitRecordCount, readExits
+from material import Material
+from photon import Photon
+from stats import Stats
+
+def testRecordsAreReadBackInChunks(tmp_path):
+    filepath = str(tmp_path / "exits.bin")
+    np.random.seed(10)
+    with Detector(filepath, bufferSize=100) as detector:
+        stack = LayerStack.withThicknesses([Material(20, 0.5, 0.8, index=1.4)], [0.1], reflectanceTally=detector)
+        for i in range(500):
+            stack.propagate(Photon())
+
+    chunks = list(readExits(filepath, chunkSize=70))
+    assert sum(len(records) for records in chunks) == exitRecordCount(filepath) == detector.recordCount
+    weight = sum(records['weight'].sum(dtype=float) for records in chunks)
+    assert np.isclose(weight, stack.reflected, rtol=1e-5)
+
+def testStatsFileIsNotAnExitFile(tmp_path):
+    filepath = str(tmp_path / "output.stats")
+    Stats(size=(2, 2, 2)).save(filepath)
+    try:
+        Detector(filepath)
+        assert False, "A Stats file was taken for exit records"
+    except ValueError:
+        pass
@@ -0,0 +1,41 @@
+import numpy as np
+from layers import LayerStack
+from tallies import CylindricalTally, ExitTally, writeMCO
+from material import Material
+from photon import Photon
+from mco import readMCO
+
+def testWriteAndReadMCO(tmp_path):
+    np.random.seed(6)
+    A = CylindricalTally(nr=8, nz=6, dr=0.01, dz=0.02)
+    Rd = ExitTally(nr=8, na=5, dr=0.01)
+    Tt = ExitTally(nr=8, na=5, dr=0.01)
+    materials = [Material(mu_s=20, mu_a=1, g=0.8, index=1.4), Material(mu_s=10, mu_a=2, g=0.9, index=1.3)]
+    stack = LayerStack.withThicknesses(materials, [0.05, 0.07], indexAbove=1.0, indexBelow=1.5,
+                                       stats=A, reflectanceTally=Rd, transmittanceTally=Tt)
+    N = 500
+    for i in range(N):
+        stack.propagate(Photon())
+    filepath = str(tmp_path/"stack.mco")
+    writeMCO(filepath, stack)
+
+    for load2D in (False, True):
+        mco = readMCO(filepath, load2D=load2D)
+        assert mco.InParm['photons'] == N
+        assert (mco.InParm['dz'], mco.InParm['dr']) == (0.02, 0.01)
+        assert (mco.InParm['nz'], mco.InParm['nr'], mco.InParm['na']) == (6, 8, 5)
+        assert (mco.InParm['indexAbove'], mco.InParm['indexBelow']) == (1.0, 1.5)
+        assert np.allclose(mco.InParm['layers'], [[1.4, 1, 20, 0.8, 0.05], [1.3, 2, 10, 0.9, 0.07]])
+
+        rtol = 1e-3 # At least 4 significant digits in the file
+        assert np.allclose(mco.RAT, [stack.specularReflectance, stack.diffuseReflectance,
+                                     stack.absorbance, stack.transmittance], rtol=rtol)
+        assert np.allclose(mco.A_l, np.array(stack.absorbed[1:-1])/N, rtol=rtol)
+        assert np.allclose(mco.A_z, A.A_z(N), rtol=rtol)
+        assert np.allclose(mco.Rd_r, Rd.r(N), rtol=rtol)
+        assert np.allclose(mco.Rd_a, Rd.a(N), rtol=rtol)
+        assert np.allclose(mco.Tt_r, Tt.r(N), rtol=rtol)
+        assert np.allclose(mco.Tt_a, Tt.a(N), rtol=rtol)
+        assert np.allclose(mco.A_rz, A.A_rz(N), rtol=rtol)
+        assert np.allclose(mco.Rd_ra, Rd.ra(N), rtol=rtol)
+        assert np.allclose(mco.Tt_ra, Tt.ra(N), rtol=rtol)
@@ -0,0 +1,37 @@
+import numpy as np
+from parallel import propagateInParallel
+from material import Material
+from photon import Photon
+from photons import Photons
+from stats import Stats
+
+def testParallelKeepsTheOverflow():
+    N = 2000
+    overflows = []
+    for parallel in (False, True):
+        np.random.seed(3)
+        material = Material(mu_s=30, mu_a=0.5, g=0.8)
+        material.stats = Stats(min=(-0.05, -0.05, 0), max=(0.05, 0.05, 0.1), size=(5, 5, 5), clampToEdges=False)
+        if parallel:
+            propagateInParallel(material, N, processes=2, seed=3)
+        else:
+            for i in range(0, N, 500):
+                Photons(500).propagate(material)
+        overflows.append(material.stats.overflow/N)
+
+    assert overflows[0] > 0.5
+    assert abs(overflows[0] - overflows[1]) < 0.05
+
+def testResultsDoNotDependOnTheProcesses():
+    energies = []
+    for processes in (1, 2, 3):
+        material = Material(mu_s=30, mu_a=0.5, g=0.8)
+        material.stats = Stats(min=(-0.5, -0.5, -0.5), max=(0.5, 0.5, 0.5), size=(11, 11, 11))
+        firstId = Photon.nextUniqueId
+        propagateInParallel(material, 1200, processes=processes, seed=4, tasks=6, batchSize=100)
+        assert Photon.nextUniqueId == firstId + 1200
+        assert material.stats.photonCount == 1200
+        energies.append(material.stats.energy)
+
+    assert np.array_equal(energies[0], energies[1])
+    assert np.array_equal(energies[0], energies[2])
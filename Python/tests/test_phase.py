@@ -0,0 +1,28 @@
+import numpy as np
+from phase import HenyeyGreenstein, TabulatedPhaseFunction
+
+def moments(phaseFunction, M=1 << 20):
+    """ Mean of cos(theta) and of its square for M random numbers evenly
+    spread in [0,1) """
+    (cost, sint) = phaseFunction.sampleCosines((np.arange(M) + 0.5)/M)
+    return (cost.mean(), (cost*cost).mean())
+
+def testHenyeyGreensteinMoments():
+    for g in (0, 0.5, 0.9, 0.99, -0.7):
+        (mean, meanSquare) = moments(HenyeyGreenstein(g))
+        assert abs(mean - g) < 1e-4
+        assert abs(meanSquare - (1 + 2*g*g)/3) < 1e-4
+
+def testTabulatedMoments():
+    phaseFunction = TabulatedPhaseFunction([-1, 1], [0, 2]) # p = 1 + cos
+    (mean, meanSquare) = moments(phaseFunction)
+    assert abs(mean - 1/3) < 1e-4
+    assert abs(meanSquare - 1/3) < 1e-4
+    assert abs(phaseFunction.g - 1/3) < 1e-4
+
+def testOneAndManyAgree():
+    phaseFunction = HenyeyGreenstein(0.8)
+    rnd = np.random.random(100)
+    (cost, sint) = phaseFunction.sampleCosines(rnd)
+    for i in range(len(rnd)):
+        assert np.allclose(phaseFunction.sampleCosine(rnd[i]), (cost[i], sint[i]), rtol=0, atol=1e-12)
@@ -0,0 +1,36 @@
+import numpy as np
+from material import Material
+from photon import Photon
+from photons import Photons
+from stats import Stats
+
+def depthProfiles(material, batched, batches=10, N=200):
+    """ Mean and standard error over batches of the energy absorbed per
+    photon at each depth """
+    material.stats = Stats(min=(-1, -1, 0), max=(1, 1, 0.5), size=(1, 1, 10))
+    material.stats.startBatches()
+    for i in range(batches):
+        if batched:
+            Photons(N).propagate(material)
+        else:
+            for j in range(N):
+                photon = Photon()
+                while photon.isAlive:
+                    (cost, sint, phi) = material.getScatteringCosines(photon)
+                    photon.scatterByCosines(cost, sint, phi)
+                    photon.moveBy(material.getScatteringDistance(photon), material.index)
+                    material.absorbEnergy(photon)
+                    material.roulette(photon)
+        material.stats.endBatch(N)
+    depth = material.stats.depthBatches
+    total = material.stats.absorbedBatches
+    return (depth.mean, depth.standardError, total.mean, total.standardError)
+
+def testPhotonsAgreeWithTheOnePhotonLoop():
+    np.random.seed(5)
+    (scalar, scalarError, scalarTotal, scalarTotalError) = depthProfiles(Material(mu_s=15, mu_a=5, g=0.8), batched=False)
+    (batched, batchedError, batchedTotal, batchedTotalError) = depthProfiles(Material(mu_s=15, mu_a=5, g=0.8), batched=True)
+
+    assert abs(scalarTotal - batchedTotal) < 4*np.hypot(scalarTotalError, batchedTotalError)
+    assert np.all(np.abs(scalar - batched) < 4*np.hypot(scalarError, batchedError))
+    assert scalar[0] > scalar[-1] > 0
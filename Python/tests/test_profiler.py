@@ -0,0 +1,56 @@
+import numpy as np
+from layers import LayerStack
+from photons import Photons
+from profiler import Profiler
+from material import Material
+from photon import Photon
+from variance import WeightWindow
+
+def testProfiledStackGivesTheSameResults():
+    results = []
+    for profiler in (None, Profiler(sampleEvery=3)):
+        np.random.seed(5)
+        stack = LayerStack.withThicknesses([Material(30, 0.5, 0.8, index=1.4)], [0.1])
+        for i in range(200):
+            stack.propagate(Photon(), profiler)
+        results.append((stack.diffuseReflectance, stack.transmittance, stack.absorbance))
+    assert results[0] == results[1]
+    assert profiler.counts['photons'] == 200
+    assert profiler.counts['steps'] > 200
+
+def testProfiledPhotonsGiveTheSameResults():
+    energies = []
+    for profiler in (None, Profiler(sampleEvery=3)):
+        np.random.seed(6)
+        material = Material(30, 0.5, 0.8)
+        Photons(200).propagate(material, profiler)
+        energies.append(material.stats.energy)
+    assert np.array_equal(energies[0], energies[1])
+    assert profiler.counts['photons'] == 200
+
+def testProfilingLeavesNothingBehind():
+    methods = (Photon.moveBy, Photon.roulette, Photons.moveBy, Material.absorbEnergy, Material.rouletteMany, LayerStack.hopDropSpin)
+    profiler = Profiler(sampleEvery=2)
+    material = Material(30, 0.5, 0.8, weightWindow=WeightWindow(lower=1e-3, upper=2))
+    stack = LayerStack.withThicknesses([material], [0.1])
+    for i in range(50):
+        stack.propagate(Photon(), profiler)
+    Photons(50).propagate(Material(30, 0.5, 0.8), profiler)
+    assert (Photon.moveBy, Photon.roulette, Photons.moveBy, Material.absorbEnergy, Material.rouletteMany, LayerStack.hopDropSpin) == methods
+
+    counts = profiler.counts
+    assert counts['photons'] == 100
+    assert counts['rouletteCandidates'] >= counts['rouletteSurvivors'] > 0
+    assert counts['deposits'] > counts['photons']
+    assert all(profiler.times[stage] > 0 for stage in Profiler.stages)
+
+def testProfilerRestoresMethodsAfterAnException():
+    class Failing(Material):
+        def absorbEnergyMany(self, photons):
+            raise RuntimeError()
+    originals = (Photons.moveBy, Failing.absorbEnergyMany)
+    try:
+        Photons(10).propagate(Failing(30, 0.5, 0.8), Profiler())
+    except RuntimeError:
+        pass
+    assert (Photons.moveBy, Failing.absorbEnergyMany) == originals
@@ -0,0 +1,129 @@
+import numpy as np
+import json
+from stats import SparseStats, Stats
+from vector import Vectors
+from material import Material
+from photon import Photon
+from photons import Photons
+from layers import LayerStack
+
+def writeOldJSON(filepath, stats, energy, photonCount):
+    """ The format of the files saved before the binary format """
+    with open(filepath, "w") as write_file:
+        json.dump({"min":list(stats.min), "max":list(stats.max), "L":list(stats.L), "size":list(stats.size),
+                   "photonCount":photonCount, "photons":[], "energy":energy.tolist()}, write_file)
+
+def testAppendJSON(tmp_path):
+    filepath = str(tmp_path / "old.json")
+    stats = Stats(min=(-1, -1, 0), max=(1, 1, 0.5), size=(5, 5, 5))
+    energy = np.arange(125, dtype=float).reshape(5, 5, 5)
+    writeOldJSON(filepath, stats, energy, photonCount=10)
+
+    stats.append(filepath)
+    stats.append(filepath)
+    assert stats.photonCount == 20
+    assert np.array_equal(stats.energy, 2*energy)
+
+def testRestoreJSON(tmp_path):
+    filepath = str(tmp_path / "old.json")
+    stats = Stats(min=(-1, -1, 0), max=(1, 1, 0.5), size=(5, 5, 5))
+    energy = np.ones((5, 5, 5))
+    writeOldJSON(filepath, stats, energy, photonCount=3)
+
+    restored = Stats()
+    restored.restore(filepath)
+    restored.append(filepath)
+    assert restored.size == (5, 5, 5)
+    assert restored.photonCount == 6
+    assert np.array_equal(restored.energy, 2*energy)
+
+def testSparseStatsMatchesStats():
+    np.random.seed(4)
+    positions = Vectors(np.random.normal(0, 0.1, 5000), np.random.normal(0, 0.1, 5000), np.random.exponential(0.05, 5000))
+    deltas = np.random.random(5000)
+    grid = dict(min=(-2, -2, 0), max=(2, 2, 4), size=(200, 200, 200), clampToEdges=False)
+    dense = Stats(**grid)
+    sparse = SparseStats(**grid)
+    for stats in (dense, sparse):
+        stats.scoreMany(positions, deltas)
+
+    assert sparse.nbytes < dense.nbytes/20
+    assert len(sparse.pool) <= sparse.slots.size
+    assert np.allclose(sparse.energyAt(np.s_[90:110, 100, 0:20]), dense.energyAt(np.s_[90:110, 100, 0:20]))
+    for axis in (0, (0, 1), (0, 2)):
+        assert np.allclose(sparse.energySum(axis), dense.energySum(axis))
+
+def testSparseStatsNeverAllocatesMoreThanTheGrid():
+    sparse = SparseStats(min=(0, 0, 0), max=(1, 1, 1), size=(40, 40, 40))
+    (i, j, k) = np.meshgrid(np.arange(40), np.arange(40), np.arange(40), indexing='ij')
+    sparse.addMany((i.ravel(), j.ravel(), k.ravel()), np.ones(40**3))
+    assert sparse.blockCount == sparse.slots.size == len(sparse.pool)
+    assert np.array_equal(sparse.energy, np.ones((40, 40, 40)))
+
+def scoredStats(statsClass, seed):
+    np.random.seed(seed)
+    stats = statsClass(min=(-1, -1, 0), max=(1, 1, 1), size=(20, 12, 10), clampToEdges=False)
+    N = 2000
+    stats.scoreMany(Vectors(np.random.normal(0, 0.3, N), np.random.normal(0, 0.3, N), np.random.random(N)*1.2), np.random.random(N))
+    stats.photonCount = 100
+    return stats
+
+def assertSameResults(a, b):
+    assert tuple(a.min) == tuple(b.min) and tuple(a.max) == tuple(b.max) and tuple(a.size) == tuple(b.size)
+    assert (a.photonCount, a.eventCount, a.overflowCount) == (b.photonCount, b.eventCount, b.overflowCount)
+    assert a.overflow == b.overflow
+    assert np.array_equal(a.energy, b.energy)
+
+def testSaveAndRestore(tmp_path):
+    filepath = str(tmp_path / "output.stats")
+    for statsClass in (Stats, SparseStats):
+        saved = scoredStats(statsClass, seed=1)
+        saved.save(filepath)
+        for mmap in (True, False):
+            restored = statsClass()
+            restored.restore(filepath, mmap=mmap)
+            assertSameResults(restored, saved)
+
+def testAppendAndMerge(tmp_path):
+    for statsClass in (Stats, SparseStats):
+        (a, b) = (scoredStats(statsClass, seed=2), scoredStats(statsClass, seed=3))
+        b.save(str(tmp_path / "b.stats"))
+        appended = scoredStats(statsClass, seed=2)
+        appended.append(str(tmp_path / "b.stats"))
+        a.merge(b)
+        assertSameResults(appended, a)
+        assert appended.photonCount == 200
+        assert np.allclose(a.energy, scoredStats(Stats, seed=2).energy + scoredStats(Stats, seed=3).energy)
+
+def testDenseAndSparseFilesAreInterchangeable(tmp_path):
+    for (savedClass, restoredClass) in ((Stats, SparseStats), (SparseStats, Stats)):
+        filepath = str(tmp_path / "{0}.stats".format(savedClass.__name__))
+        saved = scoredStats(savedClass, seed=4)
+        saved.save(filepath)
+
+        restored = restoredClass()
+        restored.restore(filepath)
+        assertSameResults(restored, saved)
+
+        appended = scoredStats(restoredClass, seed=5)
+        appended.append(filepath)
+        merged = scoredStats(restoredClass, seed=5)
+        merged.merge(saved)
+        assertSameResults(appended, merged)
+
+def testPhotonsAreCountedAtLaunch():
+    material = Material(mu_s=10, mu_a=1, g=0.9)
+    material.stats = Stats()
+    photons = Photons(100)
+    Photon() # A later id, propagated first
+    Photons(10).propagate(material)
+    photons.propagate(material)
+    assert material.stats.photonCount == 110
+
+    stats = Stats()
+    glass = Material(mu_s=0, mu_a=0, g=0, index=1.5)
+    stack = LayerStack.withThicknesses([glass, Material(mu_s=1, mu_a=0.1, g=0.9)], [0.1, 0.01], stats=stats)
+    for i in range(50):
+        stack.propagate(Photon())
+    assert stats.photonCount == 50
+    assert stats.eventCount < 50 # Most photons go through without depositing anything
@@ -0,0 +1,12 @@
+import pytest
+from sweep import Sweep
+
+def testAnisotropicSweepWarns(tmp_path):
+    sweep = Sweep({'musz':[10, 20]}, musx=10, mua=1, d=0.01, photons=10)
+    with pytest.warns(UserWarning, match="musz"):
+        sweep.run(str(tmp_path), engine='python', processes=1, seed=1)
+
+def testIsotropicSweepDoesNotWarn(tmp_path, recwarn):
+    sweep = Sweep({'mua':[0.1, 1]}, mus=10, d=0.01, photons=10)
+    sweep.run(str(tmp_path), engine='python', processes=1, seed=1)
+    assert not any("musz" in str(w.message) for w in recwarn)
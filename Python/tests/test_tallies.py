@@ -0,0 +1,39 @@
+import numpy as np
+from layers import LayerStack
+from tallies import CylindricalTally, TimeTally
+from material import Material
+from photon import Photon
+from photons import Photons
+
+def testAbsorptionIsPerLaunchedPhoton():
+    np.random.seed(4)
+    tally = CylindricalTally(nr=10, nz=10, dr=0.01, dz=0.001)
+    stack = LayerStack.withThicknesses([Material(mu_s=10, mu_a=1, g=0.9, index=1.4)], [0.01], stats=tally)
+    N = 2000
+    for i in range(N):
+        stack.propagate(Photon())
+
+    assert tally.photonCount == N # Also those that go through without depositing anything
+    assert np.isclose(tally.A_z().sum()*tally.dz, stack.absorbance)
+
+def testTimeOfFlightIsInNanoseconds():
+    photon = Photon()
+    photon.moveBy(3, 1.5)
+    assert np.isclose(photon.timeOfFlight, 4.5/29.9792458) # cm and cm/ns
+
+    photons = Photons(3)
+    photons.moveBy(np.array([1.0, 2.0, 3.0]), 1.5)
+    tally = TimeTally(nt=50, dt=0.02)
+    tally.scoreMany(photons, np.ones(3))
+    assert list(np.nonzero(tally.values)[0]) == [2, 5, 7] # 0.050, 0.100 and 0.150 ns
+
+    np.random.seed(5)
+    tally = TimeTally(nt=50, dt=0.02)
+    glass = Material(mu_s=0, mu_a=0, g=0, index=1.5)
+    stack = LayerStack.withThicknesses([glass], [3], transmittanceTally=tally)
+    for i in range(200):
+        stack.propagate(Photon())
+    # Straight through in 0.150 ns, or after 2, 4... internal reflections
+    assert set(np.nonzero(tally.values)[0]) <= {7, 22, 37}
+    assert tally.values[7] > 0
+    assert np.isclose(tally.values.sum(), stack.transmitted)
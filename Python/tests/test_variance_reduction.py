@@ -0,0 +1,105 @@
+import numpy as np
+from layers import LayerStack
+from photons import Photons
+from voxel import VoxelVolume
+from material import Material
+from photon import Photon
+from stats import Stats
+from variance import ExponentialTransform, WeightWindow
+from vector import UnitVector
+import pytest
+
+def batchMeans(values):
+    """ Mean and standard error of the means of independent batches """
+    values = np.array(values)
+    return (values.mean(axis=0), values.std(axis=0, ddof=1)/np.sqrt(len(values)))
+
+def stackResults(material, batches=8, N=300):
+    results = []
+    for i in range(batches):
+        stack = LayerStack.withThicknesses([material], [0.2], indexAbove=1.0, indexBelow=1.0)
+        for j in range(N):
+            stack.propagate(Photon())
+        results.append((stack.diffuseReflectance, stack.transmittance))
+    return batchMeans(results)
+
+def assertAgree(a, b, sigmas=4):
+    (meanA, errorA) = a
+    (meanB, errorB) = b
+    assert np.all(np.abs(meanA - meanB) < sigmas*np.sqrt(errorA**2 + errorB**2))
+
+def testWeightWindowIsUnbiased():
+    np.random.seed(7)
+    analog = stackResults(Material(mu_s=30, mu_a=2, g=0.8, index=1.4))
+    window = WeightWindow(lower=0.2, upper=0.6, maxSplit=4) # Acts on most photons
+    windowed = stackResults(Material(mu_s=30, mu_a=2, g=0.8, index=1.4, weightWindow=window))
+    assertAgree(analog, windowed)
+
+def depthEnergy(material, batches=8, N=500):
+    """ Energy absorbed per photon in the two halves of the grid in z """
+    results = []
+    for i in range(batches):
+        material.stats = Stats(min=(-1, -1, -1), max=(1, 1, 1), size=(2, 2, 2))
+        Photons(N).propagate(material)
+        energy = material.stats.energy
+        results.append((energy[:, :, 0].sum()/N, energy[:, :, 1].sum()/N))
+    return batchMeans(results)
+
+def testExponentialTransformIsUnbiased():
+    np.random.seed(8)
+    analog = depthEnergy(Material(mu_s=5, mu_a=1, g=0.8))
+    transform = ExponentialTransform(direction=UnitVector(0, 0, 1), p=0.3)
+    transformed = depthEnergy(Material(mu_s=5, mu_a=1, g=0.8, exponentialTransform=transform))
+    assertAgree(analog, transformed)
+
+def twoLayers(transform, batches=8, N=300):
+    """ Rd, Tt and the energy absorbed in the deep layer, per photon """
+    results = []
+    for i in range(batches):
+        top = Material(mu_s=20, mu_a=1, g=0.8, index=1.4, exponentialTransform=transform)
+        bottom = Material(mu_s=10, mu_a=2, g=0.8, index=1.4, exponentialTransform=transform)
+        stack = LayerStack.withThicknesses([top, bottom], [0.1, 0.2])
+        for j in range(N):
+            stack.propagate(Photon())
+        results.append((stack.diffuseReflectance, stack.transmittance, stack.absorbed[2]/stack.photonCount))
+    return batchMeans(results)
+
+def testExponentialTransformIsUnbiasedAcrossLayers():
+    np.random.seed(9)
+    transform = ExponentialTransform(direction=UnitVector(0, 0, 1), p=0.3)
+    assertAgree(twoLayers(None), twoLayers(transform))
+
+def twoLabels(tracking='dda', many=False, transform=None, window=None, batches=8, N=300):
+    """ Energy absorbed per photon in the top and bottom halves of a
+    volume of two labels, and the weight that escapes. The weight window
+    is only in the bottom one. """
+    labels = np.zeros((4, 4, 6), dtype=int)
+    labels[:, :, 3:] = 1
+    results = []
+    for i in range(batches):
+        materials = [Material(mu_s=20, mu_a=1, g=0.8, exponentialTransform=transform),
+                     Material(mu_s=10, mu_a=2, g=0.8, exponentialTransform=transform, weightWindow=window)]
+        stats = Stats(min=(-0.2, -0.2, 0), max=(0.2, 0.2, 0.6), size=(1, 1, 3))
+        volume = VoxelVolume(labels, materials, voxelSize=0.1, tracking=tracking, stats=stats)
+        if many:
+            volume.propagateMany(Photons(N))
+        else:
+            for j in range(N):
+                volume.propagate(Photon())
+        results.append((stats.energy[0, 0, 0]/N, stats.energy[0, 0, 1]/N, volume.escaped/N))
+    return batchMeans(results)
+
+def testExponentialTransformIsUnbiasedAcrossVoxels():
+    np.random.seed(10)
+    transform = ExponentialTransform(direction=UnitVector(0, 0, 1), p=0.3)
+    assertAgree(twoLabels(), twoLabels(transform=transform))
+
+def testExponentialTransformNeedsDDA():
+    material = Material(mu_s=20, mu_a=1, g=0.8, exponentialTransform=ExponentialTransform(p=0.3))
+    with pytest.raises(ValueError):
+        VoxelVolume(np.zeros((2, 2, 2), dtype=int), [material], voxelSize=0.1, tracking='delta')
+
+def testWeightWindowIsUnbiasedInBatches():
+    np.random.seed(12)
+    window = WeightWindow(lower=0.2, upper=0.6, maxSplit=4)
+    assertAgree(twoLabels('delta', many=True), twoLabels('delta', many=True, window=window))
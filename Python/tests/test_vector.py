@@ -0,0 +1,50 @@
+import numpy as np
+import math
+from vector import Vector, UnitVector, Vectors
+from photon import Photon
+
+def testSpinFrameMatchesTwoRotations():
+    np.random.seed(9)
+    for i in range(100):
+        (theta, phi) = (np.random.random()*math.pi, np.random.random()*2*math.pi)
+        ez = UnitVector(0, 0, 1)
+        ez.rotateAround(Vector(1, 2, 3), np.random.random()*6)
+        perpendicular = Vector(1, 2, 3).cross(ez)
+        er = UnitVector(perpendicular.x, perpendicular.y, perpendicular.z)
+        er.normalize()
+
+        (ez1, er1) = (ez.copy(), er.copy())
+        er1.rotateAround(ez1, phi)
+        ez1.rotateAround(er1, theta)
+        (ez2, er2) = (ez.copy(), er.copy())
+        ez2.spinFrameBy(er2, theta, phi)
+        for (a, b) in ((ez1, ez2), (er1, er2)):
+            assert abs(a.x-b.x) + abs(a.y-b.y) + abs(a.z-b.z) < 1e-12
+
+def testRotateAroundLeavesTheAxisAlone():
+    axis = Vector(0, 0, 2)
+    v = Vector(1, 0, 0)
+    v.rotateAround(axis, math.pi/2)
+    assert (axis.x, axis.y, axis.z) == (0, 0, 2)
+    assert abs(v.x) < 1e-15 and abs(v.y - 1) < 1e-15
+
+def testFrameStaysOrthonormal():
+    photon = Photon()
+    np.random.seed(10)
+    for i in range(10*Photon.renormalizationPeriod + 37):
+        photon.scatterBy(np.random.random()*math.pi, np.random.random()*2*math.pi)
+    (ez, er) = (photon.ez, photon.er)
+    assert abs(ez.abs() - 1) < 1e-12 and abs(er.abs() - 1) < 1e-12
+    assert abs(ez.dot(er)) < 1e-12
+
+def testVectorsSpinFrameMatchesOneAtATime():
+    np.random.seed(11)
+    N = 50
+    (cost, phi) = (2*np.random.random(N)-1, np.random.random(N)*2*np.pi)
+    sint = np.sqrt(1-cost*cost)
+    (ez, er) = (Vectors(0, 0, 1, N=N), Vectors(0, 1, 0, N=N))
+    ez.spinFrameByCosines(er, cost, sint, phi)
+    for i in range(N):
+        (one, oneR) = (UnitVector(0, 0, 1), UnitVector(0, 1, 0))
+        one.spinFrameByCosines(oneR, cost[i], sint[i], phi[i])
+        assert abs(one.x - ez.x[i]) + abs(one.y - ez.y[i]) + abs(one.z - ez.z[i]) < 1e-14
@@ -0,0 +1,52 @@
+import numpy as np
+from voxel import VoxelVolume
+from material import Material
+from photon import Photon
+from photons import Photons
+from stats import Stats
+from tallies import ExitTally, TimeTally, TimeRadiusTally
+from detector import Detector, readExits
+
+def testPropagateManyCountsEveryPhoton():
+    np.random.seed(1)
+    labels = np.ones((10, 10, 10), dtype=np.int8)
+    stats = Stats(min=(-0.25, -0.25, 0), max=(0.25, 0.25, 0.5), size=(10, 10, 10))
+    volume = VoxelVolume(labels, [None, Material(mu_s=2, mu_a=0.5, g=0.8)], 0.05, stats=stats)
+    N = 2000
+    volume.propagateMany(Photons(N))
+    assert stats.photonCount == N
+    assert volume.photonCount == N
+
+def testDeltaTrackingAndTraversalAgree():
+    np.random.seed(2)
+    labels = np.ones((20, 20, 10), dtype=np.int8)
+    labels[:, :, 5:] = 2
+    def materials():
+        return [None, Material(20, 0.5, 0.8), Material(10, 2.0, 0.5)]
+    N = 1000
+    results = []
+    for tracking in ('delta', 'dda'):
+        volume = VoxelVolume(labels, materials(), 0.05, tracking=tracking)
+        for i in range(N):
+            volume.propagate(Photon())
+        results.append(volume.absorbed/N)
+    volume = VoxelVolume(labels, materials(), 0.05)
+    volume.propagateMany(Photons(N))
+    results.append(volume.absorbed/N)
+    assert np.ptp(results) < 0.05
+
+def testEveryExitTallyGetsTheSameExits(tmp_path):
+    labels = np.ones((10, 10, 10), dtype=np.int8)
+    tallies = [ExitTally(nr=10, na=10, dr=0.05), TimeTally(nt=50, dt=0.01),
+               TimeRadiusTally(nr=10, nt=50, dr=0.05, dt=0.01), Detector(str(tmp_path / "exits.bin"))]
+    for tally in tallies:
+        np.random.seed(3)
+        volume = VoxelVolume(labels, [None, Material(mu_s=10, mu_a=0.5, g=0.8)], 0.05, exitTally=tally)
+        volume.propagateMany(Photons(500))
+        recorded = tally.weight if isinstance(tally, Detector) else tally.values.sum()
+        assert recorded > 0
+        assert abs(recorded - volume.escaped) < 1e-6*volume.escaped # float32 records
+
+    detector = tallies[-1]
+    detector.close()
+    assert sum(len(records) for records in readExits(detector.filepath)) == detector.recordCount
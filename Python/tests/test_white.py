@@ -0,0 +1,39 @@
+import numpy as np
+from layers import LayerStack
+from material import Material
+from photon import Photon
+from white import WhiteMonteCarlo
+
+muas = [0.5, 2.0, 10.0]
+
+def slab(mua):
+    material = Material(mu_s=20, mu_a=mua, g=0.8, index=1.4)
+    return LayerStack.withThicknesses([material], [0.1], indexAbove=1.0, indexBelow=1.0)
+
+def batchMeans(values):
+    values = np.array(values)
+    return (values.mean(axis=0), values.std(axis=0, ddof=1)/np.sqrt(len(values)))
+
+def testWhiteMatchesDirectRuns():
+    np.random.seed(13)
+    (batches, N) = (6, 400)
+    white = []
+    direct = []
+    for i in range(batches):
+        whiteMC = WhiteMonteCarlo(slab(0))
+        whiteMC.run(N)
+        (Rd, Tt, A) = whiteMC.results(muas)
+        white.append(np.concatenate((Rd, Tt)))
+
+        results = ([], [])
+        for mua in muas:
+            stack = slab(mua)
+            for j in range(N):
+                stack.propagate(Photon())
+            results[0].append(stack.diffuseReflectance)
+            results[1].append(stack.transmittance)
+        direct.append(np.concatenate(results))
+
+    (white, whiteError) = batchMeans(white)
+    (direct, directError) = batchMeans(direct)
+    assert np.all(np.abs(white - direct) < 4*np.hypot(whiteError, directError))
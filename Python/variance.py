@@ -0,0 +1,124 @@
+import numpy as np
+import math
+from vector import UnitVector
+
+class WeightWindow:
+    """ Keeps the weights of the photons in a material between lower and
+    upper: a heavier photon is split into n copies of weight w/n (at most
+    maxSplit), a lighter one plays roulette and survives with the weight
+    survivalWeight (with the probability w/survivalWeight, so the
+    expected weight is unchanged). It replaces the roulette of the
+    material: photons that are too light to matter die, photons heavy
+    enough to matter (e.g. after an ExponentialTransform toward a deep
+    region) are followed several times, each with its own random path. """
+    def __init__(self, lower=1e-4, upper=1.0, survivalWeight=None, maxSplit=10):
+        if not 0 < lower < upper:
+            raise ValueError("The window must have 0 < lower < upper")
+        self.lower = lower
+        self.upper = upper
+        self.survivalWeight = survivalWeight if survivalWeight is not None else math.sqrt(lower*upper)
+        self.maxSplit = maxSplit
+
+    def apply(self, photon) -> list:
+        """ The copies of photon split from it (an empty list if it was not
+        split). photon itself may be rouletted: its weight is then either
+        survivalWeight or 0. """
+        w = photon.weight
+        if w == 0:
+            return []
+        elif w < self.lower:
+            self.roulette(photon)
+            return []
+        elif w > self.upper:
+            n = min(math.ceil(w/self.upper), self.maxSplit)
+            photon.weight = w/n
+            return [photon.copy() for i in range(n-1)]
+        return []
+
+    def roulette(self, photon) -> (int, int):
+        """ The roulette of a photon lighter than lower, which survives
+        with survivalWeight. Returns (1, 1) if it survived, (1, 0) if not,
+        like Photon.roulette. """
+        if photon.random()*self.survivalWeight < photon.weight:
+            photon.weight = self.survivalWeight
+            return (1, 1)
+        photon.weight = 0
+        return (1, 0)
+
+    def applyMany(self, photons) -> (int, int):
+        """ Same as apply for a batch of Photons, which gets the copies.
+        Returns the number of photons that played roulette and that survived. """
+        return applyWeightWindows(photons, self.lower, self.upper, self.survivalWeight, self.maxSplit)
+
+def applyWeightWindows(photons, lower, upper, survivalWeight, maxSplit) -> (int, int):
+    """ WeightWindow.applyMany with one window per photon: each parameter
+    is a value or an array, nan for the photons without a window (e.g.
+    looked up by label in a VoxelVolume). The photons are split last, so
+    the arrays are those of the photons before the copies are added. """
+    w = photons.weight
+    light = (w < lower) & (w != 0)
+    n = int(np.count_nonzero(light))
+    survivors = 0
+    if n > 0:
+        if np.ndim(survivalWeight) > 0:
+            survivalWeight = survivalWeight[light]
+        survived = np.random.random(n)*survivalWeight < w[light]
+        w[light] = np.where(survived, survivalWeight, 0)
+        survivors = int(np.count_nonzero(survived))
+
+    heavy = w > upper
+    if np.any(heavy):
+        if np.ndim(upper) > 0:
+            upper = upper[heavy]
+        if np.ndim(maxSplit) > 0:
+            maxSplit = maxSplit[heavy]
+        counts = np.ones(len(w), dtype=int)
+        counts[heavy] = np.minimum(np.ceil(w[heavy]/upper), maxSplit)
+        w /= counts
+        photons.split(counts)
+    return (n, survivors)
+
+class ExponentialTransform:
+    """ Path lengths biased toward a direction (e.g. toward a deep region
+    of interest): the distance to the next interaction is sampled with
+    mu_t*(1 - p*cos), where cos is the cosine between the photon and the
+    direction, so photons going that way travel farther. The weight is
+    multiplied by the ratio of the true and biased probabilities of the
+    distance, which keeps every tally unbiased. 0 <= p < 1. """
+    def __init__(self, direction=UnitVector(0,0,1), p=0.5):
+        if not 0 <= p < 1:
+            raise ValueError("p must be between 0 and 1 (excluded)")
+        length = math.sqrt(direction.x*direction.x + direction.y*direction.y + direction.z*direction.z)
+        self.direction = UnitVector(direction.x/length, direction.y/length, direction.z/length)
+        self.p = p
+
+    def biasedAttenuation(self, mu_t, photon) -> float:
+        """ The attenuation used to sample the steps of photon """
+        ez = photon.ez
+        u = self.direction
+        return mu_t*(1 - self.p*(ez.x*u.x + ez.y*u.y + ez.z*u.z))
+
+    def correctWeight(self, photon, mu_t, biased, d, collides=True):
+        """ Multiply the weight of photon by the ratio of the true and
+        biased probabilities of a step of length d: ending with a
+        collision, or cut without one (at an interface, where the rest of
+        the step is carried to the next material) """
+        ratio = math.exp(-(mu_t-biased)*d)
+        photon.weight *= mu_t/biased*ratio if collides else ratio
+
+    def sampleDistance(self, mu_t, photon) -> float:
+        """ The distance to the next interaction of photon, whose weight
+        is corrected """
+        biased = self.biasedAttenuation(mu_t, photon)
+        d = -math.log(1.0 - photon.random())/biased
+        self.correctWeight(photon, mu_t, biased, d)
+        return d
+
+    def sampleDistances(self, mu_t, photons) -> np.ndarray:
+        ez = photons.ez
+        u = self.direction
+        biased = mu_t*(1 - self.p*(ez.x*u.x + ez.y*u.y + ez.z*u.z))
+        rnd = 1 - np.random.random(photons.count)
+        d = -np.log(rnd)/biased
+        photons.weight *= mu_t/biased*np.exp(-(mu_t-biased)*d)
+        return d
@@ -3,21 +3,21 @@ import math
 from collections import namedtuple
 
 class Vector:
+    """ A 3D vector. This is used for every step of every photon, so it is
+    kept as lean as possible: __slots__ (no __dict__), a constructor
+    without type dispatch (x, y and z can be numbers or arrays), no
+    isinstance() in any operation,
+    and in-place operators that do not create new vectors. """
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, x:float=0,y:float=0,z:float=0):
-        if isinstance(x, (int, float)):
-            self.x = x
-            self.y = y 
-            self.z = z
-        elif isinstance(x, Vector):
-            self.x = x.x
-            self.y = x.y 
-            self.z = x.z 
-        elif isinstance(x, np.ndarray):
-            self.x = x
-            self.y = y 
-            self.z = z
-        else:
-            raise ValueError("No valid input for Vector")
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def copy(self):
+        """ A new vector of the same type with the same components """
+        return type(self)(self.x, self.y, self.z)
 
     @property
     def isUnitary(self) -> bool:
@@ -32,8 +32,8 @@ class Vector:
     def __rmul__(self, scale):
         return Vector(self.x * scale, self.y * scale, self.z * scale)
 
-    def __div__(self, scale):
-        return self.v / scale
+    def __truediv__(self, scale):
+        return Vector(self.x / scale, self.y / scale, self.z / scale)
 
     def __add__(self, vector):
         return Vector(self.x + vector.x, self.y + vector.y, self.z + vector.z)
@@ -47,6 +47,30 @@ class Vector:
     def __rsub__(self, vector):
         return Vector(-self.x + vector.x, -self.y + vector.y, -self.z + vector.z)
 
+    def __iadd__(self, vector):
+        self.x += vector.x
+        self.y += vector.y
+        self.z += vector.z
+        return self
+
+    def __isub__(self, vector):
+        self.x -= vector.x
+        self.y -= vector.y
+        self.z -= vector.z
+        return self
+
+    def __imul__(self, scale):
+        self.x *= scale
+        self.y *= scale
+        self.z *= scale
+        return self
+
+    def addScaled(self, vector, scale):
+        """ self += vector * scale, without the intermediate vector """
+        self.x += vector.x * scale
+        self.y += vector.y * scale
+        self.z += vector.z * scale
+
     def isParallelTo(self, vector):
         return (self.normalizedDotProduct(vector) - 1 < 1e-6)
 
@@ -107,25 +131,23 @@ class Vector:
         return phi
 
     def rotateAround(self, u, theta):
-        # This is the most expensive (and most common)
-        # operation when performing Monte Carlo in tissue 
-        # (40% of time spent here). It is difficult to optimize without
-        # making it even less readable than it currently is
-        # http://en.wikipedia.org/wiki/Rotation_matrix
-        u.normalize()
+        """ Rotation by theta around the axis u (normalized here, u itself
+        is not changed). Photons scatter with spinFrameByCosines, this is
+        for any other rotation.
+        http://en.wikipedia.org/wiki/Rotation_matrix """
+        length = math.sqrt(u.x*u.x + u.y*u.y + u.z*u.z)
+        ux = u.x/length
+        uy = u.y/length
+        uz = u.z/length
 
         cost = math.cos(theta)
         sint = math.sin(theta)
         one_cost = 1 - cost
-        
-        ux = u.x
-        uy = u.y
-        uz = u.z
-        
+
         X = self.x
         Y = self.y
         Z = self.z
-        
+
         self.x = (cost     + ux*ux    * one_cost ) * X \
         +        (ux*uy    * one_cost - uz * sint) * Y \
         +        (ux * uz  * one_cost + uy * sint) * Z
@@ -165,40 +187,208 @@ class Vector:
         self.z = v.z
 
 class UnitVector(Vector):
-    def __init__(self, x:float=0,y:float=0,z:float=0):
-        Vector.__init__(self, x,y,z)
+    """ A Vector that is meant to have a norm of 1 (a direction). Its
+    norm is kept close to 1 by spinFrameByCosines, and exactly 1 by
+    orthonormalize. """
+    __slots__ = ()
+
+    def spinFrameBy(self, er, theta, phi):
+        """ Scattering of the frame (self, er), with self the direction of
+        propagation: er is rotated by phi around self, then self by theta
+        around the new er. This is the same as
+            er.rotateAround(self, phi)
+            self.rotateAround(er, theta)
+        but in one step (see spinFrameByCosines). """
+        self.spinFrameByCosines(er, math.cos(theta), math.sin(theta), phi)
+
+    def spinFrameByCosines(self, er, cost, sint, phi):
+        """ spinFrameBy with cos(theta) and sin(theta) instead of theta.
+        With el = self x er, the new vectors are
+            er' = cos(phi) er + sin(phi) el
+            ez' = cos(theta) ez + sin(theta) (sin(phi) er - cos(phi) el)
+        The norms are corrected to first order at every call (errors on
+        the norms would otherwise grow through el), and the frame must
+        be orthonormalized from time to time (see orthonormalize). """
+        cosp = math.cos(phi)
+        sinp = math.sin(phi)
+
+        zx = self.x
+        zy = self.y
+        zz = self.z
+        rx = er.x
+        ry = er.y
+        rz = er.z
+        lx = zy*rz - zz*ry
+        ly = zz*rx - zx*rz
+        lz = zx*ry - zy*rx
+
+        nx = cosp*rx + sinp*lx
+        ny = cosp*ry + sinp*ly
+        nz = cosp*rz + sinp*lz
+        # 1/sqrt(n) = (3-n)/2 for n close to 1, much cheaper than sqrt
+        scale = (3 - (nx*nx + ny*ny + nz*nz))/2
+        er.x = nx*scale
+        er.y = ny*scale
+        er.z = nz*scale
+
+        nx = cost*zx + sint*(sinp*rx - cosp*lx)
+        ny = cost*zy + sint*(sinp*ry - cosp*ly)
+        nz = cost*zz + sint*(sinp*rz - cosp*lz)
+        scale = (3 - (nx*nx + ny*ny + nz*nz))/2
+        self.x = nx*scale
+        self.y = ny*scale
+        self.z = nz*scale
+
+    def orthonormalize(self, er):
+        """ Correct the rounding errors accumulated by many spinFrameBy:
+        self is normalized and er is made perpendicular to self and
+        normalized, exactly """
+        length = math.sqrt(self.norm())
+        self.x /= length
+        self.y /= length
+        self.z /= length
+        projection = er.dot(self)
+        er.x -= projection*self.x
+        er.y -= projection*self.y
+        er.z -= projection*self.z
+        length = math.sqrt(er.norm())
+        er.x /= length
+        er.y /= length
+        er.z /= length
+
+class Vectors(Vector):
+    """ N vectors stored as three arrays x, y and z (structure of arrays).
+    All operations apply to the N vectors at once, with NumPy doing
+    the loop instead of Python. """
+    __slots__ = ()
+
+    def __init__(self, x=None, y=None, z=None, N:int=None):
+        if N is not None:
+            x = np.zeros(N) if x is None else np.full(N, x, dtype=float)
+            y = np.zeros(N) if y is None else np.full(N, y, dtype=float)
+            z = np.zeros(N) if z is None else np.full(N, z, dtype=float)
+        Vector.__init__(self, np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(z, dtype=float))
+
+    @property
+    def count(self) -> int:
+        return len(self.x)
+
+    def __str__(self):
+        return "{0} vectors".format(self.count)
+
+    def __getitem__(self, i):
+        return Vector(float(self.x[i]), float(self.y[i]), float(self.z[i]))
+
+    def __mul__(self, scale):
+        return Vectors(self.x * scale, self.y * scale, self.z * scale)
+
+    def __rmul__(self, scale):
+        return Vectors(self.x * scale, self.y * scale, self.z * scale)
+
+    def __add__(self, vector):
+        return Vectors(self.x + vector.x, self.y + vector.y, self.z + vector.z)
+
+    def __radd__(self, vector):
+        return Vectors(self.x + vector.x, self.y + vector.y, self.z + vector.z)
+
+    def __sub__(self, vector):
+        return Vectors(self.x - vector.x, self.y - vector.y, self.z - vector.z)
+
+    def __rsub__(self, vector):
+        return Vectors(-self.x + vector.x, -self.y + vector.y, -self.z + vector.z)
 
     def abs(self):
-        """ The sqrt() calculation is expensive. If it should
-        be unitary in the first place, so we use sqrt(1+x) = 1+x/2
-        with norm = 1 + x, or norm - 1 = x """
-        ux = self.x
-        uy = self.y
-        uz = self.z
-        return (ux*ux+uy*uy+uz*uz+1)/2
+        return np.sqrt(self.x*self.x+self.y*self.y+self.z*self.z)
 
     def cross(self, vector):
-        """ Accessing properties is costly when done very often.
-        cross product of unit vectors is a common operation """
         ux = self.x
         uy = self.y
         uz = self.z
         vx = vector.x
         vy = vector.y
         vz = vector.z
-        if isinstance(vector, UnitVector):
-            return UnitVector(uy*vz - uz*vy, uz*vx - ux*vz, ux*vy - uy*vx)
-        else:
-            return Vector(uy*vz - uz*vy, uz*vx - ux*vz, ux*vy - uy*vx)
+        return Vectors(uy*vz - uz*vy, uz*vx - ux*vz, ux*vy - uy*vx)
 
-    def normalizedCrossProduct(self, vector):
-        if isinstance(vector, UnitVector):
-            return self.cross(vector)
-        else:
-            return Vector.normalizedCrossProduct(self, vector)
+    def spinFrameByCosines(self, er, cost, sint, phi):
+        """ Same as UnitVector.spinFrameByCosines, for N frames with
+        N angles at once """
+        cosp = np.cos(phi)
+        sinp = np.sin(phi)
 
-    def normalizedDotProduct(self, vector):
-        if isinstance(vector, UnitVector):
-            return self.dot(vector)
-        else:
-            return Vector.normalizedDotProduct(self, vector)
+        zx = self.x
+        zy = self.y
+        zz = self.z
+        rx = er.x
+        ry = er.y
+        rz = er.z
+        lx = zy*rz - zz*ry
+        ly = zz*rx - zx*rz
+        lz = zx*ry - zy*rx
+
+        nx = cosp*rx + sinp*lx
+        ny = cosp*ry + sinp*ly
+        nz = cosp*rz + sinp*lz
+        scale = (3 - (nx*nx + ny*ny + nz*nz))/2
+        er.x = nx*scale
+        er.y = ny*scale
+        er.z = nz*scale
+
+        nx = cost*zx + sint*(sinp*rx - cosp*lx)
+        ny = cost*zy + sint*(sinp*ry - cosp*ly)
+        nz = cost*zz + sint*(sinp*rz - cosp*lz)
+        scale = (3 - (nx*nx + ny*ny + nz*nz))/2
+        self.x = nx*scale
+        self.y = ny*scale
+        self.z = nz*scale
+
+    def orthonormalize(self, er):
+        """ Same as UnitVector.orthonormalize, for N frames """
+        length = np.sqrt(self.norm())
+        self.x = self.x/length
+        self.y = self.y/length
+        self.z = self.z/length
+        projection = er.dot(self)
+        rx = er.x - projection*self.x
+        ry = er.y - projection*self.y
+        rz = er.z - projection*self.z
+        length = np.sqrt(rx*rx + ry*ry + rz*rz)
+        er.x = rx/length
+        er.y = ry/length
+        er.z = rz/length
+
+    def copy(self):
+        return Vectors(np.array(self.x), np.array(self.y), np.array(self.z))
+
+    def compress(self, mask):
+        """ Keep only the vectors where mask is True """
+        return Vectors(self.x[mask], self.y[mask], self.z[mask])
+
+    def repeat(self, counts):
+        """ Each vector repeated counts times """
+        return Vectors(np.repeat(self.x, counts), np.repeat(self.y, counts), np.repeat(self.z, counts))
+
+    def rotateAround(self, u, theta):
+        """ Same rotation as Vector.rotateAround, with one axis u and
+        one angle theta per vector """
+        length = np.sqrt(u.x*u.x + u.y*u.y + u.z*u.z)
+        ux = u.x/length
+        uy = u.y/length
+        uz = u.z/length
+
+        cost = np.cos(theta)
+        sint = np.sin(theta)
+        one_cost = 1 - cost
+
+        X = self.x
+        Y = self.y
+        Z = self.z
+
+        self.x = (cost     + ux*ux    * one_cost ) * X \
+        +        (ux*uy    * one_cost - uz * sint) * Y \
+        +        (ux * uz  * one_cost + uy * sint) * Z
+        self.y = (uy*ux    * one_cost + uz * sint) * X \
+        +        (cost     + uy*uy    * one_cost ) * Y \
+        +        (uy * uz  * one_cost - ux * sint) * Z
+        self.z = (uz*ux    * one_cost - uy * sint) * X \
+        +        (uz * uy  * one_cost + ux * sint) * Y \
+        +        (cost     + uz*uz    * one_cost ) * Z
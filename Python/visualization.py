@@ -0,0 +1,95 @@
+""" Drawing of the energy in a Stats with matplotlib. This module is only
+imported when something is drawn (Stats.show2D and Stats.show1D import
+it), so the simulation itself, and every worker process, only imports
+NumPy. """
+import numpy as np
+import matplotlib.pyplot as plt
+
+def show2D(stats, plane:str, cutAt:int= None, integratedAlong:str=None, title="", realtime=True):
+    if integratedAlong is None and cutAt is None:
+        raise ValueError("You must provide cutAt= or integratedAlong=")
+    elif integratedAlong is not None and cutAt is not None:
+        raise ValueError("You cannot provide both cutAt= and integratedAlong=")
+    elif integratedAlong is None and cutAt is not None:
+        if plane == 'xy':
+            cutAt = int((stats.size[2]-1)/2)
+        elif plane == 'yz':
+            cutAt = int((stats.size[0]-1)/2)
+        elif plane == 'xz':
+            cutAt = int((stats.size[1]-1)/2)
+
+    if stats.figure is None:
+        plt.ion()
+        stats.figure = plt.figure()
+
+    plt.title("Energy in {0}, {1} photons".format(plane, stats.photonCount))
+    if cutAt is not None:
+        if plane == 'xy':
+            plt.imshow(np.log(stats.energyAt(np.s_[:,:,cutAt])+0.0001),cmap='hsv',extent=[stats.min[0],stats.max[0],stats.min[1],stats.max[1]],aspect='auto')
+        elif plane == 'yz':
+            plt.imshow(np.log(stats.energyAt(np.s_[cutAt,:,:])+0.0001),cmap='hsv',extent=[stats.min[1],stats.max[1],stats.min[2],stats.max[2]],aspect='auto')
+        elif plane == 'xz':
+            plt.imshow(np.log(stats.energyAt(np.s_[:,cutAt,:])+0.0001),cmap='hsv',extent=[stats.min[0],stats.max[0],stats.min[2],stats.max[2]],aspect='auto')
+    else:
+        if plane == 'xy':
+            sum = stats.energySum(axis=2)
+            plt.imshow(np.log(sum+0.0001),cmap='hsv',extent=[stats.min[0],stats.max[0],stats.min[1],stats.max[1]],aspect='auto')
+        elif plane == 'yz':
+            sum = stats.energySum(axis=0)
+            plt.imshow(np.log(sum+0.0001),cmap='hsv',extent=[stats.min[1],stats.max[1],stats.min[2],stats.max[2]],aspect='auto')
+        elif plane == 'xz':
+            sum = stats.energySum(axis=1)
+            plt.imshow(np.log(sum+0.0001),cmap='hsv',extent=[stats.min[2],stats.max[2],stats.min[0],stats.max[0]],aspect='auto')
+
+    if realtime:
+        plt.show()
+        plt.pause(0.0001)
+        plt.clf()
+    else:
+        plt.ioff()
+        plt.show()
+
+def show1D(stats, axis:str, cutAt=None, integratedAlong=None, title="", realtime=True):
+    if integratedAlong is None and cutAt is None:
+        # Assume integral
+        raise ValueError("You should provide cutAt=(x0, x1) or integratedAlong='xy'.")
+    elif integratedAlong is not None and cutAt is not None:
+        raise ValueError("You cannot provide both cutAt= and integratedAlong=")
+    elif integratedAlong is None and cutAt is not None:
+        if axis == 'x':
+            cutAt = (int((stats.size[1]-1)/2),int((stats.size[2]-1)/2))
+        elif axis == 'y':
+            cutAt = (int((stats.size[0]-1)/2),int((stats.size[2]-1)/2))
+        elif axis == 'z':
+            cutAt = (int((stats.size[0]-1)/2),int((stats.size[1]-1)/2))
+
+    if stats.figure is None:
+        plt.ion()
+        stats.figure = plt.figure()
+
+    plt.title(title)
+    if cutAt is not None:
+        if axis == 'z':
+            plt.plot(stats.zCoords, np.log(stats.energyAt(np.s_[cutAt[0],cutAt[1],:])+0.0001),'ko--')
+        elif axis == 'y':
+            plt.plot(stats.yCoords, np.log(stats.energyAt(np.s_[cutAt[0],:,cutAt[1]])+0.0001),'ko--')
+        elif axis == 'x':
+            plt.plot(stats.xCoords, np.log(stats.energyAt(np.s_[:,cutAt[0],cutAt[1]])+0.0001),'ko--')
+    else:
+        if axis == 'z':
+            sum = stats.energySum(axis=(0,1))
+            plt.plot(stats.zCoords, np.log(sum+0.0001),'ko--')
+        elif axis == 'y':
+            sum = stats.energySum(axis=(0,2))
+            plt.plot(stats.yCoords, np.log(sum+0.0001),'ko--')
+        elif axis == 'x':
+            sum = stats.energySum(axis=(1,2))
+            plt.plot(stats.xCoords, np.log(sum+0.0001),'ko--')
+
+    if realtime:
+        plt.show()
+        plt.pause(0.0001)
+        plt.clf()
+    else:
+        plt.ioff()
+        plt.show()
@@ -0,0 +1,344 @@
+import numpy as np
+import math
+from vector import Vector
+from material import Material
+from variance import applyWeightWindows
+
+class VoxelVolume:
+    """ A heterogeneous medium given as a 3D array of labels (e.g. a
+    segmented anatomy), each label being the index of its Material in
+    materials (a list, or a dict {label: material}). Voxels are cubes of
+    side voxelSize, and origin is the corner of voxel (0, 0, 0): by
+    default, the volume is centered on the z axis below z = 0, so a
+    Photon() enters it at the center of its top face.
+
+    labels can be the path of a .npy file, which is memory-mapped instead
+    of read: the label map is then shared by the page cache, not copied
+    by every process, and a pickled VoxelVolume (e.g. sent to a worker)
+    only holds the path.
+
+    Photons are tracked with one of two methods:
+        tracking='delta': delta (Woodcock) tracking, steps sampled with
+            the largest mu_t of all materials and a collision that is real
+            with the probability mu_t/mu_max of the voxel where it lands,
+            without looking at the voxels in between.
+        tracking='dda': the voxels along the step are traversed one by one
+            (Amanatides-Woo) and the optical depth is spent voxel by voxel.
+    Delta tracking is faster when the materials have similar mu_t; DDA
+    when some labels are much less scattering than others (or are
+    clear, with mu_t = 0). Materials with an ExponentialTransform need
+    DDA: the optical depth is then spent with the biased attenuation of
+    each voxel, and the weight corrected voxel by voxel.
+
+    Indices are taken as matched: there is no reflection at the voxel
+    faces nor at the surface of the volume, the index only counts for the
+    time of flight (with delta tracking, the index of the voxel where a
+    step starts counts for the whole step). Photons that leave the volume
+    are summed in escaped and scored in exitTally (e.g. a Detector). """
+    def __init__(self, labels, materials, voxelSize, origin=None, tracking='delta', stats=None, exitTally=None):
+        self.filepath = None
+        if isinstance(labels, str):
+            self.filepath = labels
+            labels = np.load(labels, mmap_mode='r')
+        if labels.ndim != 3 or not np.issubdtype(labels.dtype, np.integer):
+            raise ValueError("labels must be a 3D array of integers")
+        if tracking not in ('delta', 'dda'):
+            raise ValueError("tracking must be 'delta' or 'dda'")
+
+        self.labels = labels
+        self.shape = labels.shape
+        self.voxelSize = voxelSize
+        if origin is None:
+            origin = Vector(-self.shape[0]*voxelSize/2, -self.shape[1]*voxelSize/2, 0)
+        self.origin = origin
+        self.tracking = tracking
+
+        if isinstance(materials, dict):
+            table = [None]*(max(materials)+1)
+            for label, material in materials.items():
+                table[label] = material
+            materials = table
+        self.materials = list(materials)
+        self.hasExponentialTransform = any(m is not None and m.exponentialTransform is not None for m in self.materials)
+        if self.hasExponentialTransform and tracking == 'delta':
+            raise ValueError("The exponential transform needs tracking='dda' (delta tracking samples with mu_max)")
+
+        # Lookup tables by label, for propagateMany (nan: no material)
+        def table(attribute):
+            return np.array([getattr(m, attribute) if m is not None else np.nan for m in self.materials])
+        self.muaTable = table('mu_a')
+        self.musTable = table('mu_s')
+        self.muszTable = table('mu_sz')
+        self.indexTable = table('index')
+        self.rouletteThresholdTable = table('rouletteThreshold')
+        self.rouletteChanceTable = table('rouletteChance')
+        def windowTable(attribute):
+            return np.array([getattr(m.weightWindow, attribute) if m is not None and m.weightWindow is not None
+                             else np.nan for m in self.materials])
+        self.lowerTable = windowTable('lower')
+        self.upperTable = windowTable('upper')
+        self.survivalWeightTable = windowTable('survivalWeight')
+        self.maxSplitTable = windowTable('maxSplit')
+        self.hasWeightWindows = not np.all(np.isnan(self.lowerTable))
+        self.mu_max = float(np.nanmax(self.muaTable + np.maximum(self.musTable, self.muszTable)))
+
+        self.stats = stats
+        self.exitTally = exitTally
+        for material in self.materials:
+            if material is not None:
+                material.stats = stats
+        self.reset()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if self.filepath is not None:
+            state['labels'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.filepath is not None:
+            self.labels = np.load(self.filepath, mmap_mode='r')
+
+    def reset(self):
+        self.photonCount = 0
+        self.absorbed = 0.0
+        self.escaped = 0.0
+
+    @property
+    def boundingBoxMin(self) -> Vector:
+        return Vector(self.origin.x, self.origin.y, self.origin.z)
+
+    @property
+    def boundingBoxMax(self) -> Vector:
+        s = self.voxelSize
+        return Vector(self.origin.x + self.shape[0]*s, self.origin.y + self.shape[1]*s, self.origin.z + self.shape[2]*s)
+
+    def materialOf(self, label) -> Material:
+        material = self.materials[label] if label < len(self.materials) else None
+        if material is None:
+            raise ValueError("No material for label {0}".format(label))
+        return material
+
+    def voxelAt(self, position):
+        """ Indices (i, j, k) of the voxel at position, None outside """
+        s = self.voxelSize
+        i = math.floor((position.x - self.origin.x)/s)
+        j = math.floor((position.y - self.origin.y)/s)
+        k = math.floor((position.z - self.origin.z)/s)
+        (nx, ny, nz) = self.shape
+        if 0 <= i < nx and 0 <= j < ny and 0 <= k < nz:
+            return (i, j, k)
+        return None
+
+    def labelAt(self, position):
+        """ Label of the voxel at position, None outside """
+        voxel = self.voxelAt(position)
+        return int(self.labels[voxel]) if voxel is not None else None
+
+    def labelsAt(self, positions) -> np.ndarray:
+        """ Labels at many positions (x, y and z arrays), all inside or on
+        the surface of the volume """
+        s = self.voxelSize
+        indices = []
+        for size, coordinates, o in zip(self.shape, (positions.x, positions.y, positions.z),
+                                        (self.origin.x, self.origin.y, self.origin.z)):
+            indices.append(np.clip(np.floor((coordinates - o)/s).astype(int), 0, size-1))
+        return np.asarray(self.labels[tuple(indices)])
+
+    def distanceToExit(self, position, direction) -> float:
+        """ Distance along direction from position (inside) to the
+        surface of the volume """
+        (low, high) = (self.boundingBoxMin, self.boundingBoxMax)
+        distance = math.inf
+        for r, u, low, high in zip((position.x, position.y, position.z), (direction.x, direction.y, direction.z),
+                                   (low.x, low.y, low.z), (high.x, high.y, high.z)):
+            if u > 0:
+                distance = min(distance, (high - r)/u)
+            elif u < 0:
+                distance = min(distance, (low - r)/u)
+        return max(distance, 0.0)
+
+    def distancesToExit(self, positions, directions) -> np.ndarray:
+        (low, high) = (self.boundingBoxMin, self.boundingBoxMax)
+        distance = np.full(len(positions.x), np.inf)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for r, u, low, high in zip((positions.x, positions.y, positions.z), (directions.x, directions.y, directions.z),
+                                       (low.x, low.y, low.z), (high.x, high.y, high.z)):
+                d = np.where(u > 0, (high - r)/u, np.where(u < 0, (low - r)/u, np.inf))
+                distance = np.minimum(distance, d)
+        return np.maximum(distance, 0.0)
+
+    def propagate(self, photon):
+        """ Propagate photon from where it is (it must be in the volume,
+        or it is counted as escaped right away) """
+        self.photonCount += 1
+        if self.stats is not None:
+            self.stats.countPhotons()
+        photons = [photon] # And the copies split by a WeightWindow
+        while photons:
+            photon = photons.pop()
+            while photon.isAlive:
+                if self.tracking == 'delta':
+                    label = self.deltaTrack(photon)
+                else:
+                    label = self.traverse(photon)
+
+                if label is None:
+                    self.recordExit(photon)
+                    photon.weight = 0
+                    break
+
+                material = self.materialOf(label)
+                self.absorbed += material.absorbEnergy(photon)
+                (cost, sint, phi) = material.getScatteringCosines(photon)
+                photon.scatterByCosines(cost, sint, phi)
+                photons.extend(material.roulette(photon))
+
+    def deltaTrack(self, photon):
+        """ Move photon to its next real collision, and return the label
+        where it is, or None if it left the volume (it is then on the
+        surface) """
+        mu_max = self.mu_max
+        while True:
+            label = self.labelAt(photon.r)
+            if label is None:
+                return None
+            index = self.materialOf(label).index
+            d = -math.log(1.0 - photon.random())/mu_max
+            distanceToExit = self.distanceToExit(photon.r, photon.ez)
+            if d >= distanceToExit:
+                photon.moveBy(distanceToExit, index)
+                return None
+
+            photon.moveBy(d, index)
+            label = self.labelAt(photon.r)
+            if label is None: # Rounding, on the surface
+                return None
+            if photon.random()*mu_max < self.materialOf(label).getAttenuation(photon):
+                return label
+
+    def traverse(self, photon):
+        """ Move photon to its next collision by walking the voxels along
+        its direction (Amanatides and Woo, 1987), and return the label
+        where it is, or None if it left the volume """
+        voxel = self.voxelAt(photon.r)
+        if voxel is None:
+            return None
+        opticalDepth = -math.log(1.0 - photon.random())
+
+        s = self.voxelSize
+        r = photon.r
+        u = photon.ez
+        ijk = list(voxel)
+        steps = [0, 0, 0]
+        tMax = [math.inf]*3 # Distance to the next face on each axis
+        tDelta = [math.inf]*3
+        for axis, (p, ua, o) in enumerate(zip((r.x, r.y, r.z), (u.x, u.y, u.z), (self.origin.x, self.origin.y, self.origin.z))):
+            if ua > 0:
+                steps[axis] = 1
+                tMax[axis] = (o + (ijk[axis]+1)*s - p)/ua
+                tDelta[axis] = s/ua
+            elif ua < 0:
+                steps[axis] = -1
+                tMax[axis] = (o + ijk[axis]*s - p)/ua
+                tDelta[axis] = -s/ua
+
+        t = 0.0
+        opticalLength = 0.0 # Index times distance
+        while True:
+            label = int(self.labels[tuple(ijk)])
+            material = self.materialOf(label)
+            mu_t = material.getAttenuation(photon)
+            transform = material.exponentialTransform
+            mu = mu_t if transform is None else transform.biasedAttenuation(mu_t, photon)
+            axis = tMax.index(min(tMax))
+            tNext = tMax[axis]
+            if opticalDepth <= mu*(tNext - t):
+                d = opticalDepth/mu
+                if transform is not None:
+                    transform.correctWeight(photon, mu_t, mu, d)
+                opticalLength += material.index*d
+                t += d
+                photon.moveBy(t, opticalLength/t) # Mean index along the step
+                return label
+
+            opticalDepth -= mu*(tNext - t)
+            if transform is not None:
+                transform.correctWeight(photon, mu_t, mu, tNext - t, collides=False)
+            opticalLength += material.index*(tNext - t)
+            t = tNext
+            ijk[axis] += steps[axis]
+            tMax[axis] += tDelta[axis]
+            if not 0 <= ijk[axis] < self.shape[axis]:
+                photon.moveBy(t, opticalLength/t if t > 0 else 1.0)
+                return None
+
+    def propagateMany(self, photons):
+        """ Propagate a batch of Photons with delta tracking, all the
+        photons at once: materials are looked up in the tables by label.
+        The roulette is the one of the material, or its weight window
+        (photons are split after the roulette). exitTally gets
+        scoreMany(photons, weights) with the photons that leave. The
+        exponential transform is not supported (see tracking). """
+        if self.hasExponentialTransform:
+            raise ValueError("The exponential transform is not supported by propagateMany")
+
+        mu_max = self.mu_max
+        self.photonCount += photons.count
+        if self.stats is not None:
+            self.stats.countPhotons(photons.count)
+        while photons.isAlive:
+            labels = self.labelsAt(photons.r)
+            d = -np.log(1 - np.random.random(photons.count))/mu_max
+            distanceToExit = self.distancesToExit(photons.r, photons.ez)
+            escaping = d >= distanceToExit
+            photons.moveBy(np.minimum(d, distanceToExit), self.indexTable[labels])
+            if np.any(escaping):
+                self.escaped += float(np.sum(photons.weight[escaping]))
+                if self.exitTally is not None:
+                    leaving = photons.compress(escaping)
+                    self.exitTally.scoreMany(leaving, leaving.weight)
+                photons.weight[escaping] = 0
+
+            labels = self.labelsAt(photons.r)
+            mu_a = self.muaTable[labels]
+            mu_s = self.musTable[labels]
+            mu_sz = self.muszTable[labels]
+            if np.any(np.isnan(mu_a)):
+                raise ValueError("No material for labels {0}".format(np.unique(labels[np.isnan(mu_a)])))
+            uz = photons.ez.z
+            mu_t = mu_a + np.sqrt(mu_s*mu_s*(1-uz*uz) + mu_sz*mu_sz*uz*uz)
+            real = (np.random.random(photons.count)*mu_max < mu_t) & ~escaping
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                delta = np.where(real, photons.weight*mu_a/mu_t, 0)
+            photons.decreaseWeightBy(delta)
+            self.absorbed += float(np.sum(delta))
+            if self.stats is not None:
+                self.stats.scoreMany(photons.r.compress(real), delta[real])
+
+            # Null collisions keep their direction (cos = 1)
+            cost = np.ones(photons.count)
+            sint = np.zeros(photons.count)
+            phi = np.zeros(photons.count)
+            for label in np.unique(labels[real]):
+                collided = real & (labels == label)
+                n = int(np.count_nonzero(collided))
+                (cost[collided], sint[collided]) = self.materials[label].phaseFunction.sampleCosines(np.random.random(n))
+                phi[collided] = np.random.random(n)*2*np.pi
+            photons.scatterByCosines(cost, sint, phi)
+
+            if self.hasWeightWindows:
+                windowed = ~np.isnan(self.lowerTable[labels])
+                photons.roulette(np.where(windowed, 0, self.rouletteThresholdTable[labels]), self.rouletteChanceTable[labels])
+                applyWeightWindows(photons, self.lowerTable[labels], self.upperTable[labels],
+                                   self.survivalWeightTable[labels], self.maxSplitTable[labels])
+            else:
+                photons.roulette(self.rouletteThresholdTable[labels], self.rouletteChanceTable[labels])
+            photons.removeDeadPhotons()
+
+    def recordExit(self, photon):
+        self.escaped += photon.weight
+        if self.exitTally is not None:
+            self.exitTally.score(photon, photon.weight)
@@ -0,0 +1,133 @@
+import numpy as np
+import math
+from layers import LayerStack
+from geometry import InfiniteLayer
+from material import Material
+from photon import Photon
+from vector import Vector
+
+class WhiteLayerStack(LayerStack):
+    """ A LayerStack that keeps the last exit (side, position, direction)
+    instead of summing it, for WhiteMonteCarlo """
+    def recordExit(self, photon, layer):
+        super().recordExit(photon, layer)
+        self.exit = (layer, photon.r.copy(), photon.ez.copy())
+
+class WhiteMonteCarlo:
+    """ Scaled ("white") Monte Carlo of a LayerStack: the transport is
+    done once without absorption, and the path length of every photon in
+    every layer is kept. The reflectance and transmittance for any
+    absorption coefficients are then given by Beer-Lambert, each photon
+    counting for exp(-sum(mua*L)), for a whole list of mua at once:
+
+        white = WhiteMonteCarlo(stack)
+        white.run(100000)
+        (Rd, Tt, A) = white.results([0.01, 0.1, 0.5, 1.0])
+
+    Only the absorption changes: the stack is copied with the same
+    scattering, phase functions and indices, and mu_a = 0.
+
+    Without absorption, photons only leave the stack by the surfaces,
+    which takes long in thick layers. With referenceMua (one per layer,
+    e.g. the smallest of the sweep), photons play roulette on the weight
+    they would have with it, and survivors carry the factor 1/chance: the
+    results stay unbiased for any mua, and precise for mua >= referenceMua. """
+    def __init__(self, stack, referenceMua=None, rouletteThreshold=1e-4, rouletteChance=0.1):
+        materials = []
+        for layer in stack.layers:
+            m = layer.material
+            materials.append(Material(mu_s=m.mu_s, mu_a=0, g=m.g, index=m.index,
+                                      phaseFunction=m.phaseFunction, mu_sz=m.mu_sz))
+        layers = [InfiniteLayer(layer.thickness, origin=Vector(0, 0, layer.boundingBoxMin.z), material=material)
+                  for layer, material in zip(stack.layers, materials)]
+        self.stack = WhiteLayerStack(layers, indexAbove=stack.indices[0], indexBelow=stack.indices[-1])
+        for material in materials:
+            material.stats = None
+
+        N = self.stack.layerCount
+        self.referenceMua = [0.0]*(N+2) if referenceMua is None else [0.0] + list(referenceMua) + [0.0]
+        self.rouletteThreshold = rouletteThreshold
+        self.rouletteChance = rouletteChance
+        self.reset()
+
+    def reset(self):
+        self.photonCount = 0
+        self.pathLengths = [] # One row per photon that exits: path length in each layer
+        self.exitSides = [] # 0 for reflectance, 1 for transmittance
+        self.exitRadii = []
+        self.exitWeights = [] # Launch weight and roulette factor
+
+    @property
+    def specularReflectance(self) -> float:
+        return self.stack.specularReflectance
+
+    def run(self, N):
+        stack = self.stack
+        referenceMua = self.referenceMua
+        useReference = any(mua > 0 for mua in referenceMua)
+        threshold = math.log(self.rouletteThreshold)
+        chance = self.rouletteChance
+
+        for i in range(N):
+            photon = Photon()
+            stack.launch(photon)
+            stack.exit = None
+            lengths = [0.0]*(stack.layerCount+2)
+            logWeight = 0.0 # log of the weight with referenceMua
+            factor = 1.0
+
+            while photon.isAlive:
+                layer = photon.layer
+                pathLength = photon.pathLength
+                stack.hopDropSpin(photon)
+                d = photon.pathLength - pathLength
+                lengths[layer] += d
+
+                if useReference and photon.isAlive:
+                    logWeight -= referenceMua[layer]*d
+                    if logWeight + math.log(factor) < threshold:
+                        if photon.random() < chance:
+                            factor /= chance
+                        else:
+                            photon.weight = 0
+
+            self.photonCount += 1
+            if stack.exit is not None:
+                (side, position, direction) = stack.exit
+                self.pathLengths.append(lengths[1:-1])
+                self.exitSides.append(0 if side == 0 else 1)
+                self.exitRadii.append(math.sqrt(position.x*position.x + position.y*position.y))
+                self.exitWeights.append((1-stack.specularReflectance)*factor)
+
+    def weights(self, muas) -> np.ndarray:
+        """ Weight of every exit for every set of absorption coefficients:
+        muas is M x layers (or a list of M values for a single layer) and
+        the result is exits x M """
+        muas = np.asarray(muas, dtype=float)
+        if muas.ndim == 1:
+            if self.stack.layerCount != 1:
+                raise ValueError("muas must be M x layers with more than one layer")
+            muas = muas[:, np.newaxis]
+        lengths = np.array(self.pathLengths).reshape(-1, self.stack.layerCount)
+        return np.array(self.exitWeights)[:, np.newaxis]*np.exp(-lengths @ muas.T)
+
+    def results(self, muas) -> (np.ndarray, np.ndarray, np.ndarray):
+        """ Diffuse reflectance, transmittance and absorbance for every set
+        of absorption coefficients (see weights) """
+        W = self.weights(muas)
+        reflected = np.array(self.exitSides) == 0
+        Rd = W[reflected].sum(axis=0)/self.photonCount
+        Tt = W[~reflected].sum(axis=0)/self.photonCount
+        A = 1 - self.specularReflectance - Rd - Tt
+        return (Rd, Tt, A)
+
+    def radialProfiles(self, muas, nr, dr, side=0) -> np.ndarray:
+        """ Rd_r (side=0) or Tt_r (side=1) [1/cm2] as in the .mco files,
+        one row per set of absorption coefficients """
+        W = self.weights(muas)
+        exits = np.array(self.exitSides) == side
+        rings = np.minimum((np.array(self.exitRadii)[exits]/dr).astype(int), nr-1)
+        profiles = np.zeros((nr, W.shape[1]))
+        np.add.at(profiles, rings, W[exits])
+        areas = 2*np.pi*(np.arange(nr)+0.5)*dr*dr
+        return (profiles/(areas[:, np.newaxis]*self.photonCount)).T